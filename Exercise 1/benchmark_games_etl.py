@@ -0,0 +1,148 @@
+# Compare the vectorized transforms of games_etl.py with the row-wise cells of Games_Data_Processing.ipynb
+# on a synthetic games table.
+#
+# Usage:
+#   python benchmark_games_etl.py --rows 10000000 --output games_etl_benchmark.json
+#
+# Transforms measured (the notebook version first, then games_etl):
+#   split_lists     Categories/Genres/Tags strings to lowercase lists without duplicates
+#   estimate_owners middle of the 'low - high' Estimated owners ranges
+#   genre_metrics   silver -> gold genre metrics (CSV silver with ast.literal_eval + explode,
+#                   against the Parquet silver list column)
+# Both versions of a transform are checked to give the same result before they are timed.
+import argparse
+import ast
+import json
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from games_etl import LIST_COLUMNS, estimate_owners, genre_metrics, split_list_column
+
+GENRES = ['Action', 'Indie', 'Adventure', 'Casual', 'RPG', 'Strategy', 'Simulation', 'Sports', 'Racing',
+          'Free to Play', 'Early Access', 'Massively Multiplayer']
+OWNER_RANGES = ['0 - 20000', '20000 - 50000', '50000 - 100000', '100000 - 200000', '200000 - 500000',
+                '500000 - 1000000', '1000000 - 2000000', '2000000 - 5000000', '5000000 - 10000000']
+
+
+def make_games(rows, seed=0):
+    # Columns of the bronze table used by the transforms, built from a few hundred distinct values
+    # so that generating 10M rows stays fast
+    rng = np.random.default_rng(seed)
+    combinations = np.array([', '.join(rng.choice(GENRES, size=rng.integers(1, 5), replace=False)) for _ in range(500)],
+                            dtype=object)
+    lists = {column: combinations[rng.integers(0, len(combinations), rows)] for column in LIST_COLUMNS}
+    for values in lists.values():
+        values[rng.random(rows) < 0.02] = np.nan  # missing lists
+    return pd.DataFrame(dict(lists, **{
+        'AppID': np.arange(rows),
+        'Estimated owners': np.array(OWNER_RANGES, dtype=object)[rng.integers(0, len(OWNER_RANGES), rows)],
+        'Price': rng.choice([0, 4.99, 9.99, 19.99, 59.99], rows),
+        'Positive': rng.integers(0, 10000, rows),
+        'Negative': rng.integers(0, 2000, rows),
+        'Average playtime forever': rng.integers(0, 3000, rows)
+    }))
+
+
+# The cells of the notebook
+
+def split_lists_rowwise(series):
+    lists = series.apply(lambda x: [item.strip().lower() for item in x.split(',')] if isinstance(x, str) and not pd.isnull(x) else [])
+    return lists.apply(lambda x: list(set(x)))
+
+
+def estimate_owners_range(owners_range):
+    if pd.isnull(owners_range):
+        return np.nan
+    try:
+        low, high = owners_range.split(' - ')
+        low = int(low.replace(',', '').strip())
+        high = int(high.replace(',', '').strip())
+        return (low + high) / 2
+    except:
+        return np.nan
+
+
+def genre_metrics_rowwise(silver_csv_df):
+    gold_genre_df = silver_csv_df.copy()
+    gold_genre_df["Genres"] = gold_genre_df["Genres"].apply(ast.literal_eval)
+    gold_genre_df = gold_genre_df.explode('Genres')
+    gold_genre_df = gold_genre_df.dropna(subset=['Genres'])
+    gold_genre_df['Total_Reviews'] = gold_genre_df['Positive'] + gold_genre_df['Negative']
+    gold_genre_df['Total_Reviews'] = gold_genre_df['Total_Reviews'].replace(0, np.nan)
+    gold_genre_df['Positive_Review_Rate'] = gold_genre_df['Positive'] / gold_genre_df['Total_Reviews']
+    gold_genre_df['Positive_Review_Rate'] = gold_genre_df['Positive_Review_Rate'].fillna(0)
+    gold_genre_df['Estimated_Owners'] = gold_genre_df['Estimated owners'].apply(estimate_owners_range)
+    gold_genre_df['Price'] = pd.to_numeric(gold_genre_df['Price'], errors='coerce').fillna(0)
+    gold_genre_df['Estimated_Owners'] = gold_genre_df['Estimated_Owners'].fillna(0)
+    gold_genre_df['Total_Revenue'] = gold_genre_df['Estimated_Owners'] * gold_genre_df['Price']
+    genre_metrics = gold_genre_df.groupby('Genres').agg(
+        Average_Playtime_Forever=('Average playtime forever', 'mean'),
+        Average_Positive_Review_Rate=('Positive_Review_Rate', 'mean'),
+        Total_Estimated_Players=('Estimated_Owners', 'sum'),
+        Total_Revenue=('Total_Revenue', 'sum'),
+        Number_of_Games=('AppID', 'count')
+    ).reset_index()
+    genre_metrics = genre_metrics.round({
+        'Average_Positive_Review_Rate': 4,
+        'Total_Estimated_Players': 0,
+        'Total_Revenue': 2
+    })
+    genre_metrics = genre_metrics[(genre_metrics['Number_of_Games'] >= 10) & (genre_metrics['Average_Playtime_Forever'] > 0) & (genre_metrics['Total_Estimated_Players'] > 0)]
+    return genre_metrics.sort_values('Total_Revenue', ascending=False)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def compare(name, rowwise, vectorized, results):
+    results[name] = {'rowwise_seconds': round(rowwise, 3), 'vectorized_seconds': round(vectorized, 3),
+                     'speedup': round(rowwise / vectorized, 1)}
+    print(f"{name:<16} {rowwise:>12.2f} {vectorized:>14.2f} {rowwise / vectorized:>8.1f}x")
+
+
+def run(rows):
+    print(f"Generating {rows} games...")
+    games = make_games(rows)
+    results = {'rows': rows}
+    print(f"{'transform':<16} {'row-wise s':>12} {'vectorized s':>14} {'speedup':>9}")
+
+    rowwise_lists, rowwise_seconds = timed(lambda: {column: split_lists_rowwise(games[column]) for column in LIST_COLUMNS})
+    lists, vectorized_seconds = timed(lambda: {column: split_list_column(games[column]) for column in LIST_COLUMNS})
+    for column in LIST_COLUMNS:
+        assert [sorted(x) for x in rowwise_lists[column]] == [sorted(x) for x in lists[column].to_pylist()]
+    compare('split_lists', rowwise_seconds, vectorized_seconds, results)
+
+    rowwise_owners, rowwise_seconds = timed(lambda: games['Estimated owners'].apply(estimate_owners_range))
+    owners, vectorized_seconds = timed(estimate_owners, games['Estimated owners'])
+    np.testing.assert_allclose(rowwise_owners.to_numpy(dtype='float64'), owners.to_numpy())
+    compare('estimate_owners', rowwise_seconds, vectorized_seconds, results)
+
+    # The notebook re-reads the silver layer from CSV, where the lists are written as their repr
+    silver_csv = games.drop(columns=LIST_COLUMNS).assign(Genres=rowwise_lists['Genres'].map(repr))
+    silver = pa.Table.from_pandas(games.drop(columns=LIST_COLUMNS), preserve_index=False)
+    silver = silver.append_column('Genres', lists['Genres'])
+    del rowwise_lists, rowwise_owners
+
+    rowwise_metrics, rowwise_seconds = timed(genre_metrics_rowwise, silver_csv)
+    metrics, vectorized_seconds = timed(genre_metrics, silver)
+    pd.testing.assert_frame_equal(rowwise_metrics.reset_index(drop=True), metrics, check_dtype=False)
+    compare('genre_metrics', rowwise_seconds, vectorized_seconds, results)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the vectorized Games ETL against the notebook cells.")
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.rows)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,415 @@
+# Bronze -> silver -> gold pipeline of the Games dataset, the steps of Games_Data_Processing.ipynb
+# with every transform vectorized over whole columns instead of applied row by row.
+#
+# Usage:
+#   python games_etl.py silver              bronze/games.csv -> silver/games/
+#   python games_etl.py genre_metrics       silver/games/ -> gold/games_genre_metrics/
+#   python games_etl.py yearly_revenue      silver/games/ -> gold/games_yearly_revenue/
+#   python games_etl.py all [--force]       the three stages in order
+#   python games_etl.py all --verify        ... then check the gold states against a full recomputation
+#
+# Every stage reads its input layer and writes its output layer with medallion.py, so it can be
+# rerun on its own. A stage is skipped when its output was built from the same input files by the
+# same version of the stage (see STAGE_VERSION), --force rebuilds it anyway.
+# The gold stages are incremental: only the games that changed in silver since their last run are
+# folded into their partial aggregates (see run_gold). They start from scratch after a change of
+# STAGE_VERSION or with --force.
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from medallion import encode_dictionaries, read_table, table_path, write_frame, write_table
+
+# Increase when a stage changes, so the outputs built by the previous version are rebuilt
+STAGE_VERSION = 2
+
+# Manifest of a built table, stored in its dataset directory (files starting with '_' are not read as data)
+STAGE_MANIFEST = '_stage.json'
+
+# Columns with a high rate of missing values, dropped in the silver layer
+DROPPED_COLUMNS = ['Reviews', 'Website', 'Support url', 'Metacritic url', 'Score rank', 'Notes']
+NUMERIC_COLUMNS = ['AppID', 'Peak CCU', 'Required age', 'Price', 'Achievements', 'Positive', 'Negative',
+                   'Average playtime forever', 'Average playtime two weeks', 'Median playtime forever',
+                   'Median playtime two weeks', 'Recommendations']
+BOOLEAN_COLUMNS = ['Windows', 'Mac', 'Linux']
+PLACEHOLDERS = {'About the game': 'Not Provided', 'Support email': 'Not Provided', 'Screenshots': 'Not Provided'}
+MISSING_RELEASE_DATE = '1950-01-01'
+
+# Comma separated 'words', stored as lowercase lists without duplicates
+LIST_COLUMNS = ['Categories', 'Genres', 'Tags']
+
+# 'Estimated owners' is a range such as '20,000 - 50,000'
+OWNERS_PATTERN = r'^\s*([\d,]+)\s*-\s*([\d,]+)\s*$'
+
+# Genres with fewer games are left out of the genre metrics
+MIN_GENRE_GAMES = 10
+
+# Relative tolerance of --verify between the incremental gold states and a full recomputation
+VERIFY_TOLERANCE = 1e-9
+
+# Columns of the silver layer read by the gold stages
+GENRE_METRIC_COLUMNS = ['AppID', 'Genres', 'Average playtime forever', 'Positive', 'Negative', 'Estimated owners', 'Price']
+REVENUE_COLUMNS = ['AppID', 'Release date', 'Estimated owners', 'Price']
+
+
+def fix_column_shift(df):
+    # The values from 'DiscountDLC count' on are one column to the right of their header
+    columns = df.columns[df.columns.get_loc('DiscountDLC count'):]
+    df[columns[:-1]] = df[columns[1:]].values
+    return df.drop(columns=columns[-1])
+
+
+def split_words(strings):
+    # 'Action, Indie,action' -> ['action', 'indie'] for an Arrow string array, nulls -> [].
+    # The split, lowercasing and trimming run in Arrow, the duplicates are removed by sorting the
+    # (row, word) pairs with NumPy.
+    lists = pc.split_pattern(pc.utf8_lower(strings), ',')
+    words = pc.utf8_trim_whitespace(pc.list_flatten(lists))
+    rows = pc.list_parent_indices(lists).to_numpy()
+    encoded = pc.dictionary_encode(words)
+    # Codes ranked in alphabetical order of the words, so every list comes out sorted
+    alphabetical = pc.array_sort_indices(encoded.dictionary).to_numpy()
+    ranks = np.empty(len(alphabetical), dtype=np.int64)
+    ranks[alphabetical] = np.arange(len(alphabetical))
+    codes = ranks[encoded.indices.to_numpy()]
+    dictionary = encoded.dictionary.take(pa.array(alphabetical))
+
+    order = np.lexsort((codes, rows))
+    rows, codes = rows[order], codes[order]
+    keep = pc.not_equal(words, '').to_numpy(zero_copy_only=False)[order]
+    keep[1:] &= (rows[1:] != rows[:-1]) | (codes[1:] != codes[:-1])
+    rows, codes = rows[keep], codes[keep]
+
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(strings)))])
+    return pa.ListArray.from_arrays(pa.array(offsets, type=pa.int32()), dictionary.take(pa.array(codes)))
+
+
+def split_list_column(series):
+    # Comma separated strings to an Arrow ListArray of lowercase words without duplicates, missing values -> [].
+    # The same strings repeat a lot (genre combinations), so every distinct string is split once
+    # and the lists are repeated with the codes of pd.factorize.
+    codes, distinct = pd.factorize(series)
+    strings = pa.array(pd.Series(distinct, dtype=object).astype('string'), type=pa.string())
+    lists = split_words(pa.concat_arrays([strings, pa.nulls(1, pa.string())]))
+    codes[codes < 0] = len(distinct)  # missing values take the empty list of the appended null
+    return lists.take(pa.array(codes))
+
+
+def estimate_owners(series):
+    # Middle of the 'low - high' owner ranges, NaN for values that are not a range.
+    # There are only a few distinct ranges: every one is parsed once and mapped back with its code.
+    codes, distinct = pd.factorize(series)
+    bounds = pd.Series(distinct, dtype=object).astype('string').str.extract(OWNERS_PATTERN)
+    low = pd.to_numeric(bounds[0].str.replace(',', '', regex=False), errors='coerce')
+    high = pd.to_numeric(bounds[1].str.replace(',', '', regex=False), errors='coerce')
+    estimates = ((low + high) / 2).to_numpy(dtype='float64', na_value=np.nan)
+    return pd.Series(np.where(codes >= 0, estimates[codes], np.nan), index=series.index)
+
+
+def bronze_to_silver(df):
+    # Clean the bronze DataFrame, returns the silver Arrow Table
+    df = fix_column_shift(df)
+    df = df.drop(columns=DROPPED_COLUMNS).dropna(subset=['Name'])
+    df['Release date'] = pd.to_datetime(df['Release date'], errors='coerce', format='mixed').fillna(
+        pd.Timestamp(MISSING_RELEASE_DATE))
+    df['Release_Year'] = df['Release date'].dt.year.astype('Int64')
+    df = df.fillna(PLACEHOLDERS)
+    df[NUMERIC_COLUMNS] = df[NUMERIC_COLUMNS].apply(pd.to_numeric, errors='coerce')
+    df[BOOLEAN_COLUMNS] = df[BOOLEAN_COLUMNS].astype(bool)
+    df = df.drop_duplicates(subset='AppID').reset_index(drop=True)
+
+    lists = {column: split_list_column(df[column]) for column in LIST_COLUMNS}
+    table = pa.Table.from_pandas(encode_dictionaries(df.drop(columns=LIST_COLUMNS)), preserve_index=False)
+    for column, values in lists.items():
+        table = table.append_column(column, values)
+    return table
+
+
+def column_to_numpy(table, column, fill=np.nan):
+    return table[column].to_pandas().astype('float64').fillna(fill).to_numpy()
+
+
+def genre_partials(games):
+    # Mergeable partial aggregates per genre of a table of games with GENRE_METRIC_COLUMNS: sums and counts
+    # only, so the partials of two sets of games add up to the partials of their union (see merge_partials).
+    # Every game is counted in each of its genres: the per-game values are repeated with the
+    # parent indices of the flattened Genres lists instead of exploding a DataFrame.
+    genres = games['Genres'].combine_chunks()
+    parents = pc.list_parent_indices(genres).to_numpy()
+
+    positive, negative = column_to_numpy(games, 'Positive'), column_to_numpy(games, 'Negative')
+    total_reviews = positive + negative
+    review_rate = np.divide(positive, total_reviews, out=np.zeros_like(positive), where=total_reviews > 0)
+    owners = estimate_owners(games['Estimated owners'].to_pandas()).fillna(0).to_numpy()
+    revenue = owners * column_to_numpy(games, 'Price', fill=0)
+    playtime = column_to_numpy(games, 'Average playtime forever')[parents]
+
+    per_genre = pd.DataFrame({
+        'Genres': pc.dictionary_encode(pc.list_flatten(genres)).to_pandas(),
+        'rows': 1,
+        'games': ~np.isnan(column_to_numpy(games, 'AppID')[parents]),
+        'playtime_sum': np.nan_to_num(playtime),
+        'playtime_count': ~np.isnan(playtime),
+        'review_rate_sum': review_rate[parents],
+        'owners_sum': owners[parents],
+        'revenue_sum': revenue[parents]
+    })
+    partials = per_genre.groupby('Genres', observed=True).sum()
+    partials.index = partials.index.astype(str)
+    return partials
+
+
+def finalize_genre_metrics(partials):
+    # Player retention, reputation and revenue per genre from the partials of all the games
+    partials = partials.reset_index()
+    metrics = pd.DataFrame({
+        'Genres': partials['Genres'],
+        'Average_Playtime_Forever': partials['playtime_sum'] / partials['playtime_count'].replace(0, np.nan),
+        'Average_Positive_Review_Rate': partials['review_rate_sum'] / partials['rows'],
+        'Total_Estimated_Players': partials['owners_sum'],
+        'Total_Revenue': partials['revenue_sum'],
+        'Number_of_Games': partials['games'].astype('int64')
+    })
+    metrics = metrics.round({'Average_Positive_Review_Rate': 4, 'Total_Estimated_Players': 0, 'Total_Revenue': 2})
+
+    # Genres with less than 10 games, with average playtime at 0 or total estimated players at 0 are left out
+    metrics = metrics[(metrics['Number_of_Games'] >= MIN_GENRE_GAMES) & (metrics['Average_Playtime_Forever'] > 0)
+                      & (metrics['Total_Estimated_Players'] > 0)]
+    return metrics.sort_values('Total_Revenue', ascending=False).reset_index(drop=True)
+
+
+def genre_metrics(silver):
+    # Full computation of the genre metrics from a silver table with GENRE_METRIC_COLUMNS
+    return finalize_genre_metrics(genre_partials(silver))
+
+
+def yearly_partials(games):
+    # Mergeable partial aggregates per release year of a table of games with REVENUE_COLUMNS
+    owners = estimate_owners(games['Estimated owners'].to_pandas()).to_numpy()
+    revenue = owners * column_to_numpy(games, 'Price')
+    per_year = pd.DataFrame({
+        'Release_Year': pd.to_datetime(games['Release date'].to_pandas(), errors='coerce').dt.year,
+        'rows': 1,
+        'games': ~np.isnan(column_to_numpy(games, 'AppID')),
+        'revenue_sum': np.nan_to_num(revenue),
+        'owners_sum': np.nan_to_num(owners)
+    }).dropna(subset=['Release_Year'])
+    partials = per_year.groupby('Release_Year').sum()
+    partials.index = partials.index.astype('int64')
+    return partials
+
+
+def finalize_yearly_revenue(partials):
+    # Estimated revenue, owners and number of games per release year from the partials of all the games
+    partials = partials.reset_index()
+    revenue = pd.DataFrame({
+        'Release_Year': partials['Release_Year'],
+        'Total_Estimated_Revenue': partials['revenue_sum'],
+        'Total_Estimated_Owners': partials['owners_sum'],
+        'Number_of_Games': partials['games'].astype('int64')
+    }).sort_values('Release_Year')
+    # Drop years with 0 total estimated owners
+    return revenue[revenue['Total_Estimated_Owners'] > 0].reset_index(drop=True)
+
+
+def yearly_revenue(silver):
+    # Full computation of the yearly revenue from a silver table with REVENUE_COLUMNS
+    return finalize_yearly_revenue(yearly_partials(silver))
+
+
+def merge_partials(state, added, removed):
+    # Fold the partials of new or changed games in and the partials of their previous version out.
+    # Keys left without any game are dropped.
+    merged = pd.concat([state, added, -removed]).groupby(level=0).sum()
+    return merged[merged['rows'] > 0]
+
+
+def game_digests(games):
+    # One hash per game of the columns an aggregate reads, to find the games that changed
+    columns = {}
+    for name in games.column_names:
+        column = games[name]
+        if pa.types.is_list(column.type):
+            column = pc.binary_join(column, '\x1f')  # the lists are sorted, see split_words
+        columns[name] = column.to_pandas()
+    return pd.util.hash_pandas_object(pd.DataFrame(columns), index=False).to_numpy()
+
+
+def fingerprint(path):
+    # Size and modification time of a file, or of every data file of a dataset directory
+    if os.path.isfile(path):
+        files = [path]
+    else:
+        files = sorted(os.path.join(directory, file_name) for directory, _, file_names in os.walk(path)
+                       for file_name in file_names if not file_name.startswith(('_', '.')))
+    stats = [(os.path.relpath(file, path), os.path.getsize(file), os.path.getmtime(file)) for file in files]
+    return hashlib.sha1(json.dumps(stats).encode('utf-8')).hexdigest()
+
+
+def stage_key(stage, inputs):
+    return {'stage': stage, 'version': STAGE_VERSION, 'inputs': {path: fingerprint(path) for path in inputs}}
+
+
+def is_up_to_date(outputs, key):
+    for output in outputs:
+        manifest = os.path.join(output, STAGE_MANIFEST)
+        if not os.path.exists(manifest):
+            return False
+        with open(manifest) as f:
+            if json.load(f) != key:
+                return False
+    return True
+
+
+def run_stage(stage, inputs, outputs, build, force=False):
+    # Build the outputs of a stage unless they are up to date, then record what they were built from
+    for path in inputs:
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Input of stage '{stage}' not found: {path}, run the previous stage first")
+    key = stage_key(stage, inputs)
+    if not force and is_up_to_date(outputs, key):
+        print(f"Stage '{stage}' is up to date, skipped.")
+        return False
+    build()
+    for output in outputs:
+        with open(os.path.join(output, STAGE_MANIFEST), 'w') as f:
+            json.dump(key, f, indent=2)
+    print(f"Stage '{stage}' done.")
+    return True
+
+
+def run_silver(root, force=False):
+    bronze_file = os.path.join(root, 'bronze', 'games.csv')
+    silver_dir = os.path.join(root, 'silver')
+
+    def build():
+        silver = bronze_to_silver(pd.read_csv(bronze_file, index_col=False))
+        write_table(silver, silver_dir, 'games', partition_cols=['Release_Year'])
+
+    return run_stage('silver', [bronze_file], [table_path(silver_dir, 'games')], build, force)
+
+
+def read_manifest(output):
+    manifest = os.path.join(output, STAGE_MANIFEST)
+    if not os.path.exists(manifest):
+        return None
+    with open(manifest) as f:
+        return json.load(f)
+
+
+def diff_games(games, digests, snapshot):
+    # Positions of the games of 'games' that are not in the snapshot of the previous run (new or changed),
+    # and of the snapshot games that are no longer in 'games' (removed or changed).
+    # Identical games are matched by digest and occurrence, so the games are compared as multisets.
+    new = pd.DataFrame({'digest': digests})
+    old = pd.DataFrame({'digest': snapshot['digest'].to_numpy()})
+    new['occurrence'] = new.groupby('digest').cumcount()
+    old['occurrence'] = old.groupby('digest').cumcount()
+    matched = new.reset_index().merge(old.reset_index(), on=['digest', 'occurrence'], how='outer',
+                                      suffixes=('_new', '_old'), indicator=True)
+    added = matched.loc[matched['_merge'] == 'left_only', 'index_new'].astype('int64').to_numpy()
+    removed = matched.loc[matched['_merge'] == 'right_only', 'index_old'].astype('int64').to_numpy()
+    return np.sort(added), np.sort(removed)
+
+
+def load_gold_state(gold_dir, name, key):
+    # Partial aggregates and snapshot of the games they were computed from, None when they have to be
+    # computed from scratch: first run, or state written by another version of the stage (schema change)
+    state_dir = table_path(gold_dir, f'{name}_state')
+    snapshot_dir = table_path(gold_dir, f'{name}_games')
+    manifest = read_manifest(state_dir)
+    if manifest is None or manifest['version'] != STAGE_VERSION or not os.path.isdir(snapshot_dir):
+        return None, None
+    state = read_table(gold_dir, f'{name}_state').to_pandas().set_index(key)
+    state.index = state.index.astype(str if key == 'Genres' else 'int64')
+    return state, read_table(gold_dir, f'{name}_games')
+
+
+def run_gold(root, stage, partials, finalize, key, columns, force=False):
+    # Gold tables are kept as mergeable partial aggregates (gold/games_<stage>_state/) next to a snapshot
+    # of the silver rows they were computed from (gold/games_<stage>_games/). A run only folds in the
+    # partials of the games added or changed since the snapshot and folds out those of the games removed
+    # or replaced, then finalizes the state into the gold table.
+    silver_dir, gold_dir = os.path.join(root, 'silver'), os.path.join(root, 'gold')
+    name = f'games_{stage}'
+
+    def build():
+        games = read_table(silver_dir, 'games', columns=columns)
+        digests = game_digests(games)
+        state, snapshot = (None, None) if force else load_gold_state(gold_dir, name, key)
+        if state is None:
+            print(f"Computing '{name}' from all the {games.num_rows} games...")
+            state = partials(games)
+        else:
+            added, removed = diff_games(games, digests, snapshot)
+            print(f"Updating '{name}': {len(added)} games added or changed, {len(removed)} removed or replaced...")
+            state = merge_partials(state, partials(games.take(pa.array(added))),
+                                   partials(snapshot.select(columns).take(pa.array(removed))))
+
+        write_frame(state.reset_index(), gold_dir, f'{name}_state')
+        write_table(games.append_column('digest', pa.array(digests)), gold_dir, f'{name}_games')
+        # The gold tables are written with a CSV copy for the analysis of Exercise 4
+        write_frame(finalize(state), gold_dir, name, csv=True)
+
+    outputs = [table_path(gold_dir, f'{name}_state'), table_path(gold_dir, f'{name}_games'), table_path(gold_dir, name)]
+    return run_stage(stage, [table_path(silver_dir, 'games')], outputs, build, force)
+
+
+def verify_gold(root, stage):
+    # Compare the incremental state of a gold stage with its partial aggregates computed from all the
+    # silver games. Sums of floats folded in and out over many runs may differ in the last digits.
+    silver_dir, gold_dir = os.path.join(root, 'silver'), os.path.join(root, 'gold')
+    name = f'games_{stage}'
+    partials, _, key, columns = GOLD_STAGES[stage]
+    state, _ = load_gold_state(gold_dir, name, key)
+    if state is None:
+        print(f"'{name}' has no incremental state, run the stage first.")
+        return False
+    expected = partials(read_table(silver_dir, 'games', columns=columns))
+    try:
+        pd.testing.assert_frame_equal(state.sort_index(), expected.sort_index(), check_dtype=False,
+                                      check_index_type=False, check_names=False, rtol=VERIFY_TOLERANCE)
+    except AssertionError as e:
+        print(f"'{name}' differs from a full recomputation:\n{e}")
+        return False
+    print(f"'{name}' matches a full recomputation ({len(state)} keys).")
+    return True
+
+
+# Gold stages: stage -> (partials, finalize, key of the partials, silver columns)
+GOLD_STAGES = {
+    'genre_metrics': (genre_partials, finalize_genre_metrics, 'Genres', GENRE_METRIC_COLUMNS),
+    'yearly_revenue': (yearly_partials, finalize_yearly_revenue, 'Release_Year', REVENUE_COLUMNS)
+}
+
+STAGES = dict({'silver': run_silver}, **{
+    stage: lambda root, force, stage=stage: run_gold(root, stage, *GOLD_STAGES[stage], force=force)
+    for stage in GOLD_STAGES
+})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the bronze -> silver -> gold pipeline of the Games dataset.")
+    parser.add_argument('stage', choices=list(STAGES) + ['all'])
+    parser.add_argument('--root', default=os.path.dirname(os.path.abspath(__file__)),
+                        help="Directory containing the bronze, silver and gold layers")
+    parser.add_argument('--force', action='store_true',
+                        help="Rebuild the stages even if they are up to date, and the gold states from scratch")
+    parser.add_argument('--verify', action='store_true',
+                        help="Check the incremental gold states against a full recomputation")
+    args = parser.parse_args()
+
+    stages = list(STAGES) if args.stage == 'all' else [args.stage]
+    for stage in stages:
+        STAGES[stage](args.root, args.force)
+    if args.verify:
+        results = [verify_gold(args.root, stage) for stage in stages if stage in GOLD_STAGES]
+        if not all(results):
+            sys.exit(1)
@@ -0,0 +1,66 @@
+# Storage of the bronze -> silver -> gold layers of the Games pipeline as Parquet datasets.
+#
+# Every table is a directory <layer directory>/<name>/ of Parquet files, optionally partitioned
+# (hive style, e.g. silver/games/Release_Year=2020/). Compared with the CSV files:
+#   - list columns (Genres, Tags, Categories) are stored as native lists, no ast.literal_eval on read
+#   - repetitive strings are dictionary encoded, in the files and in memory (pandas categoricals)
+#   - readers memory-map the files and only decode the columns and partitions they ask for
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# String columns with at most this share of distinct values are dictionary encoded
+DICTIONARY_MAX_RATIO = 0.5
+
+PARQUET_COMPRESSION = 'zstd'
+
+
+def table_path(directory, name):
+    return os.path.join(directory, name)
+
+
+def encode_dictionaries(df):
+    # Low-cardinality string columns become categoricals, which Arrow stores as dictionary arrays
+    df = df.copy(deep=False)
+    for column in df.columns:
+        if (pd.api.types.infer_dtype(df[column], skipna=True) == 'string'
+                and df[column].nunique() <= DICTIONARY_MAX_RATIO * len(df)):
+            df[column] = df[column].astype('category')
+    return df
+
+
+def write_table(table, directory, name, partition_cols=None):
+    # Replace the table 'name' of a layer with an Arrow Table
+    path = table_path(directory, name)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    pq.write_to_dataset(table, path, partition_cols=partition_cols, compression=PARQUET_COMPRESSION)
+    print(f"'{name}' written to {path} ({table.num_rows} rows)")
+
+
+def write_frame(df, directory, name, partition_cols=None, csv=False):
+    # Replace the table 'name' of a layer with the DataFrame. With csv=True a CSV copy is written
+    # next to it, for the consumers that read the CSV files.
+    table = pa.Table.from_pandas(encode_dictionaries(df), preserve_index=False)
+    write_table(table, directory, name, partition_cols)
+    if csv:
+        df.to_csv(table_path(directory, name) + '.csv', index=False)
+
+
+def read_table(directory, name, columns=None, filters=None):
+    # The table as an Arrow Table, memory-mapped, with only 'columns' decoded.
+    # 'filters' prunes partitions and row groups, e.g. [('Release_Year', '>=', 2015)].
+    return pq.read_table(table_path(directory, name), columns=columns, filters=filters, memory_map=True)
+
+
+def read_frame(directory, name, columns=None, filters=None):
+    # The table as a DataFrame. Tables of layers written before the Parquet storage are read
+    # from their CSV file (without the filters).
+    path = table_path(directory, name)
+    if not os.path.isdir(path) and os.path.exists(path + '.csv'):
+        return pd.read_csv(path + '.csv', usecols=columns)
+    # self_destruct frees every Arrow column once it is converted, so the data is not held twice
+    return read_table(directory, name, columns, filters).to_pandas(split_blocks=True, self_destruct=True)
@@ -0,0 +1,298 @@
+# Single pass over animelist.csv (hundreds of millions of rows) with bounded memory, for the DimUser and
+# FactUserAnimeInteractions sinks of star_schema_loader.py.
+#
+# Every chunk is read with narrow dtypes (ANIMELIST_DTYPES), cleaned, and split into the users not seen
+# in the previous chunks and the (user, anime) pairs not seen in the previous chunks, so both sinks are
+# fed from the same read. Across chunks:
+#   - the users seen are a bitmap indexed by user_id (one byte per id, a few hundred KB)
+#   - the pairs seen are user_id << 32 | anime_id keys in a SeenPairs: a sorted in-memory array, plus
+#     sorted runs spilled to disk once the array reaches its share of max_rss_mb. Runs of about the same
+#     size are merged RUN_MERGE_FANIN at a time, so a chunk is looked up in a logarithmic number of runs.
+# animelist.csv is sorted by user_id: as long as the chunks keep that order, the keys of the users
+# before the current chunk are moved to an append-only run on disk, so the array only holds the keys
+# of one chunk's users and the run is never read. If the order breaks, the runs are searched too, so
+# pairs are still deduplicated over the whole file.
+# The chunk size is halved whenever the memory of the process goes over max_rss_mb.
+import os
+import resource
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+ANIMELIST_DTYPES = {
+    'user_id': 'Int32',
+    'anime_id': 'Int32',
+    'rating': 'Int8',
+    'watching_status': 'Int8',
+    'watched_episodes': 'Int32'
+}
+# Rows without one of these are dropped, missing ratings and watched episodes are stored as 0
+REQUIRED_COLUMNS = ['user_id', 'anime_id', 'watching_status']
+FILLED_COLUMNS = {'rating': 0, 'watched_episodes': 0}
+
+CHUNK_SIZE = 500_000
+MIN_CHUNK_SIZE = 10_000
+MAX_RSS_MB = 2048
+
+# Share of the memory left under max_rss_mb for the in-memory keys (a merge holds them twice), and the
+# least memory a pass needs besides them
+KEY_MEMORY_SHARE = 0.25
+MIN_FREE_MB = 64
+
+# Number of spilled runs of the same size class that are merged into one
+RUN_MERGE_FANIN = 4
+
+
+def current_rss_mb():
+    # Anonymous resident memory of the process on Linux (the pages of the memory-mapped runs are left
+    # out, the kernel drops them when needed), else the peak reported by getrusage
+    try:
+        with open('/proc/self/statm') as f:
+            _, resident, shared = f.read().split()[:3]
+        return (int(resident) - int(shared)) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def pair_keys(user_ids, anime_ids):
+    return (user_ids.astype(np.int64) << 32) | anime_ids.astype(np.int64)
+
+
+def mark_users(bitmap, user_ids):
+    # Users of the chunk not in the bitmap, which is grown to the largest id and updated.
+    # Returns the bitmap (a new array when it grew) and the new users, sorted.
+    user_ids = np.unique(user_ids)
+    if len(user_ids) and user_ids[-1] >= len(bitmap):
+        grown = np.zeros(max(int(user_ids[-1]) + 1, 2 * len(bitmap)), dtype=bool)
+        grown[:len(bitmap)] = bitmap
+        bitmap = grown
+    new_users = user_ids[~bitmap[user_ids]]
+    bitmap[new_users] = True
+    return bitmap, new_users
+
+
+def is_in_sorted(sorted_keys, keys):
+    # Membership of the sorted 'keys' in the sorted array (or memory map) 'sorted_keys'.
+    # Only the part of 'keys' within the range of 'sorted_keys' is searched.
+    found = np.zeros(len(keys), dtype=bool)
+    if len(sorted_keys) == 0 or len(keys) == 0:
+        return found
+    start = np.searchsorted(keys, sorted_keys[0], side='left')
+    stop = np.searchsorted(keys, sorted_keys[-1], side='right')
+    if start >= stop:
+        return found
+    candidates = keys[start:stop]
+    positions = np.minimum(np.searchsorted(sorted_keys, candidates), len(sorted_keys) - 1)
+    found[start:stop] = np.asarray(sorted_keys[positions]) == candidates
+    return found
+
+
+class SeenPairs:
+    # Set of the pair keys seen: a sorted in-memory array of at most max_keys keys, and sorted runs on disk.
+    # evict_below() moves the keys below a bound to the append-only ordered run, spill() moves the whole
+    # array to a new run. The runs are memory-mapped when they have to be searched.
+    # The size class of a run is log(run length / max_keys) in base RUN_MERGE_FANIN: as soon as a class
+    # holds RUN_MERGE_FANIN runs they are merged into one run of the next class.
+
+    def __init__(self, max_keys, directory=None):
+        self.max_keys = max_keys
+        self.keys = np.zeros(0, dtype=np.int64)
+        self._directory = tempfile.TemporaryDirectory(dir=directory, prefix='animelist_pairs_')
+        self._ordered_path = os.path.join(self._directory.name, 'ordered.bin')
+        self._ordered_count = 0
+        self._ordered_bounds = None  # (first key, last key) of the ordered run
+        self._ordered_map = None  # memory map of the ordered run, reopened after an append
+        self._runs = []  # memory maps of the spilled runs
+        self._run_files = 0
+        self.spilled = 0
+        self.merges = 0
+
+    def _ordered_run(self):
+        if self._ordered_count and (self._ordered_map is None or len(self._ordered_map) != self._ordered_count):
+            self._ordered_map = np.memmap(self._ordered_path, dtype=np.int64, mode='r', shape=(self._ordered_count,))
+        return self._ordered_map if self._ordered_count else np.zeros(0, dtype=np.int64)
+
+    def contains(self, keys):
+        # Membership of the sorted, distinct 'keys'. The runs are only read for the keys within their
+        # range, none in a file read in user_id order.
+        found = is_in_sorted(self.keys, keys)
+        if self._ordered_count and len(keys) and keys[0] <= self._ordered_bounds[1]:
+            found |= is_in_sorted(self._ordered_run(), keys)
+        for run in self._runs:
+            if len(keys) and keys[0] <= run[-1] and keys[-1] >= run[0]:
+                found |= is_in_sorted(run, keys)
+        return found
+
+    def add(self, new_keys):
+        # Add sorted keys not in the set. Both arrays are sorted: the stable sort of their concatenation
+        # is a linear merge of two runs.
+        self.keys = np.sort(np.concatenate([self.keys, new_keys]), kind='stable')
+        if len(self.keys) > self.max_keys:
+            self.spill()
+
+    def evict_below(self, bound):
+        # The keys below 'bound' will not be looked up while the file stays in user_id order: append
+        # them to the ordered run, whose keys stay ascending as the bounds only increase
+        count = int(np.searchsorted(self.keys, bound))
+        if count == 0:
+            return
+        with open(self._ordered_path, 'ab') as f:
+            self.keys[:count].tofile(f)
+        first = self._ordered_bounds[0] if self._ordered_bounds else int(self.keys[0])
+        self._ordered_bounds = (first, int(self.keys[count - 1]))
+        self._ordered_count += count
+        self.keys = self.keys[count:].copy()
+        self.spilled += count
+
+    def _new_run_path(self):
+        self._run_files += 1
+        return os.path.join(self._directory.name, f'run_{self._run_files}.bin')
+
+    def _size_class(self, run):
+        size_class, size = 0, len(run)
+        while size > self.max_keys * RUN_MERGE_FANIN ** (size_class + 1):
+            size_class += 1
+        return size_class
+
+    def spill(self):
+        path = self._new_run_path()
+        self.keys.tofile(path)
+        self._runs.append(np.memmap(path, dtype=np.int64, mode='r', shape=(len(self.keys),)))
+        self.spilled += len(self.keys)
+        self.keys = np.zeros(0, dtype=np.int64)
+        while True:
+            classes = {}
+            for run in self._runs:
+                classes.setdefault(self._size_class(run), []).append(run)
+            full = [runs for runs in classes.values() if len(runs) >= RUN_MERGE_FANIN]
+            if not full:
+                break
+            self.merge(full[0])
+
+    def merge(self, runs):
+        # Replace 'runs' with one sorted run. The runs hold distinct keys, they are merged in key ranges
+        # of about max_keys keys: the bounds are taken from a regular sample of every run.
+        step = max(self.max_keys // (4 * len(runs)), 1)
+        samples = np.sort(np.concatenate([np.asarray(run[::step]) for run in runs]))
+        per_range = max(self.max_keys // (2 * step), 1)
+        bounds = list(samples[per_range::per_range]) + [None]
+        path = self._new_run_path()
+        starts = [0] * len(runs)
+        with open(path, 'wb') as f:
+            for bound in bounds:
+                parts = []
+                for i, run in enumerate(runs):
+                    stop = len(run) if bound is None else int(np.searchsorted(run, bound))
+                    parts.append(np.asarray(run[starts[i]:stop]))
+                    starts[i] = stop
+                np.sort(np.concatenate(parts)).tofile(f)
+        length = sum(len(run) for run in runs)
+        self._runs = [run for run in self._runs if not any(run is merged for merged in runs)]
+        for run in runs:
+            os.remove(run.filename)
+        self._runs.append(np.memmap(path, dtype=np.int64, mode='r', shape=(length,)))
+        self.merges += 1
+
+    def close(self):
+        self._ordered_map = None
+        self._runs = []
+        self._directory.cleanup()
+
+
+def mark_pairs(seen, keys):
+    # Positions of the rows whose key is neither in 'seen' nor earlier in the chunk (first occurrence
+    # wins), in key order. The new keys are added to 'seen'.
+    unique_keys, first_rows = np.unique(keys, return_index=True)
+    is_new = ~seen.contains(unique_keys)
+    seen.add(unique_keys[is_new])
+    return first_rows[is_new]
+
+
+def clean_chunk(chunk):
+    chunk = chunk.dropna(subset=REQUIRED_COLUMNS).fillna(FILLED_COLUMNS)
+    # Back to NumPy dtypes of the same width now that nothing is missing
+    return chunk.astype({column: dtype.lower() for column, dtype in ANIMELIST_DTYPES.items()})
+
+
+def plan_key_memory(max_rss_mb):
+    # Number of keys kept in memory before a spill. Raises MemoryError when the cap leaves no room for
+    # a pass, before anything is read or written.
+    free_mb = max_rss_mb - current_rss_mb()
+    if free_mb < MIN_FREE_MB:
+        raise MemoryError(f"{current_rss_mb():.0f} MB already resident, a cap of {max_rss_mb} MB leaves less than "
+                          f"{MIN_FREE_MB} MB for reading animelist.csv")
+    return max(int(free_mb * KEY_MEMORY_SHARE * 2 ** 20) // 8, MIN_CHUNK_SIZE)
+
+
+def stream_interactions(path, chunk_size=CHUNK_SIZE, max_rss_mb=MAX_RSS_MB, stats=None, spill_dir=None,
+                        max_keys=None):
+    # Iterator of (new users, new facts) per chunk of animelist.csv: the user_ids not yielded before as
+    # an int32 array, and the rows of the chunk with a (user_id, anime_id) pair not yielded before,
+    # sorted by pair. 'stats' (a dict) is filled with the counts of the pass.
+    # The memory cap and the file are checked when this is called, so a caller can fail before
+    # clearing its tables. 'max_keys' overrides the number of pair keys kept in memory before a spill.
+    max_keys = plan_key_memory(max_rss_mb) if max_keys is None else max_keys
+    reader = pd.read_csv(path, usecols=list(ANIMELIST_DTYPES), dtype=ANIMELIST_DTYPES, iterator=True)
+    stats = {} if stats is None else stats
+    stats.update(rows_read=0, rows_missing=0, duplicates=0, users=0, facts=0, chunks=0, min_chunk_size=chunk_size,
+                 in_user_order=True, keys_spilled=0, run_merges=0)
+    return iterate_chunks(reader, chunk_size, max_rss_mb, SeenPairs(max_keys, spill_dir), stats)
+
+
+def iterate_chunks(reader, chunk_size, max_rss_mb, seen, stats):
+    bitmap = np.zeros(0, dtype=bool)
+    last_user = -1
+    with reader:
+        try:
+            while True:
+                try:
+                    chunk = reader.get_chunk(chunk_size)
+                except StopIteration:
+                    break
+                stats['rows_read'] += len(chunk)
+                stats['chunks'] += 1
+                facts = clean_chunk(chunk)
+                stats['rows_missing'] += len(chunk) - len(facts)
+                del chunk
+                user_ids = facts['user_id'].to_numpy()
+                anime_ids = facts['anime_id'].to_numpy()
+
+                if stats['in_user_order'] and len(facts):
+                    if user_ids[0] < last_user or np.any(np.diff(user_ids) < 0):
+                        stats['in_user_order'] = False
+                        print(f"animelist.csv is not in user_id order from chunk {stats['chunks']}: "
+                              f"the spilled pairs are searched from now on.")
+                    else:
+                        # Pairs of the users before this chunk cannot appear again while the order holds
+                        seen.evict_below(int(user_ids[0]) << 32)
+                        last_user = int(user_ids[-1])
+
+                bitmap, new_users = mark_users(bitmap, user_ids)
+                rows = mark_pairs(seen, pair_keys(user_ids, anime_ids))
+                stats['duplicates'] += len(facts) - len(rows)
+                facts = facts.iloc[rows]
+                stats['users'] += len(new_users)
+                stats['facts'] += len(facts)
+                stats['keys_spilled'] = seen.spilled
+                stats['run_merges'] = seen.merges
+                yield new_users.astype(np.int32), facts
+                del facts
+
+                rss = current_rss_mb()
+                stats['peak_rss_mb'] = max(stats.get('peak_rss_mb', 0), round(rss))
+                if rss > max_rss_mb:
+                    if chunk_size <= MIN_CHUNK_SIZE:
+                        raise MemoryError(f"{rss:.0f} MB resident with chunks of {chunk_size} rows, over the cap "
+                                          f"of {max_rss_mb} MB")
+                    chunk_size = max(chunk_size // 2, MIN_CHUNK_SIZE)
+                    stats['min_chunk_size'] = chunk_size
+                    print(f"{rss:.0f} MB resident, over the cap of {max_rss_mb} MB: chunks of {chunk_size} rows "
+                          f"from now on.")
+        finally:
+            seen.close()
@@ -0,0 +1,174 @@
+# Compare the bulk loader of star_schema_loader.py with the loading cells of anime_star_schema.ipynb
+# (per-row INSERTs, one INSERT + lastrowid per genre and studio, two passes over animelist.csv)
+# on synthetic raw files, in rows/s per table.
+#
+# Usage:
+#   python benchmark_star_schema_loader.py --anime 20000 --interactions 5000000 --output loader_benchmark.json
+#
+# Both loaders write to their own SQLite stage database, whose tables are compared once loaded.
+import argparse
+import json
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from star_schema_loader import (ANIME_NUMERIC_COLUMNS, DIM_ANIME_COLUMNS, DIMENSIONS, FACT_INDEXES, STAGE_TABLES,
+                                clean_anime, connect, load_stage)
+
+GENRES = ['Action', 'Comedy', 'Drama', 'Fantasy', 'Romance', 'Sci-Fi', 'Slice of Life', 'Sports', 'Mystery',
+          'Supernatural', 'Mecha', 'Music']
+STUDIOS = [f'Studio {i}' for i in range(300)]
+DURATIONS = ['24 min. per ep.', '1 hr. 55 min.', '23 min. per ep.', '5 min. per ep.', 'Unknown']
+
+
+def make_raw_files(raw_dir, anime, interactions, seed=0):
+    # anime.csv, animelist.csv and watching_status.csv with the columns of the Kaggle files
+    rng = np.random.default_rng(seed)
+    ids = np.arange(1, anime + 1)
+
+    def lists(names, most):
+        return [', '.join(rng.choice(names, size=rng.integers(1, most + 1), replace=False)) for _ in range(anime)]
+
+    anime_df = pd.DataFrame({
+        'MAL_ID': ids, 'Name': [f'Anime {i}' for i in ids], 'Score': rng.choice(['7.5', '8.12', 'Unknown'], anime),
+        'Genres': lists(GENRES, 4), 'English name': 'Unknown', 'Japanese name': 'Unknown',
+        'Type': rng.choice(['TV', 'Movie', 'OVA'], anime), 'Episodes': rng.choice(['12', '24', 'Unknown'], anime),
+        'Aired': 'Apr 3, 1998', 'Premiered': rng.choice(['Spring 1998', 'Unknown'], anime), 'Producers': 'Bandai',
+        'Licensors': 'Unknown', 'Studios': lists(STUDIOS, 2), 'Source': 'Manga', 'Duration': rng.choice(DURATIONS, anime),
+        'Rating': 'PG-13'
+    })
+    for column in ANIME_NUMERIC_COLUMNS[2:]:
+        anime_df[column] = rng.integers(0, 100000, anime)
+    anime_df.to_csv(os.path.join(raw_dir, 'anime.csv'), index=False)
+
+    users = np.sort(rng.integers(0, interactions // 100 + 1, interactions))
+    pd.DataFrame({
+        'user_id': users, 'anime_id': rng.integers(1, anime + 1, interactions),
+        'rating': rng.integers(0, 11, interactions), 'watching_status': rng.integers(1, 7, interactions),
+        'watched_episodes': rng.integers(0, 25, interactions)
+    }).drop_duplicates(subset=['user_id', 'anime_id']).to_csv(os.path.join(raw_dir, 'animelist.csv'), index=False)
+    pd.DataFrame({'status': range(1, 7), 'description': ['Currently Watching', 'Completed', 'On Hold', 'Dropped', '',
+                                                         'Plan to Watch']}).to_csv(
+        os.path.join(raw_dir, 'watching_status.csv'), index=False)
+
+
+# The cells of the notebook, with the SQLite placeholders
+
+def load_stage_rowwise(conn, raw_dir):
+    cursor = conn.cursor()
+    for table, columns in STAGE_TABLES.items():
+        # INTEGER PRIMARY KEY is the AUTO_INCREMENT of SQLite
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS stage.{table} ({columns.replace('_id INT PRIMARY KEY', '_id INTEGER PRIMARY KEY')});")
+    # The secondary indexes of the fact table are maintained during the whole load
+    for index, columns in FACT_INDEXES.items():
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS stage.{index} ON FactUserAnimeInteractions ({', '.join(columns)})")
+    anime_df_cleaned = clean_anime(pd.read_csv(os.path.join(raw_dir, 'anime.csv')))
+    timings = {}
+
+    start = time.perf_counter()
+    for index, row in anime_df_cleaned.iterrows():
+        cursor.execute(f"INSERT INTO stage.DimAnime ({', '.join(DIM_ANIME_COLUMNS)}) VALUES ({', '.join(['?'] * 24)})",
+                       tuple(None if pd.isna(row[column]) else
+                             (float(row[column]) if column == 'Score' else int(row[column]))
+                             if column in ANIME_NUMERIC_COLUMNS + ['MAL_ID', 'Duration'] else row[column]
+                             for column in DIM_ANIME_COLUMNS.values()))
+    conn.commit()
+    record(timings, 'DimAnime', len(anime_df_cleaned), start)
+
+    for column, (table, _, name, bridge_table) in DIMENSIONS.items():
+        start = time.perf_counter()
+        unique_names = anime_df_cleaned[column].dropna().str.split(',').explode().str.strip().unique()
+        name_dict = {}
+        for value in unique_names:
+            cursor.execute(f"INSERT INTO stage.{table} ({name}) VALUES (?);", (value,))
+            name_dict[value] = cursor.lastrowid
+        conn.commit()
+        bridge_records = []
+        for index, row in anime_df_cleaned.iterrows():
+            if pd.notnull(row[column]):
+                for value in row[column].split(','):
+                    bridge_records.append((int(row['MAL_ID']), name_dict.get(value.strip())))
+        cursor.executemany(f"INSERT INTO stage.{bridge_table} VALUES (?, ?)", bridge_records)
+        conn.commit()
+        record(timings, f'{table} + {bridge_table}', len(unique_names) + len(bridge_records), start)
+
+    start = time.perf_counter()
+    watching_status_df = pd.read_csv(os.path.join(raw_dir, 'watching_status.csv')).drop_duplicates()
+    cursor.executemany("INSERT INTO stage.DimWatchingStatus (status, description) VALUES (?, ?)",
+                       watching_status_df.values.tolist())
+    conn.commit()
+    record(timings, 'DimWatchingStatus', len(watching_status_df), start)
+
+    start = time.perf_counter()
+    animelist_path = os.path.join(raw_dir, 'animelist.csv')
+    unique_user_ids = set()
+    for chunk in pd.read_csv(animelist_path, chunksize=100000, usecols=['user_id'], low_memory=True):
+        unique_user_ids.update(chunk.dropna(subset=['user_id'])['user_id'].astype(int).unique())
+    cursor.executemany("INSERT INTO stage.DimUser (user_id) VALUES (?);", [(int(user_id),) for user_id in unique_user_ids])
+    conn.commit()
+    total_rows_inserted = 0
+    for chunk in pd.read_csv(animelist_path, chunksize=150000, low_memory=True):
+        chunk.drop_duplicates(inplace=True)
+        chunk.dropna(subset=['user_id', 'anime_id', 'watching_status'], inplace=True)
+        fact_records = chunk[['user_id', 'anime_id', 'rating', 'watching_status', 'watched_episodes']].astype(int).values.tolist()
+        cursor.executemany("INSERT INTO stage.FactUserAnimeInteractions (user_id, anime_id, rating, watching_status, "
+                           "watched_episodes) VALUES (?, ?, ?, ?, ?)", fact_records)
+        conn.commit()
+        total_rows_inserted += len(fact_records)
+    record(timings, 'DimUser + Fact', len(unique_user_ids) + total_rows_inserted, start)
+    return timings
+
+
+def record(timings, table, rows, start):
+    seconds = time.perf_counter() - start
+    timings[table] = {'rows': rows, 'seconds': round(seconds, 3), 'rows_per_second': round(rows / seconds)}
+
+
+def read_stage_table(path, table):
+    with sqlite3.connect(path) as conn:
+        return pd.read_sql(f"SELECT * FROM {table}", conn).sort_values(list(pd.read_sql(
+            f"SELECT * FROM {table} LIMIT 0", conn).columns)).reset_index(drop=True)
+
+
+def run(anime, interactions):
+    results = {'anime': anime, 'interactions': interactions}
+    with tempfile.TemporaryDirectory() as work_dir:
+        print(f"Generating {anime} anime and {interactions} interactions...")
+        make_raw_files(work_dir, anime, interactions)
+
+        rowwise_path, bulk_path = os.path.join(work_dir, 'rowwise.sqlite'), os.path.join(work_dir, 'bulk.sqlite')
+        conn = connect('sqlite', rowwise_path)
+        rowwise = load_stage_rowwise(conn, work_dir)
+        conn.close()
+        print("Bulk loader:")
+        conn = connect('sqlite', bulk_path)
+        bulk = load_stage(conn, 'sqlite', work_dir)
+        conn.close()
+
+        for table in STAGE_TABLES:
+            pd.testing.assert_frame_equal(read_stage_table(rowwise_path, table), read_stage_table(bulk_path, table),
+                                          check_dtype=False)
+
+    print(f"{'tables':<32} {'row-wise rows/s':>16} {'bulk rows/s':>12} {'speedup':>8}")
+    for table, timing in bulk.items():
+        speedup = rowwise[table]['seconds'] / timing['seconds']
+        results[table] = {'rowwise': rowwise[table], 'bulk': timing, 'speedup': round(speedup, 1)}
+        print(f"{table:<32} {rowwise[table]['rows_per_second']:>16} {timing['rows_per_second']:>12} {speedup:>7.1f}x")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the bulk star schema loader against the notebook cells.")
+    parser.add_argument('--anime', type=int, default=20000)
+    parser.add_argument('--interactions', type=int, default=5_000_000)
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.anime, args.interactions)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,317 @@
+# Bulk loader of the stage tables of the anime star schema, the loading cells of anime_star_schema.ipynb
+# without per-row round trips to the database.
+#
+# Usage:
+#   python star_schema_loader.py --backend mariadb --socket mysql/mysql.sock [--infile]
+#   python star_schema_loader.py --backend sqlite --database anime_stage.sqlite
+#
+# Compared with the notebook:
+#   - the surrogate keys of DimGenre and DimStudio are assigned in memory (pd.factorize, in order of
+#     first appearance like the AUTO_INCREMENT ids), no INSERT + lastrowid per genre or studio
+#   - every table is written in batches of BATCH_SIZE rows with executemany, or with LOAD DATA LOCAL
+#     INFILE on MariaDB (--infile)
+#   - the secondary indexes of FactUserAnimeInteractions are dropped before the facts are loaded and
+#     built once at the end
+#   - animelist.csv is read once, with bounded memory: DimUser and the facts are fed from the same chunks
+#     and the (user, anime) pairs are deduplicated across chunks (see animelist_stream.py)
+# SQLite stands in for MariaDB when no server is available, with the stage tables in an attached
+# database named 'stage' so the queries are the same.
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from animelist_stream import CHUNK_SIZE, MAX_RSS_MB, peak_rss_mb, stream_interactions
+
+BATCH_SIZE = 10_000
+
+# anime.csv columns with 'Unknown' for missing values
+ANIME_NUMERIC_COLUMNS = ['Score', 'Episodes', 'Ranked', 'Popularity', 'Members', 'Favorites',
+                         'Watching', 'Completed', 'On-Hold', 'Dropped', 'Plan to Watch']
+ANIME_STRING_COLUMNS = ['Genres', 'English name', 'Japanese name', 'Type', 'Aired', 'Premiered',
+                        'Producers', 'Licensors', 'Studios', 'Source', 'Duration', 'Rating']
+
+# stage.DimAnime column -> anime.csv column
+DIM_ANIME_COLUMNS = {
+    'MAL_ID': 'MAL_ID', 'Name': 'Name', 'English_name': 'English name', 'Japanese_name': 'Japanese name',
+    'Type': 'Type', 'Episodes': 'Episodes', 'Aired': 'Aired', 'Premiered': 'Premiered', 'Producers': 'Producers',
+    'Licensors': 'Licensors', 'Studios': 'Studios', 'Source': 'Source', 'Duration': 'Duration', 'Rating': 'Rating',
+    'Score': 'Score', 'Ranked': 'Ranked', 'Popularity': 'Popularity', 'Members': 'Members',
+    'Favorites': 'Favorites', 'Watching': 'Watching', 'Completed': 'Completed', 'OnHold': 'On-Hold',
+    'Dropped': 'Dropped', 'PlanToWatch': 'Plan to Watch'
+}
+DIM_ANIME_INT_COLUMNS = ['MAL_ID', 'Episodes', 'Duration', 'Ranked', 'Popularity', 'Members', 'Favorites',
+                         'Watching', 'Completed', 'OnHold', 'Dropped', 'PlanToWatch']
+
+# Comma separated anime.csv column -> (dimension table, key column, name column, bridge table)
+DIMENSIONS = {
+    'Genres': ('DimGenre', 'genre_id', 'genre_name', 'BridgeAnimeGenre'),
+    'Studios': ('DimStudio', 'studio_id', 'studio_name', 'BridgeAnimeStudio')
+}
+
+FACT_COLUMNS = ['user_id', 'anime_id', 'rating', 'watching_status', 'watched_episodes']
+
+# Secondary indexes of the fact table (the hist stored procedures join on anime_id), dropped during
+# the fact load and built once at the end
+FACT_INDEXES = {
+    'idx_fact_anime_id': ['anime_id'],
+    'idx_fact_watching_status': ['watching_status']
+}
+
+# Stage tables of the notebook. The ids are assigned by the loader, so the AUTO_INCREMENT of DimGenre
+# and DimStudio is not needed here (the tables created by the notebook work as well).
+STAGE_TABLES = {
+    'DimAnime': """
+        MAL_ID INT PRIMARY KEY, Name VARCHAR(255), English_name VARCHAR(255), Japanese_name VARCHAR(255),
+        Type VARCHAR(50), Episodes INT, Aired VARCHAR(100), Premiered VARCHAR(50), Producers TEXT,
+        Licensors TEXT, Studios TEXT, Source VARCHAR(50), Duration INT, Rating VARCHAR(50), Score FLOAT,
+        Ranked INT, Popularity INT, Members INT, Favorites INT, Watching INT, Completed INT, OnHold INT,
+        Dropped INT, PlanToWatch INT""",
+    'DimUser': "user_id INT PRIMARY KEY",
+    'FactUserAnimeInteractions': """
+        user_id INT, anime_id INT, rating INT, watching_status INT, watched_episodes INT,
+        PRIMARY KEY (user_id, anime_id)""",
+    'DimWatchingStatus': "status INT PRIMARY KEY, description VARCHAR(100)",
+    'DimGenre': "genre_id INT PRIMARY KEY, genre_name VARCHAR(100)",
+    'BridgeAnimeGenre': "anime_id INT, genre_id INT, PRIMARY KEY (anime_id, genre_id)",
+    'DimStudio': "studio_id INT PRIMARY KEY, studio_name VARCHAR(255)",
+    'BridgeAnimeStudio': "anime_id INT, studio_id INT, PRIMARY KEY (anime_id, studio_id)"
+}
+
+# SQL that differs between MariaDB and the SQLite stand-in
+BACKENDS = {
+    'mariadb': {
+        'clear': "TRUNCATE TABLE stage.{table}",
+        'create_index': "CREATE INDEX IF NOT EXISTS {index} ON stage.{table} ({columns})",
+        'drop_index': "DROP INDEX IF EXISTS {index} ON stage.{table}",
+        'bulk_session': ["SET unique_checks = 0", "SET foreign_key_checks = 0"],
+        'end_bulk_session': ["SET unique_checks = 1", "SET foreign_key_checks = 1"]
+    },
+    'sqlite': {
+        'clear': "DELETE FROM stage.{table}",
+        'create_index': "CREATE INDEX IF NOT EXISTS stage.{index} ON {table} ({columns})",
+        'drop_index': "DROP INDEX IF EXISTS stage.{index}",
+        'bulk_session': ["PRAGMA stage.synchronous = OFF", "PRAGMA stage.journal_mode = MEMORY"],
+        'end_bulk_session': ["PRAGMA stage.synchronous = FULL", "PRAGMA stage.journal_mode = DELETE"]
+    }
+}
+
+
+def connect(backend, database=None, socket=None, user='root', infile=False):
+    # Connection with the 'stage' schema selectable as stage.<table>
+    if backend == 'mariadb':
+        import mariadb  # only needed for MariaDB
+        conn = mariadb.connect(user=user, unix_socket=socket, local_infile=infile)
+        cursor = conn.cursor()
+        cursor.execute("CREATE DATABASE IF NOT EXISTS AnimeDataWarehouse;")
+        cursor.execute("USE AnimeDataWarehouse;")
+        cursor.execute("CREATE SCHEMA IF NOT EXISTS stage;")
+        return conn
+    conn = sqlite3.connect(':memory:')
+    conn.execute("ATTACH DATABASE ? AS stage", (database or ':memory:',))
+    return conn
+
+
+def create_stage_tables(conn):
+    cursor = conn.cursor()
+    for table, columns in STAGE_TABLES.items():
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS stage.{table} ({columns});")
+    conn.commit()
+
+
+def run_statements(conn, backend, statement, **parameters):
+    cursor = conn.cursor()
+    statements = BACKENDS[backend][statement]
+    for sql in ([statements] if isinstance(statements, str) else statements):
+        cursor.execute(sql.format(**parameters))
+
+
+def convert_duration_to_seconds(durations):
+    # '24 min. per ep.' or '1 hr. 55 min.' -> seconds, see the notebook
+    hours = pd.to_numeric(durations.str.extract(r"(\d+)\s*hr\.?", expand=False)).fillna(0)
+    minutes = pd.to_numeric(durations.str.extract(r"(\d+)\s*min\.?", expand=False)).fillna(0)
+    seconds = pd.to_numeric(durations.str.extract(r"(\d+)\s*sec\.?", expand=False)).fillna(0)
+    return (hours * 3600 + minutes * 60 + seconds).where(durations.notna())
+
+
+def clean_anime(anime_df):
+    # The cleaning cells of anime.csv: 'Unknown' -> missing, numbers parsed, strings stripped, durations in seconds
+    anime_df = anime_df.copy()
+    anime_df[ANIME_NUMERIC_COLUMNS] = anime_df[ANIME_NUMERIC_COLUMNS].replace('Unknown', pd.NA).apply(
+        pd.to_numeric, errors='coerce')
+    anime_df[ANIME_STRING_COLUMNS] = anime_df[ANIME_STRING_COLUMNS].replace('Unknown', pd.NA).apply(
+        lambda column: column.str.strip())
+    anime_df['Duration'] = convert_duration_to_seconds(anime_df['Duration'])
+    return anime_df
+
+
+def build_dimension(anime_df, column):
+    # Dimension (id, name) and bridge (anime_id, id) rows of a comma separated column, ids from 1
+    # in order of first appearance. An anime listing a name twice gets one bridge row.
+    names = anime_df[['MAL_ID', column]].dropna(subset=[column])
+    names = names.assign(**{column: names[column].str.split(',')}).explode(column)
+    names[column] = names[column].str.strip()
+    codes, distinct = pd.factorize(names[column])
+    dimension = pd.DataFrame({'id': np.arange(1, len(distinct) + 1), 'name': distinct})
+    bridge = pd.DataFrame({'anime_id': names['MAL_ID'].to_numpy(), 'id': codes + 1}).drop_duplicates()
+    return dimension, bridge
+
+
+def to_records(df):
+    # Rows as tuples of Python values, None for missing values (the drivers reject NumPy scalars)
+    return list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+
+def escape_infile_column(column):
+    # Text of a column in the default LOAD DATA format: tab separated, '\N' for NULL, backslash escapes
+    text = column.astype('string')
+    if not pd.api.types.is_numeric_dtype(column):
+        text = (text.str.replace('\\', '\\\\', regex=False).str.replace('\t', '\\t', regex=False)
+                .str.replace('\n', '\\n', regex=False).str.replace('\r', '\\r', regex=False))
+    return text.fillna('\\N')
+
+
+def load_infile(conn, table, df):
+    # Write the rows to a temporary file read by the server with LOAD DATA LOCAL INFILE
+    columns = [escape_infile_column(df[column]) for column in df.columns]
+    lines = columns[0].str.cat(columns[1:], sep='\t') if len(columns) > 1 else columns[0]
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv', encoding='utf-8', delete=False) as f:
+        f.write('\n'.join(lines))
+        f.write('\n')
+    try:
+        conn.cursor().execute(
+            f"LOAD DATA LOCAL INFILE '{f.name}' INTO TABLE stage.{table} "
+            f"CHARACTER SET utf8mb4 ({', '.join(df.columns)})")
+    finally:
+        os.remove(f.name)
+
+
+def write_rows(conn, table, df, infile=False):
+    # Insert the DataFrame (columns named like the table) in batches of BATCH_SIZE rows
+    if df.empty:
+        return 0
+    if infile:
+        load_infile(conn, table, df)
+    else:
+        query = (f"INSERT INTO stage.{table} ({', '.join(df.columns)}) "
+                 f"VALUES ({', '.join(['?'] * len(df.columns))})")
+        cursor = conn.cursor()
+        for start in range(0, len(df), BATCH_SIZE):
+            cursor.executemany(query, to_records(df.iloc[start:start + BATCH_SIZE]))
+    return len(df)
+
+
+def replace_table(conn, backend, table, df, infile=False):
+    # Replace the content of a stage table
+    run_statements(conn, backend, 'clear', table=table)
+    rows = write_rows(conn, table, df, infile)
+    conn.commit()
+    return rows
+
+
+def load_dim_anime(conn, backend, anime_df_cleaned, infile=False):
+    df = anime_df_cleaned[list(DIM_ANIME_COLUMNS.values())].set_axis(list(DIM_ANIME_COLUMNS), axis=1)
+    df = df.astype({column: 'Int64' for column in DIM_ANIME_INT_COLUMNS})
+    return replace_table(conn, backend, 'DimAnime', df, infile)
+
+
+def load_dimension(conn, backend, anime_df_cleaned, column, infile=False):
+    # Fill a dimension and its bridge table from a comma separated column (see DIMENSIONS).
+    # Returns the number of rows of both.
+    table, key, name, bridge_table = DIMENSIONS[column]
+    dimension, bridge = build_dimension(anime_df_cleaned, column)
+    dimension_rows = replace_table(conn, backend, table, dimension.set_axis([key, name], axis=1), infile)
+    bridge_rows = replace_table(conn, backend, bridge_table, bridge.set_axis(['anime_id', key], axis=1), infile)
+    return dimension_rows, bridge_rows
+
+
+def load_watching_status(conn, backend, watching_status_df, infile=False):
+    return replace_table(conn, backend, 'DimWatchingStatus',
+                         watching_status_df.drop_duplicates().set_axis(['status', 'description'], axis=1), infile)
+
+
+def load_interactions(conn, backend, animelist_path, chunk_size=CHUNK_SIZE, infile=False, max_rss_mb=MAX_RSS_MB):
+    # Stream animelist.csv once into DimUser and FactUserAnimeInteractions (see animelist_stream.py): every
+    # chunk adds its new users and its new (user, anime) pairs, a pair repeated later in the file is dropped.
+    # Returns the number of users and of fact rows written.
+    stats = {}
+    # Checks the memory cap and the columns of the file before the tables are cleared
+    chunks = stream_interactions(animelist_path, chunk_size, max_rss_mb, stats)
+    run_statements(conn, backend, 'clear', table='FactUserAnimeInteractions')
+    run_statements(conn, backend, 'clear', table='DimUser')
+    for index in FACT_INDEXES:
+        run_statements(conn, backend, 'drop_index', index=index, table='FactUserAnimeInteractions')
+    conn.commit()
+    run_statements(conn, backend, 'bulk_session')
+
+    try:
+        for new_users, facts in chunks:
+            write_rows(conn, 'DimUser', pd.DataFrame({'user_id': new_users}), infile)
+            write_rows(conn, 'FactUserAnimeInteractions', facts[FACT_COLUMNS], infile)
+            conn.commit()
+            print(f"Processed {stats['rows_read']} records.")
+    finally:
+        run_statements(conn, backend, 'end_bulk_session')
+    print(f"{stats['rows_read']} rows read: {stats['facts']} facts, {stats['users']} users, "
+          f"{stats['duplicates']} duplicate pairs and {stats['rows_missing']} incomplete rows dropped, "
+          f"{stats['keys_spilled']} pair keys spilled to disk, peak RSS {peak_rss_mb():.0f} MB")
+
+    print("Building the fact table indexes...")
+    for index, columns in FACT_INDEXES.items():
+        run_statements(conn, backend, 'create_index', index=index, table='FactUserAnimeInteractions',
+                       columns=', '.join(columns))
+    conn.commit()
+    return stats['users'], stats['facts']
+
+
+def timed_load(timings, table, load, *args, **kwargs):
+    start = time.perf_counter()
+    rows = load(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    total = sum(rows) if isinstance(rows, tuple) else rows
+    timings[table] = {'rows': total, 'seconds': round(seconds, 3), 'rows_per_second': round(total / seconds)}
+    print(f"{table:<28} {total:>12} rows {seconds:>9.2f} s {total / seconds:>12.0f} rows/s")
+    return rows
+
+
+def load_stage(conn, backend, raw_dir, infile=False, chunk_size=CHUNK_SIZE, max_rss_mb=MAX_RSS_MB):
+    # Load every stage table from the raw files, returns rows, seconds and rows/s per table
+    create_stage_tables(conn)
+    anime_df_cleaned = clean_anime(pd.read_csv(os.path.join(raw_dir, 'anime.csv')))
+    timings = {}
+    timed_load(timings, 'DimAnime', load_dim_anime, conn, backend, anime_df_cleaned, infile)
+    for column, (table, _, _, bridge_table) in DIMENSIONS.items():
+        timed_load(timings, f'{table} + {bridge_table}', load_dimension, conn, backend, anime_df_cleaned, column,
+                   infile)
+    timed_load(timings, 'DimWatchingStatus', load_watching_status, conn, backend,
+               pd.read_csv(os.path.join(raw_dir, 'watching_status.csv')), infile)
+    timed_load(timings, 'DimUser + Fact', load_interactions, conn, backend, os.path.join(raw_dir, 'animelist.csv'),
+               chunk_size, infile, max_rss_mb)
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk load the stage tables of the anime star schema.")
+    parser.add_argument('--raw', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'raw'),
+                        help="Directory of anime.csv, animelist.csv and watching_status.csv")
+    parser.add_argument('--backend', choices=list(BACKENDS), default='mariadb')
+    parser.add_argument('--socket', default='mysql/mysql.sock', help="Unix socket of the MariaDB server")
+    parser.add_argument('--user', default='root')
+    parser.add_argument('--database', default='anime_stage.sqlite', help="SQLite file of the stage tables")
+    parser.add_argument('--infile', action='store_true', help="Load the batches with LOAD DATA LOCAL INFILE (MariaDB)")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help="Rows of animelist.csv per chunk")
+    parser.add_argument('--max-rss-mb', type=int, default=MAX_RSS_MB,
+                        help="Resident memory cap, the chunks get smaller and the pair keys spill to disk above it")
+    args = parser.parse_args()
+
+    if args.infile and args.backend != 'mariadb':
+        parser.error("--infile is only supported with --backend mariadb")
+    conn = connect(args.backend, args.database, args.socket, args.user, args.infile)
+    try:
+        load_stage(conn, args.backend, args.raw, args.infile, args.chunk_size, args.max_rss_mb)
+    finally:
+        conn.close()
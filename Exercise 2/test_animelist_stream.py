@@ -0,0 +1,81 @@
+import numpy as np
+import pandas as pd
+
+from animelist_stream import RUN_MERGE_FANIN, SeenPairs, stream_interactions
+
+
+def write_animelist(path, order, seed=0):
+    # Random animelist.csv with repeated (user_id, anime_id) pairs and a few rows missing a field
+    rng = np.random.default_rng(seed)
+    rows = 60_000
+    frame = pd.DataFrame({
+        'user_id': rng.integers(0, 1_000, rows),
+        'anime_id': rng.integers(1, 300, rows),
+        'rating': rng.integers(0, 11, rows),
+        'watching_status': rng.integers(1, 7, rows),
+        'watched_episodes': rng.integers(0, 50, rows)
+    })
+    if order == 'sorted':
+        frame = frame.sort_values('user_id', kind='stable')
+    elif order == 'broken':
+        frame = frame.sort_values('user_id', kind='stable')
+        frame = pd.concat([frame.iloc[rows // 2:], frame.iloc[:rows // 2]])
+    frame = frame.astype('Int32')
+    frame.loc[frame.index[::997], 'watching_status'] = pd.NA
+    frame.to_csv(path, index=False)
+
+
+def stream(path, tmp_path, stats):
+    users, facts = [], []
+    for new_users, new_facts in stream_interactions(path, chunk_size=4_000, stats=stats, spill_dir=tmp_path,
+                                                    max_keys=1_000):
+        users.append(new_users)
+        facts.append(new_facts)
+    return np.concatenate(users), pd.concat(facts)
+
+
+def check_against_drop_duplicates(tmp_path, order):
+    path = tmp_path / 'animelist.csv'
+    write_animelist(path, order)
+    stats = {}
+    users, facts = stream(path, tmp_path, stats)
+
+    expected = pd.read_csv(path).dropna(subset=['user_id', 'anime_id', 'watching_status'])
+    expected = expected.fillna({'rating': 0, 'watched_episodes': 0})
+    expected = expected.drop_duplicates(['user_id', 'anime_id']).sort_values(['user_id', 'anime_id'])
+    columns = list(expected.columns)
+    actual = facts[columns].astype('int64').sort_values(['user_id', 'anime_id'])
+    assert actual.to_numpy().tolist() == expected[columns].astype('int64').to_numpy().tolist()
+    assert len(users) == len(np.unique(users))
+    assert sorted(users.tolist()) == sorted(expected['user_id'].unique().tolist())
+    return stats
+
+
+def test_sorted_file_evicts_to_the_ordered_run(tmp_path):
+    stats = check_against_drop_duplicates(tmp_path, 'sorted')
+    assert stats['in_user_order']
+    assert stats['keys_spilled'] > 0
+
+
+def test_unsorted_file_spills_and_merges_runs(tmp_path):
+    stats = check_against_drop_duplicates(tmp_path, 'shuffled')
+    assert not stats['in_user_order']
+    assert stats['run_merges'] > 0
+
+
+def test_broken_order_searches_the_ordered_run(tmp_path):
+    stats = check_against_drop_duplicates(tmp_path, 'broken')
+    assert not stats['in_user_order']
+    assert stats['keys_spilled'] > 0
+
+
+def test_merged_runs_keep_every_key(tmp_path):
+    seen = SeenPairs(100, tmp_path)
+    keys = np.random.default_rng(1).permutation(np.arange(0, 50_000, 2, dtype=np.int64))
+    for start in range(0, len(keys), 150):
+        seen.add(np.sort(keys[start:start + 150]))
+    assert seen.merges > 0
+    assert len(seen._runs) < RUN_MERGE_FANIN * 3
+    probe = np.arange(0, 50_000, dtype=np.int64)
+    assert (seen.contains(probe) == (probe % 2 == 0)).all()
+    seen.close()
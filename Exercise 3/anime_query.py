@@ -0,0 +1,208 @@
+import threading
+from collections import OrderedDict
+
+from pagination import build_seek_filter, decode_cursor, encode_cursor, parse_limit
+from premiered import MAX_YEAR, MIN_YEAR, year_range_ordinals
+
+# Range filters of /anime/query: parameter -> (field, operator, type, lowest value, highest value).
+# A min and a max on the same field are merged into one bounded range.
+RANGE_FILTERS = {
+    'min_score': ('Score', '$gte', float, 0, 10),
+    'max_score': ('Score', '$lte', float, 0, 10),
+    'min_episodes': ('Episodes', '$gte', int, 0, 100000),
+    'max_episodes': ('Episodes', '$lte', int, 0, 100000)
+}
+
+# Premiered year range, matched as a range of premiered_ordinal (see premiered.py)
+YEAR_FILTERS = ('min_year', 'max_year')
+
+# Set filters: parameter -> field. The values are comma separated, an anime matches if it has any
+# of them (genre_match=all: all of them). Genres is stored as a lowercase array, Type as a string.
+SET_FILTERS = {
+    'genres': 'Genres',
+    'type': 'Type'
+}
+MAX_SET_VALUES = 20
+
+# Orders of /anime/query?sort=, Id_anime breaks the ties so the results can be paged with a cursor
+QUERY_SORT_KEYS = {
+    'score': ('Score', -1),
+    'popularity': ('Popularity', -1),
+    'members': ('Members', -1),
+    'episodes': ('Episodes', -1),
+    'premiered': ('premiered_ordinal', -1),
+    'id': ('Id_anime', 1)
+}
+DEFAULT_QUERY_SORT = 'score'
+
+PLAN_CACHE_SIZE = 256
+
+
+def parse_number(args, parameter, number_type, low, high):
+    raw_value = args[parameter]
+    try:
+        value = number_type(raw_value)
+    except ValueError:
+        raise ValueError(f"'{parameter}' must be a number, got {raw_value!r}")
+    if not low <= value <= high:
+        raise ValueError(f"'{parameter}' must be between {low} and {high}")
+    return value
+
+
+def parse_query_parameters(args):
+    # Validate the filters of /anime/query, returns a dict of parameter -> value.
+    # Raises ValueError on unknown values, out of range numbers and empty ranges.
+    parameters = {}
+    for parameter, (_, _, number_type, low, high) in RANGE_FILTERS.items():
+        if args.get(parameter):
+            parameters[parameter] = parse_number(args, parameter, number_type, low, high)
+    for parameter in YEAR_FILTERS:
+        if args.get(parameter):
+            parameters[parameter] = parse_number(args, parameter, int, MIN_YEAR, MAX_YEAR)
+    for parameter, field in SET_FILTERS.items():
+        if args.get(parameter):
+            values = sorted({value.strip() for value in args[parameter].split(',') if value.strip()})
+            if len(values) > MAX_SET_VALUES:
+                raise ValueError(f"'{parameter}' accepts at most {MAX_SET_VALUES} values")
+            if field == 'Genres':
+                values = sorted({value.lower() for value in values})
+            if values:
+                parameters[parameter] = values
+
+    genre_match = args.get('genre_match', 'any')
+    if genre_match not in ('any', 'all'):
+        raise ValueError(f"'genre_match' must be 'any' or 'all', got {genre_match!r}")
+    if genre_match == 'all' and len(parameters.get('genres', [])) > 1:
+        parameters['genre_match'] = 'all'
+
+    sort = args.get('sort', DEFAULT_QUERY_SORT)
+    if sort not in QUERY_SORT_KEYS:
+        raise ValueError(f"'sort' must be one of {', '.join(QUERY_SORT_KEYS)}, got {sort!r}")
+    parameters['sort'] = sort
+
+    for low, high in (('min_score', 'max_score'), ('min_episodes', 'max_episodes'), ('min_year', 'max_year')):
+        if low in parameters and high in parameters and parameters[low] > parameters[high]:
+            raise ValueError(f"'{low}' must not be greater than '{high}'")
+    return parameters
+
+
+def get_query_shape(parameters):
+    # Queries with the same filters and sort but other values share a plan. One or several values
+    # of a set filter give different match operators, so they are different shapes.
+    shape = []
+    for parameter, value in sorted(parameters.items()):
+        if isinstance(value, list):
+            shape.append((parameter, 'one' if len(value) == 1 else 'many'))
+        elif parameter in ('sort', 'genre_match'):
+            shape.append((parameter, value))
+        else:
+            shape.append((parameter, None))
+    return tuple(shape)
+
+
+class QueryPlan:
+    # Compiled form of one query shape: which field every parameter goes to and with which operator,
+    # and the sort of the pipeline. bind() fills in the values of a request.
+
+    def __init__(self, shape):
+        self.shape = shape
+        parameters = dict(shape)
+        self.sort_spec = [QUERY_SORT_KEYS[parameters['sort']]]
+        if self.sort_spec[0][0] != 'Id_anime':
+            self.sort_spec.append(('Id_anime', 1))
+
+        # Equality (and $in) filters first, then the ranges: the order of the indexes created by
+        # indexes.py (Genres or Type, then the sort field), see get_top_k_indexes in top_k.py
+        self.set_filters = []
+        for parameter, field in SET_FILTERS.items():
+            if parameter in parameters:
+                if parameters[parameter] == 'one':
+                    operator = None
+                elif parameter == 'genres' and parameters.get('genre_match') == 'all':
+                    operator = '$all'  # Type is a single string, an anime can only match one of several types
+                else:
+                    operator = '$in'
+                self.set_filters.append((parameter, field, operator))
+        self.range_filters = [(parameter, field, operator) for parameter, (field, operator, *_) in RANGE_FILTERS.items()
+                              if parameter in parameters]
+        self.year_range = 'min_year' in parameters or 'max_year' in parameters
+
+    def build_match(self, parameters):
+        match = {}
+        for parameter, field, operator in self.set_filters:
+            values = parameters[parameter]
+            match[field] = values[0] if operator is None else {operator: values}
+        for parameter, field, operator in self.range_filters:
+            match.setdefault(field, {})[operator] = parameters[parameter]
+        if self.year_range:
+            bounds = year_range_ordinals(parameters.get('min_year'), parameters.get('max_year'))
+            match.setdefault('premiered_ordinal', {}).update(bounds)
+        # Documents without a number in the sort field are not ranked
+        sort_field = self.sort_spec[0][0]
+        match[sort_field] = dict(match.get(sort_field, {}), **{'$type': 'number'})
+        return match
+
+    def bind(self, parameters, limit, after=None, fields=None):
+        # Pipeline of one page: the filters, the seek predicate of the cursor, the sort and the limit.
+        # One extra document is read to know whether there is a next page.
+        match = self.build_match(parameters)
+        if after:
+            match = {'$and': [match, build_seek_filter(self.sort_spec, decode_cursor(after, self.sort_spec))]}
+        pipeline = [
+            {'$match': match},
+            {'$sort': dict(self.sort_spec)},
+            {'$limit': limit + 1}
+        ]
+        projection = dict.fromkeys(fields + [field for field, _ in self.sort_spec], 1) if fields else {}
+        projection['_id'] = 0
+        pipeline.append({'$project': projection})
+        return pipeline
+
+
+class PlanCache:
+    # LRU cache of the compiled QueryPlans, keyed by query shape
+
+    def __init__(self, max_plans=PLAN_CACHE_SIZE):
+        self.max_plans = max_plans
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_plan(self, parameters):
+        shape = get_query_shape(parameters)
+        with self._lock:
+            plan = self._plans.get(shape)
+            if plan is not None:
+                self._plans.move_to_end(shape)
+                self.hits += 1
+                return plan
+            self.misses += 1
+        plan = QueryPlan(shape)
+        with self._lock:
+            self._plans[shape] = plan
+            while len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        return plan
+
+    def stats(self):
+        with self._lock:
+            return {'plans': len(self._plans), 'plan_hits': self.hits, 'plan_misses': self.misses}
+
+
+def run_query(collection, plan_cache, args, fields=None):
+    # One page of the anime matching the filters of a request.
+    # Returns the validated parameters, the documents and the token of the next page (None on the last page).
+    parameters = parse_query_parameters(args)
+    limit = parse_limit(args.get('limit'))
+    plan = plan_cache.get_plan(parameters)
+    documents = list(collection.aggregate(plan.bind(parameters, limit, args.get('after'), fields)))
+    has_more = len(documents) > limit
+    documents = documents[:limit]
+    next_cursor = encode_cursor(documents[-1], plan.sort_spec) if has_more else None
+    if fields:
+        for document in documents:
+            for field, _ in plan.sort_spec:
+                if field not in fields:
+                    document.pop(field, None)
+    return parameters, documents, next_cursor
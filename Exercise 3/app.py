@@ -1,73 +1,341 @@
-import pymongo
-from flask import Flask, render_template, jsonify
-import logging
-from filter_views import create_views_with_filters
-from aggregation_views import create_aggregation_views
-
-
-app = Flask(__name__)
-
-# Connect to MongoDB
-client = pymongo.MongoClient("mongodb://localhost:27017/")
-db = client["myanimelist_db"]
-# Create filter and aggregation views
-create_views_with_filters(db)
-# Krijo agregimet (views) me pipeline përkatëse
-create_aggregation_views(db)
-
-
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-@app.route('/anime/<view_name>')
-def get_anime_data(view_name):
-    try:
-        anime_list = list(db[view_name].find({}, {'_id': 0}))  # Exclude the _id field from the result
-        return jsonify(anime_list)
-    except Exception as e:
-        logging.error(f"Error fetching data for view '{view_name}': {e}")
-        return jsonify({"error": str(e)}), 500
-
-@app.route('/view/<view_name>')
-def render_table_view(view_name):
-    # Mapping view names to their corresponding template files and human-readable titles
-    view_map = {
-        'high_score_anime': 'high_score_anime.html',
-        'action_anime': 'action_anime.html',
-        'long_series': 'long_series.html',
-        'recent_anime': 'recent_anime.html',
-        'popular_anime': 'popular_anime.html',
-        'average_score_anime': 'average_score_anime.html',
-        'average_score_per_genre': 'average_score_per_genre.html',
-        'total_anime_per_studio': 'total_anime_per_studio.html',
-        'top_10_highest_rated_anime': 'top_10_highest_rated_anime.html',
-        'total_episodes_per_studio': 'total_episodes_per_studio.html',
-        'top_10_most_popular_anime': 'top_10_most_popular_anime.html',
-        'count_anime_by_type': 'count_anime_by_type.html'
-    }
-
-    # Get the template file name and title for the given view name
-    template_file = view_map.get(view_name)
-    view_title = {
-        'high_score_anime': 'High Score Anime',
-        'action_anime': 'Action Anime',
-        'long_series': 'Long Series Anime',
-        'recent_anime': 'Recent Anime',
-        'popular_anime': 'Popular Anime',
-        'average_score_anime': 'Average Score Anime',
-        'average_score_per_genre': 'Average Score per Genre',
-        'total_anime_per_studio': 'Total Anime per Studio',
-        'top_10_highest_rated_anime': 'Top 10 Highest Rated Anime',
-        'total_episodes_per_studio': 'Total Episodes per Studio',
-        'top_10_most_popular_anime': 'Top 10 Most Popular Anime',
-        'count_anime_by_type': 'Total number for each type'
-    }.get(view_name, "Anime View")
-
-    if template_file:
-        return render_template(template_file, view_name=view_name, view_title=view_title)
-    else:
-        return "View not found", 404  # Return a 404 error if the view doesn't exist
-    
-if __name__ == '__main__':
-    app.run(debug=True)
+import concurrent.futures
+import functools
+import pymongo
+from flask import Flask, render_template, jsonify, request, Response, stream_with_context
+import logging
+from bson import json_util
+from pagination import VIEW_SORT_KEYS, find_page, parse_fields, parse_limit, stream_ndjson
+from materialized_views import get_staleness
+from premiered import count_per_season, parse_year
+from search import TitleIndex, parse_search_query, search_anime
+from statistics_store import STATISTICS_FIELDS, get_field_statistics
+from anime_query import PlanCache, run_query
+from top_k import DOCUMENT_METRICS, GROUP_METRICS, parse_top_query, top_documents, top_groups
+from response_cache import DataGenerationWatcher, ResponseCache, bump_data_generation, cached_view
+from single_flight import SingleFlight
+from query_metrics import query_metrics
+from view_templates import VIEW_FIELDS, VIEW_TEMPLATES, VIEW_TITLES
+from payload_formats import make_payload_response, parse_format
+from serializers import RAW_BSON_OPTIONS, dumps_raw_documents, make_json_provider, raw_documents_available
+
+
+# JSON serializer of the responses: 'flask', 'orjson' or 'bsonjs' (see serializers.py),
+# benchmark_serializers.py compares them
+JSON_SERIALIZER = 'orjson'
+
+app = Flask(__name__)
+app.json = make_json_provider(app, JSON_SERIALIZER)
+
+# Connect to MongoDB. The client keeps a pool of connections that is shared by all request threads.
+# The views and indexes are not created here, run 'python migrate.py' once after loading the data.
+# Every command is timed by query_metrics, see /metrics and /metrics/slow_queries.
+client = pymongo.MongoClient("mongodb://localhost:27017/", maxPoolSize=50, minPoolSize=5,
+                             event_listeners=[query_metrics])
+db = client["myanimelist_db"]
+
+# Cache of the view responses. The 'anime' collection only changes when insert_data.py or migrate.py
+# is rerun, and both bump the data generation stamp (see data_generation below), so the TTLs are only a safety net.
+response_cache = ResponseCache(
+    max_bytes=64 * 1024 * 1024,
+    default_ttl=300,
+    view_ttls={
+        'average_score_per_genre': 3600,
+        'total_anime_per_studio': 3600,
+        'total_episodes_per_studio': 3600,
+        'count_anime_by_type': 3600
+    }
+)
+
+# Identical /anime/<view_name> requests that miss the cache at the same time (a dashboard loading
+# several aggregation views for several users) run the view query once and share its response
+view_requests = SingleFlight()
+
+# Compiled /anime/query pipelines, one per combination of filters and sort
+query_plans = PlanCache()
+
+# Anime titles in memory for /search?mode=autocomplete, reloaded with the data (see data_generation)
+title_index = TitleIndex()
+
+def drop_cached_data():
+    response_cache.invalidate()
+    title_index.refresh(db['anime'])
+
+# Every worker process compares the data generation stamp in MongoDB with the one its caches were
+# filled under, at most every DATA_GENERATION_POLL_SECONDS, and drops them when the data was reloaded
+data_generation = DataGenerationWatcher(db, drop_cached_data)
+
+# Views of one /anime/batch request are read in parallel on these threads, each on its own pooled connection
+MAX_BATCH_VIEWS = len(VIEW_SORT_KEYS)
+batch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=16)
+
+@app.before_request
+def check_data_generation():
+    data_generation.check()
+
+@app.after_request
+def record_response_bytes(response):
+    # Only known views get a view label, so the labels stay bounded. Streamed responses have no length.
+    if request.endpoint is not None and response.content_length is not None:
+        view_name = (request.view_args or {}).get('view_name')
+        query_metrics.observe_response_bytes(request.endpoint, view_name if view_name in VIEW_SORT_KEYS else '',
+                                             response.content_length)
+    return response
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+def get_view_fields(view_name, raw_fields):
+    # fields=template selects the fields shown by the template of the view (all fields if it has none)
+    if raw_fields == 'template':
+        return VIEW_FIELDS.get(view_name)
+    return parse_fields(raw_fields)
+
+def make_projection(fields):
+    projection = dict.fromkeys(fields or [], 1)
+    projection['_id'] = 0
+    return projection
+
+def known_view(view_function):
+    # Unknown view names get a 404 before the response cache and the view metrics see them,
+    # so neither grows with the names requested
+    @functools.wraps(view_function)
+    def wrapper(view_name):
+        if view_name not in VIEW_SORT_KEYS:
+            return jsonify({"error": f"Unknown view '{view_name}'"}), 404
+        return view_function(view_name)
+    return wrapper
+
+def read_view(view_name, limit, fields):
+    # One view of a batch: a page of 'limit' documents (with its 'next' cursor) or the whole view
+    with query_metrics.time_view(view_name, 'batch'):
+        if limit is not None:
+            anime_list, next_cursor = find_page(db[view_name], view_name, limit, fields=fields)
+            return {'data': anime_list, 'next': next_cursor}
+        return {'data': list(db[view_name].find({}, make_projection(fields)))}
+
+@app.route('/anime/batch')
+def get_anime_batch():
+    # Read several views in one request: /anime/batch?views=a,b,c
+    # Optional query parameters, for all views or for one view with the '<view_name>.' prefix:
+    #   limit=<n>              return the first page of n documents and its 'next' cursor
+    #   fields=<f1>,<f2>       only return these fields (fields=template: the fields shown by the view's template)
+    # A view that fails gets an 'error' entry, the other views are still returned.
+    view_names = [name.strip() for name in request.args.get('views', '').split(',') if name.strip()]
+    if not view_names:
+        return jsonify({"error": "'views' must list at least one view, e.g. views=a,b,c"}), 400
+    if len(view_names) > MAX_BATCH_VIEWS:
+        return jsonify({"error": f"At most {MAX_BATCH_VIEWS} views can be requested at once"}), 400
+
+    results, futures = {}, {}
+    for view_name in dict.fromkeys(view_names):
+        if view_name not in VIEW_SORT_KEYS:
+            results[view_name] = {'error': f"Unknown view '{view_name}'"}
+            continue
+        try:
+            raw_limit = request.args.get(f'{view_name}.limit', request.args.get('limit'))
+            limit = parse_limit(raw_limit) if raw_limit is not None else None
+            fields = get_view_fields(view_name, request.args.get(f'{view_name}.fields', request.args.get('fields')))
+        except ValueError as e:
+            results[view_name] = {'error': str(e)}
+            continue
+        futures[view_name] = batch_executor.submit(read_view, view_name, limit, fields)
+
+    for view_name, future in futures.items():
+        try:
+            results[view_name] = future.result()
+        except Exception as e:
+            logging.error(f"Error fetching data for view '{view_name}' in a batch: {e}")
+            results[view_name] = {'error': str(e)}
+
+    results = {view_name: results[view_name] for view_name in dict.fromkeys(view_names)}  # in the requested order
+    errors = sum(1 for result in results.values() if 'error' in result)
+    return jsonify({'views': results, 'errors': errors})
+
+@app.route('/anime/query')
+def query_anime():
+    # Anime matching filters given as parameters instead of a view per threshold:
+    #   min_score, max_score, min_episodes, max_episodes, min_year, max_year   ranges (bounds included)
+    #   genres=<g1>,<g2>   any of these genres (genre_match=all: all of them), type=<t1>,<t2>
+    #   sort=<key>         score (default), popularity, members, episodes, premiered (newest first) or id
+    #   limit=<n>, after=<token>, fields=<f1>,<f2>   paging and projection, as for /anime/<view_name>
+    try:
+        parameters, anime_list, next_cursor = run_query(db['anime'], query_plans, request.args,
+                                                        parse_fields(request.args.get('fields')))
+        return jsonify({'filters': parameters, 'data': anime_list, 'next': next_cursor})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error querying anime: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/anime/<view_name>')
+@known_view
+@cached_view(response_cache, bypass=lambda: request.args.get('format') == 'ndjson' or request.cache_control.no_cache,
+             coalesce=view_requests)
+def get_anime_data(view_name):
+    # Optional query parameters:
+    #   limit=<n>         return one page of n documents plus a 'next' cursor
+    #   after=<token>     continue after the page that returned this cursor
+    #   fields=<f1>,<f2>  only read and return these fields, fields=template for the fields its template shows
+    #   format=<name>     json (default), columnar, msgpack, or ndjson to stream the documents
+    after = request.args.get('after')
+    with query_metrics.time_view(view_name, 'read'):
+        try:
+            fields = get_view_fields(view_name, request.args.get('fields'))
+            if request.args.get('format') == 'ndjson':
+                limit = parse_limit(request.args['limit']) if 'limit' in request.args else None
+                lines = stream_ndjson(db[view_name], view_name, after=after, limit=limit, fields=fields)
+                return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+            payload_format = parse_format(request.args.get('format'))
+
+            if 'limit' in request.args or after:
+                limit = parse_limit(request.args.get('limit'))
+                anime_list, next_cursor = find_page(db[view_name], view_name, limit, after=after, fields=fields)
+                return make_payload_response(anime_list, payload_format, next_cursor, paged=True)
+
+            if payload_format == 'json' and raw_documents_available(JSON_SERIALIZER):
+                # Whole views are the largest responses, convert them from BSON to JSON without building dicts
+                raw_view = db[view_name].with_options(codec_options=RAW_BSON_OPTIONS)
+                return Response(dumps_raw_documents(raw_view.find({}, make_projection(fields))),
+                                mimetype='application/json')
+
+            anime_list = list(db[view_name].find({}, make_projection(fields)))  # Exclude the _id field from the result
+            return make_payload_response(anime_list, payload_format)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            logging.error(f"Error fetching data for view '{view_name}': {e}")
+            return jsonify({"error": str(e)}), 500
+
+@app.route('/materialized_views')
+def get_materialized_views_status():
+    # How stale every materialized view is (last refresh time and source documents not yet processed)
+    try:
+        return jsonify(get_staleness(db))
+    except Exception as e:
+        logging.error(f"Error fetching materialized view status: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/top/<metric>')
+def get_top(metric):
+    # The k best anime or groups for a metric: /top/score?k=25&genre=action&type=TV&min_score=8
+    # Anime metrics: score, popularity, members, episodes (fields=<f1>,<f2> limits the returned fields).
+    # Group metrics: genres_by_score, genres_by_count, studios_by_score, studios_by_count,
+    # producers_by_score, producers_by_count.
+    if metric not in DOCUMENT_METRICS and metric not in GROUP_METRICS:
+        metrics = ', '.join(list(DOCUMENT_METRICS) + list(GROUP_METRICS))
+        return jsonify({"error": f"Unknown metric '{metric}', expected one of {metrics}"}), 404
+    try:
+        k, filters = parse_top_query(request.args)
+        if metric in DOCUMENT_METRICS:
+            data = top_documents(db, metric, k, filters, parse_fields(request.args.get('fields')))
+        else:
+            data = top_groups(db, metric, k, filters)
+        return jsonify({'metric': metric, 'k': k, 'filters': filters, 'data': data})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error fetching the top {metric}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/seasons')
+def get_season_counts():
+    # Number of anime per premiere season in chronological order, /seasons?from_year=2015&to_year=2023
+    try:
+        first_year, last_year = parse_year(request.args, 'from_year'), parse_year(request.args, 'to_year')
+        if first_year is not None and last_year is not None and first_year > last_year:
+            raise ValueError("'from_year' must not be greater than 'to_year'")
+        return jsonify({'from_year': first_year, 'to_year': last_year,
+                        'data': count_per_season(db['anime'], first_year, last_year)})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error counting the anime per season: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/search')
+def get_search_results():
+    # Anime whose name, English name or synopsis contain the words of q, the most relevant first:
+    #   /search?q=<words>&page=<n>&limit=<n>&fields=<f1>,<f2>
+    # mode=autocomplete suggests titles with a word starting with q from the in-memory title index:
+    #   /search?q=<prefix>&mode=autocomplete&limit=<n>
+    try:
+        query, page, limit = parse_search_query(request.args)
+        if request.args.get('mode') == 'autocomplete':
+            return jsonify({'query': query, 'data': title_index.complete(db['anime'], query, limit)})
+        if request.args.get('mode', 'search') != 'search':
+            raise ValueError(f"'mode' must be 'search' or 'autocomplete', got {request.args['mode']!r}")
+        with query_metrics.time_view('search', 'read'):
+            anime_list, has_more = search_anime(db['anime'], query, page, limit, parse_fields(request.args.get('fields')))
+        return jsonify({'query': query, 'page': page, 'data': anime_list, 'next_page': page + 1 if has_more else None})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        logging.error(f"Error searching for {request.args.get('q')!r}: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/statistics/<field>')
+def get_statistics(field):
+    # Running aggregates (count, sum, min, max, mean, quantiles) of a numeric field of 'anime',
+    # read from the statistics store instead of scanning the collection
+    if field not in STATISTICS_FIELDS['anime']:
+        return jsonify({"error": f"No statistics for field '{field}'"}), 404
+    try:
+        statistics = get_field_statistics(db, 'anime', field)
+        if statistics is None:
+            return jsonify({"error": f"The statistics of '{field}' are not built yet, run insert_data.py"}), 404
+        return jsonify(statistics)
+    except Exception as e:
+        logging.error(f"Error fetching the statistics of '{field}': {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/cache/stats')
+def get_cache_stats():
+    # 'coalesced' is the number of view queries saved by request coalescing
+    # 'plan_hits' is the number of /anime/query requests that reused a compiled pipeline
+    return jsonify(dict(response_cache.stats(), **view_requests.stats(), **query_plans.stats(), **title_index.stats(),
+                        **data_generation.stats()))
+
+@app.route('/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    # Drop the cached responses of every app process, after the data was changed without
+    # insert_data.py or migrate.py. The other processes drop them at their next poll of the stamp.
+    try:
+        stamp = bump_data_generation(db, 'POST /cache/invalidate')
+        drop_cached_data()
+        return jsonify({'data_generation': str(stamp)})
+    except Exception as e:
+        logging.error(f"Error bumping the data generation: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/metrics')
+def get_metrics():
+    # Latency histograms and documents returned per MongoDB command and view, response sizes per endpoint and view, in the Prometheus text format
+    body = query_metrics.render_prometheus() + view_requests.render_prometheus('anime_view_requests')
+    return Response(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/metrics/slow_queries')
+def get_slow_queries():
+    # The commands slower than MONGO_SLOW_QUERY_MS with their query and plan.
+    # json_util keeps the ObjectIds and dates of the filters readable.
+    try:
+        return Response(json_util.dumps(query_metrics.get_slow_queries(client)), mimetype='application/json')
+    except Exception as e:
+        logging.error(f"Error fetching the slow queries: {e}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/view/<view_name>')
+@cached_view(response_cache)
+def render_table_view(view_name):
+    # Get the template file name and title for the given view name
+    template_file = VIEW_TEMPLATES.get(view_name)
+    view_title = VIEW_TITLES.get(view_name, "Anime View")
+
+    if template_file:
+        return render_template(template_file, view_name=view_name, view_title=view_title)
+    else:
+        return "View not found", 404  # Return a 404 error if the view doesn't exist
+    
+if __name__ == '__main__':
+    app.run(debug=True)
@@ -0,0 +1,127 @@
+# Async (ASGI) variant of the /anime/<view_name> and /view/<view_name> endpoints of app.py.
+#
+# Usage:
+#   pip install quart motor
+#   hypercorn async_app:app --bind localhost:8000
+#
+# Quart keeps the Flask API and Motor is the asyncio MongoDB driver: requests are coroutines on one
+# event loop, and Motor runs the blocking PyMongo calls on its own thread pool, so a request waiting
+# on MongoDB holds a pool thread for the duration of the call but not a request worker.
+# Every query runs with a time limit (REQUEST_TIMEOUT_SECONDS, also sent to the server as maxTimeMS),
+# and when the client disconnects Quart cancels the request, which kills the query on the server. app.py stays the synchronous reference,
+# load_test.py compares both.
+import asyncio
+import logging
+import uuid
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import ExecutionTimeout
+from quart import Quart, jsonify, render_template, request
+
+from pagination import VIEW_SORT_KEYS, build_seek_filter, decode_cursor, encode_cursor, get_sort_spec, parse_limit
+from view_templates import VIEW_TEMPLATES, VIEW_TITLES
+
+MONGO_URI = "mongodb://localhost:27017/"
+DATABASE_NAME = "myanimelist_db"
+
+# Requests that take longer get a 504, the server stops the query at the same time
+REQUEST_TIMEOUT_SECONDS = 10
+
+app = Quart(__name__)
+
+# One client, and so one connection pool, shared by every request of the process.
+# It is created in before_serving because Motor binds to the running event loop.
+client = None
+db = None
+
+
+@app.before_serving
+async def connect():
+    global client, db
+    client = AsyncIOMotorClient(MONGO_URI, maxPoolSize=100, minPoolSize=5)
+    db = client[DATABASE_NAME]
+
+
+@app.after_serving
+async def disconnect():
+    client.close()
+
+
+async def kill_query(tag):
+    # Kill the server operations tagged with 'tag' (the find/aggregate and its getMores)
+    try:
+        async for operation in client.admin.aggregate([
+            {'$currentOp': {}},
+            {'$match': {'$or': [{'command.comment': tag}, {'cursor.originatingCommand.comment': tag}]}}
+        ]):
+            await client.admin.command('killOp', op=operation['opid'])
+    except Exception as e:
+        logging.error(f"Could not kill the query '{tag}': {e}")
+
+
+async def run_query(collection, query, projection=None, sort_spec=None, limit=None):
+    # Read the documents of a view. The query is tagged with a comment so that it can be found
+    # and killed on the server when the request times out or the client goes away.
+    tag = uuid.uuid4().hex
+    cursor = collection.find(query, projection, comment=tag)
+    cursor = cursor.max_time_ms(REQUEST_TIMEOUT_SECONDS * 1000)
+    if sort_spec is not None:
+        cursor = cursor.sort(sort_spec)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    try:
+        return await asyncio.wait_for(cursor.to_list(length=None), REQUEST_TIMEOUT_SECONDS)
+    except (asyncio.CancelledError, asyncio.TimeoutError):
+        # shield: the request task is being cancelled, the cleanup must still run to completion
+        await asyncio.shield(kill_query(tag))
+        raise
+    finally:
+        await cursor.close()
+
+
+@app.route('/anime/<view_name>')
+async def get_anime_data(view_name):
+    # Same parameters and responses as app.py: the whole view, or with limit=<n> and after=<token>
+    # one page plus a 'next' cursor. NDJSON streaming is only served by app.py.
+    if view_name not in VIEW_SORT_KEYS:
+        return jsonify({"error": f"Unknown view '{view_name}'"}), 404
+    after = request.args.get('after')
+    try:
+        if 'limit' in request.args or after:
+            limit = parse_limit(request.args.get('limit'))
+            sort_spec = get_sort_spec(view_name)
+            query = build_seek_filter(sort_spec, decode_cursor(after, sort_spec)) if after else {}
+
+            # Fetch one extra document to know whether there is a next page
+            documents = await run_query(db[view_name], query, sort_spec=sort_spec, limit=limit + 1)
+            has_more = len(documents) > limit
+            documents = documents[:limit]
+            next_cursor = encode_cursor(documents[-1], sort_spec) if has_more else None
+            for document in documents:
+                document.pop('_id', None)
+            return jsonify({'data': documents, 'next': next_cursor})
+
+        anime_list = await run_query(db[view_name], {}, {'_id': 0})  # Exclude the _id field from the result
+        return jsonify(anime_list)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except (asyncio.TimeoutError, ExecutionTimeout):
+        return jsonify({"error": f"Reading view '{view_name}' took more than {REQUEST_TIMEOUT_SECONDS} s"}), 504
+    except Exception as e:
+        logging.error(f"Error fetching data for view '{view_name}': {e}")
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/view/<view_name>')
+async def render_table_view(view_name):
+    template_file = VIEW_TEMPLATES.get(view_name)
+    view_title = VIEW_TITLES.get(view_name, "Anime View")
+
+    if template_file:
+        return await render_template(template_file, view_name=view_name, view_title=view_title)
+    else:
+        return "View not found", 404
+
+
+if __name__ == '__main__':
+    app.run(port=8000)
@@ -0,0 +1,104 @@
+# Compare the JSON serializers of serializers.py on a view-sized result.
+#
+# Usage:
+#   python benchmark_serializers.py --documents 10000 --output serializers.json
+#
+# Every path starts from the BSON bytes MongoDB sends and ends with the JSON response body,
+# so the dict-building step of PyMongo is measured too:
+#   flask   bson.decode to dicts, Flask's default JSON provider
+#   orjson  bson.decode to dicts, the orjson provider
+#   bsonjs  RawBSONDocument (no dicts), python-bsonjs
+# The documents look like the ones of the 'anime' collection (ObjectId, strings, lists, numbers, dates).
+import argparse
+import datetime
+import json
+import random
+import time
+
+import bson
+from bson import Decimal128, ObjectId
+from flask import Flask
+
+from serializers import RAW_BSON_OPTIONS, BsonJSONProvider, OrjsonProvider, bsonjs, dumps_raw_documents, orjson
+
+GENRES = ['action', 'adventure', 'comedy', 'drama', 'fantasy', 'romance', 'sci-fi', 'slice of life']
+
+
+def make_documents(count, seed=0):
+    rng = random.Random(seed)
+    return [{
+        '_id': ObjectId(),
+        'Id_anime': i,
+        'Name': f'Anime {i}',
+        'English name': f'English title of anime {i}',
+        'Score': round(rng.uniform(1, 10), 2),
+        'Episodes': rng.randint(1, 500),
+        'Genres': rng.sample(GENRES, rng.randint(1, 4)),
+        'Members': rng.randint(0, 3_000_000),
+        'Synopsis': ' '.join(rng.choice(GENRES) for _ in range(80)),
+        'Image URL': f'https://cdn.myanimelist.net/images/anime/{i}.jpg',
+        'Aired': datetime.datetime(2000, 1, 1) + datetime.timedelta(days=rng.randint(0, 9000)),
+        'Rating': Decimal128(str(round(rng.uniform(0, 10), 3)))
+    } for i in range(count)]
+
+
+def serialize_with_provider(provider):
+    def serialize(bson_documents):
+        documents = [bson.decode(raw) for raw in bson_documents]
+        return provider.dumps(documents).encode('utf-8')
+    return serialize
+
+
+def serialize_raw(bson_documents):
+    return dumps_raw_documents(bson.decode(raw, codec_options=RAW_BSON_OPTIONS) for raw in bson_documents)
+
+
+def benchmark(serialize, bson_documents, repeats):
+    # One 'request' serializes the whole result, the best of 'repeats' runs is kept
+    body = serialize(bson_documents)  # warm-up, and the size of the output
+    wall_times, cpu_times = [], []
+    for _ in range(repeats):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        serialize(bson_documents)
+        wall_times.append(time.perf_counter() - wall_start)
+        cpu_times.append(time.process_time() - cpu_start)
+    return {
+        'documents_per_second': round(len(bson_documents) / min(wall_times)),
+        'cpu_ms_per_request': round(min(cpu_times) * 1000, 2),
+        'body_bytes': len(body)
+    }
+
+
+def run(count, repeats):
+    app = Flask(__name__)
+    bson_documents = [bson.encode(document) for document in make_documents(count)]
+    serializers = {'flask': serialize_with_provider(BsonJSONProvider(app))}
+    if orjson is not None:
+        serializers['orjson'] = serialize_with_provider(OrjsonProvider(app))
+    if bsonjs is not None:
+        serializers['bsonjs'] = serialize_raw
+
+    results = {}
+    print(f"{'serializer':<10} {'docs/s':>12} {'CPU ms/request':>15} {'bytes':>12} {'speedup':>8}")
+    for name, serialize in serializers.items():
+        results[name] = benchmark(serialize, bson_documents, repeats)
+        speedup = results[name]['documents_per_second'] / results['flask']['documents_per_second']
+        print(f"{name:<10} {results[name]['documents_per_second']:>12} {results[name]['cpu_ms_per_request']:>15} "
+              f"{results[name]['body_bytes']:>12} {speedup:>7.1f}x")
+    for name in ('orjson', 'bsonjs'):
+        if name not in serializers:
+            print(f"{name} is not installed, skipped.")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the JSON serializers of the anime app.")
+    parser.add_argument('--documents', type=int, default=10000, help="Documents per request")
+    parser.add_argument('--repeats', type=int, default=10)
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run(args.documents, args.repeats)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
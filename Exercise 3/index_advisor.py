@@ -0,0 +1,402 @@
+# Check the indexes of a database against the queries that actually run on it.
+#
+# Usage:
+#   python index_advisor.py                        explain every query and write index_report.json
+#   python index_advisor.py --db anime_db          check the database built by exercise3/scripts
+#   python index_advisor.py --strict               exit with status 1 if a blocking issue is found
+#
+# Every registered MongoDB view is explained with executionStats, and so are the paged queries the
+# app runs on them (/anime/<view_name>?limit=) and, on a database with an 'anime' collection, the
+# queries of /search, /top/<metric>, /anime/query and /seasons with sample values (see
+# get_endpoint_queries). The report lists, per query, the plan stages, the
+# indexes used and the documents/keys examined, and the issues found:
+#   collscan        a filtered or sorted query scans the whole collection (blocking)
+#   in_memory_sort  the sort of a query is not served by an index (blocking)
+#   missing_field   an index is on a field that no document has (blocking)
+#   duplicate       an index is a prefix of another index and never needed (blocking)
+#   unused          an index is not used by any registered query (warning)
+# Queries that are blocked get an index proposal that follows the equality-sort-range rule.
+import argparse
+import datetime
+import json
+import sys
+
+import pymongo
+from pymongo.errors import OperationFailure
+
+from anime_query import QUERY_SORT_KEYS, QueryPlan, get_query_shape, parse_query_parameters
+from materialized_views import MATERIALIZED_SUFFIX
+from pagination import DEFAULT_PAGE_SIZE, VIEW_SORT_KEYS, get_sort_spec
+from premiered import season_count_pipeline
+from search import SEARCH_PAGE_SIZE, SEARCH_SORT, build_search_filter
+from top_k import DEFAULT_K, DOCUMENT_METRICS, build_top_documents_query
+
+MONGO_URI = "mongodb://localhost:27017/"
+DATABASE_NAME = "myanimelist_db"
+REPORT_FILE = 'index_report.json'
+
+# Issues that make --strict fail
+BLOCKING_ISSUES = ('collscan', 'in_memory_sort', 'missing_field', 'duplicate')
+
+# Stages that neither change the shape of the documents nor their fields, an index on the source
+# collection can still serve the '$match' and '$sort' stages found before any other stage
+SHAPE_PRESERVING_STAGES = ('$match', '$sort', '$limit', '$skip')
+
+# Query operators that select a single value (equality) as opposed to a range
+EQUALITY_OPERATORS = ('$eq', '$in')
+
+# Explain sections that describe plans the server did not pick
+REJECTED_PLAN_KEYS = ('rejectedPlans', 'allPlansExecution')
+
+# Values of the endpoint queries explained on the 'anime' collection. Only the shape of a query
+# decides its plan, one value per filter is enough.
+SAMPLE_SEARCH = 'naruto'
+SAMPLE_FILTERS = ({}, {'genre': 'action'}, {'type': 'TV'})
+SAMPLE_QUERY_ARGS = ({}, {'genres': 'action'}, {'genres': 'action,comedy', 'genre_match': 'all'}, {'type': 'TV'},
+                     {'min_year': '2010', 'max_year': '2020'})
+
+
+def resolve_view(views, name):
+    # Follow a chain of views down to the real collection.
+    # Returns the collection name and the full pipeline that runs on it.
+    pipeline = []
+    while name in views:
+        view = views[name]
+        pipeline = list(view.get('pipeline', [])) + pipeline
+        name = view['viewOn']
+    return name, pipeline
+
+
+def get_registered_queries(db):
+    # Every view of the database, plus the paged query of /anime/<view_name> for the views the app serves
+    views = {
+        info['name']: info['options']
+        for info in db.list_collections(filter={'type': 'view'})
+    }
+
+    queries = []
+    for view_name in sorted(views):
+        collection, pipeline = resolve_view(views, view_name)
+        queries.append({
+            'query': f'view:{view_name}',
+            'target': view_name,
+            'collection': collection,
+            'stages': [],
+            'pipeline': pipeline
+        })
+        if view_name in VIEW_SORT_KEYS:
+            stages = [{'$sort': dict(get_sort_spec(view_name))}, {'$limit': DEFAULT_PAGE_SIZE + 1}]
+            queries.append({
+                'query': f'endpoint:/anime/{view_name}?limit={DEFAULT_PAGE_SIZE}',
+                'target': view_name,
+                'collection': collection,
+                'stages': stages,
+                'pipeline': pipeline + stages
+            })
+    if 'anime' in db.list_collection_names(filter={'type': 'collection'}):
+        queries.extend(get_endpoint_queries())
+    return queries
+
+
+def get_endpoint_queries():
+    # The queries the app runs on 'anime' outside the views, built by the same functions as the endpoints,
+    # so the text index and the top-k and /anime/query indexes are checked and counted as used
+    pipelines = {
+        f'endpoint:/search?q={SAMPLE_SEARCH}': [
+            {'$match': build_search_filter(SAMPLE_SEARCH)},
+            {'$sort': dict(SEARCH_SORT)},
+            {'$limit': SEARCH_PAGE_SIZE + 1}
+        ],
+        'endpoint:/seasons': season_count_pipeline()
+    }
+    for metric in DOCUMENT_METRICS:
+        for filters in SAMPLE_FILTERS:
+            query, sort = build_top_documents_query(metric, filters)
+            arguments = ''.join(f'&{name}={value}' for name, value in filters.items())
+            pipelines[f'endpoint:/top/{metric}?k={DEFAULT_K}{arguments}'] = [
+                {'$match': query}, {'$sort': dict(sort)}, {'$limit': DEFAULT_K}
+            ]
+    for sort in QUERY_SORT_KEYS:
+        for args in SAMPLE_QUERY_ARGS:
+            parameters = parse_query_parameters(dict(args, sort=sort))
+            arguments = ''.join(f'&{name}={value}' for name, value in args.items())
+            pipelines[f'endpoint:/anime/query?sort={sort}{arguments}'] = QueryPlan(
+                get_query_shape(parameters)).bind(parameters, DEFAULT_PAGE_SIZE)
+
+    return [{'query': name, 'target': 'anime', 'collection': 'anime', 'stages': pipeline, 'pipeline': pipeline}
+            for name, pipeline in pipelines.items()]
+
+
+def explain_query(db, query):
+    return db.command({
+        'explain': {'aggregate': query['target'], 'pipeline': query['stages'], 'cursor': {}},
+        'verbosity': 'executionStats'
+    })
+
+
+def walk_plan(node, plan):
+    # Collect the stage and index names of the winning plan from any explain layout
+    # (find layer only, '$cursor' stage of an aggregation, or the slot based engine)
+    if isinstance(node, list):
+        for item in node:
+            walk_plan(item, plan)
+        return
+    if not isinstance(node, dict):
+        return
+    if isinstance(node.get('stage'), str):
+        plan['plan_stages'].add(node['stage'])
+    if isinstance(node.get('indexName'), str):
+        plan['indexes_used'].add(node['indexName'])
+    for key, value in node.items():
+        if key not in REJECTED_PLAN_KEYS:
+            walk_plan(value, plan)
+
+
+def find_execution_stats(node):
+    # First 'executionStats' section of an explain output
+    if isinstance(node, dict):
+        if isinstance(node.get('executionStats'), dict):
+            return node['executionStats']
+        children = node.values()
+    elif isinstance(node, list):
+        children = node
+    else:
+        return None
+    for child in children:
+        stats = find_execution_stats(child)
+        if stats is not None:
+            return stats
+    return None
+
+
+def summarize_explain(explain):
+    plan = {'plan_stages': set(), 'indexes_used': set()}
+    walk_plan(explain, plan)
+    pipeline_stages = [next(iter(stage)) for stage in explain.get('stages', [])]
+    stats = find_execution_stats(explain) or {}
+    return {
+        'plan_stages': sorted(plan['plan_stages']),
+        'pipeline_stages': pipeline_stages,
+        'indexes_used': sorted(plan['indexes_used']),
+        'collscan': 'COLLSCAN' in plan['plan_stages'],
+        'in_memory_sort': 'SORT' in plan['plan_stages'] or '$sort' in pipeline_stages,
+        'n_returned': stats.get('nReturned'),
+        'total_docs_examined': stats.get('totalDocsExamined'),
+        'total_keys_examined': stats.get('totalKeysExamined'),
+        'execution_time_ms': stats.get('executionTimeMillis')
+    }
+
+
+def get_indexable_prefix(pipeline):
+    # The '$match' filters and the last '$sort' found before the first stage that reshapes the documents,
+    # these are the only parts of a pipeline an index on the source collection can serve
+    filters, sort = [], None
+    for stage in pipeline:
+        operator = next(iter(stage))
+        if operator not in SHAPE_PRESERVING_STAGES:
+            break
+        if operator == '$match':
+            filters.append(stage['$match'])
+        elif operator == '$sort':
+            sort = stage['$sort']
+    return filters, sort
+
+
+def propose_index(pipeline):
+    # Equality-sort-range: fields matched on a single value first, then the sort keys, then range filters.
+    # Returns a list of [field, direction] pairs, or None if the pipeline has nothing an index can serve.
+    filters, sort = get_indexable_prefix(pipeline)
+    equality, ranges = [], []
+    for query_filter in filters:
+        for field, condition in query_filter.items():
+            if field.startswith('$'):
+                continue  # $or, $expr, $text... are not planned by this advisor
+            if isinstance(condition, dict) and any(op.startswith('$') for op in condition):
+                if all(op in EQUALITY_OPERATORS for op in condition):
+                    equality.append(field)
+                else:
+                    ranges.append(field)
+            else:
+                equality.append(field)
+
+    keys = [[field, 1] for field in equality]
+    # A sort on {'$meta': 'textScore'} cannot be served by an index, nor can its tie breakers
+    if sort and all(isinstance(direction, (int, float)) for direction in sort.values()):
+        keys.extend([field, direction] for field, direction in sort.items())
+    for field in ranges:
+        keys.append([field, 1])
+
+    proposal, seen = [], set()
+    for field, direction in keys:
+        if field not in seen:
+            seen.add(field)
+            proposal.append([field, direction])
+    return proposal or None
+
+
+def index_serves(index_key, proposal):
+    # True if an existing index starts with the proposed keys, in the same or in the reversed direction
+    prefix = index_key[:len(proposal)]
+    if [field for field, _ in prefix] != [field for field, _ in proposal]:
+        return False
+    directions = [direction for _, direction in prefix]
+    wanted = [direction for _, direction in proposal]
+    if directions == wanted:
+        return True
+    return all(isinstance(d, (int, float)) for d in directions) and directions == [-d for d in wanted]
+
+
+def describe_index(index):
+    key = [[field, int(direction) if isinstance(direction, (int, float)) else direction]
+           for field, direction in index['key'].items()]
+    if 'weights' in index:
+        fields = list(index['weights'])  # text index, the key only holds _fts/_ftsx
+    else:
+        fields = [field for field, _ in key]
+    return {
+        'name': index['name'],
+        'key': key,
+        'fields': fields,
+        'unique': bool(index.get('unique')),
+        'partial': 'partialFilterExpression' in index,
+        'sparse': bool(index.get('sparse'))
+    }
+
+
+def get_index_accesses(collection):
+    # Operations served by every index since the server started, None if $indexStats is not allowed
+    try:
+        return {stats['name']: stats['accesses']['ops'] for stats in collection.aggregate([{'$indexStats': {}}])}
+    except OperationFailure:
+        return None
+
+
+def check_indexes(db, collection_name, used_indexes, queried):
+    collection = db[collection_name]
+    indexes = [describe_index(index) for index in collection.list_indexes()]
+    accesses = get_index_accesses(collection)
+    has_documents = collection.find_one({}, {'_id': 1}) is not None
+    issues = []
+
+    for index in indexes:
+        index['accesses'] = accesses.get(index['name']) if accesses is not None else None
+        index['used_by'] = sorted(used_indexes.get(index['name'], []))
+        if index['name'] == '_id_':
+            continue
+
+        if has_documents:
+            for field in index['fields']:
+                if collection.find_one({field: {'$exists': True}}, {'_id': 1}) is None:
+                    issues.append({'type': 'missing_field', 'collection': collection_name,
+                                   'index': index['name'], 'field': field})
+
+        # A plain index that is a prefix of another index is never needed, the longer one serves its queries too
+        if not (index['unique'] or index['partial'] or index['sparse']):
+            for other in indexes:
+                if other is index or other['name'] == '_id_' or other['key'][:len(index['key'])] != index['key']:
+                    continue
+                # Of two identical indexes only the second one (by name) is reported
+                if len(other['key']) > len(index['key']) or other['name'] < index['name']:
+                    issues.append({'type': 'duplicate', 'collection': collection_name,
+                                   'index': index['name'], 'covered_by': other['name']})
+                    break
+
+        if queried and not index['used_by'] and not index['unique']:
+            issues.append({'type': 'unused', 'collection': collection_name, 'index': index['name'],
+                           'accesses': index['accesses']})
+    return indexes, issues
+
+
+def advise(db):
+    queries = get_registered_queries(db)
+    issues, proposals = [], {}
+    used_indexes = {}  # (collection, index name) -> queries that use it
+
+    for query in queries:
+        try:
+            query.update(summarize_explain(explain_query(db, query)))
+        except OperationFailure as e:
+            query['error'] = str(e)
+            print(f"Query '{query['query']}': explain failed ({e})")
+            continue
+
+        for index_name in query['indexes_used']:
+            used_indexes.setdefault((query['collection'], index_name), []).append(query['query'])
+
+        proposal = propose_index(query['pipeline'])
+        query['proposed_index'] = None
+        if proposal and (query['collscan'] or query['in_memory_sort']):
+            # Only the indexable prefix of the pipeline is considered, a '$sort' after a '$group' is always in memory
+            _, sort = get_indexable_prefix(query['pipeline'])
+            existing = [describe_index(index)['key'] for index in db[query['collection']].list_indexes()]
+            if not any(index_serves(key, proposal) for key in existing):
+                query['proposed_index'] = proposal
+                proposals.setdefault((query['collection'], json.dumps(proposal)), []).append(query['query'])
+                issue_type = 'collscan' if query['collscan'] else 'in_memory_sort'
+                if issue_type == 'collscan' or sort:
+                    issues.append({'type': issue_type, 'collection': query['collection'],
+                                   'query': query['query'], 'proposed_index': proposal})
+
+        print(f"Query '{query['query']}': {', '.join(query['plan_stages'])}, "
+              f"{query['total_docs_examined']} documents examined for {query['n_returned']} returned")
+
+    queried_collections = {query['collection'] for query in queries}
+    collections = sorted(
+        info['name'] for info in db.list_collections(filter={'type': 'collection'})
+        if not info['name'].startswith('system.')
+    )
+    index_report = {}
+    for collection_name in collections:
+        used = {name: used_by for (coll, name), used_by in used_indexes.items() if coll == collection_name}
+        index_report[collection_name], collection_issues = check_indexes(
+            db, collection_name, used, collection_name in queried_collections)
+        issues.extend(collection_issues)
+
+    counts = {}
+    for issue in issues:
+        issue['blocking'] = issue['type'] in BLOCKING_ISSUES
+        counts[issue['type']] = counts.get(issue['type'], 0) + 1
+
+    return {
+        'generated_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'database': db.name,
+        'summary': {
+            'queries': len(queries),
+            'issues': counts,
+            'blocking': sum(1 for issue in issues if issue['blocking'])
+        },
+        'queries': [{key: value for key, value in query.items() if key not in ('target', 'stages')}
+                    for query in queries],
+        'indexes': index_report,
+        'issues': issues,
+        'proposed_indexes': [
+            {
+                'collection': collection,
+                'key': json.loads(key),
+                'queries': sorted(used_by),
+                'materialized': collection.endswith(MATERIALIZED_SUFFIX)
+            }
+            for (collection, key), used_by in sorted(proposals.items())
+        ]
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Explain the registered queries and check the indexes they use.")
+    parser.add_argument('--uri', default=MONGO_URI, help="MongoDB connection string")
+    parser.add_argument('--db', default=DATABASE_NAME, help="Database name")
+    parser.add_argument('--output', default=REPORT_FILE, help="Path of the JSON report")
+    parser.add_argument('--strict', action='store_true', help="Exit with status 1 if a blocking issue is found")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(args.uri)
+    report = advise(client[args.db])
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+
+    for issue in report['issues']:
+        print(f"{'BLOCKING' if issue['blocking'] else 'warning'}: {json.dumps(issue, default=str)}")
+    print(f"{report['summary']['blocking']} blocking issue(s), report written to '{args.output}'.")
+
+    if args.strict and report['summary']['blocking']:
+        sys.exit(1)
@@ -0,0 +1,41 @@
+from search import create_text_index
+from top_k import EQUALITY_FILTER_FIELDS, get_top_k_indexes
+
+# Indexes created by earlier versions on fields that do not exist in the 'anime' documents
+# (name_id, Score_id, ...), the single field Genres index now covered by Genres_1_Id_anime_1,
+# and the Premiered string index replaced by premiered_ordinal
+OBSOLETE_INDEXES = ['name_id_1', 'Score_id_-1', 'Popularity_id_-1', 'Premiered_id_1', 'Genres_id_text',
+                    'Episodes_id_-1', 'genres_index', 'Premiered_1_Id_anime_1']
+
+
+def create_anime_indexes(db):
+    existing = db['anime'].index_information()
+    for index_name in OBSOLETE_INDEXES:
+        if index_name in existing:
+            db['anime'].drop_index(index_name)
+            print(f"Index '{index_name}' dropped.")
+
+    # Every index ends with Id_anime, the tie breaker of the paged queries (see pagination.get_sort_spec),
+    # so a page of a view is read in index order without an in-memory sort
+    db['anime'].create_index([('Score', -1), ('Id_anime', 1)])  # high_score_anime, top_10_highest_rated_anime
+    db['anime'].create_index([('Popularity', -1), ('Id_anime', 1)])  # popular_anime, top_10_most_popular_anime
+    # recent_anime, the premiered year ranges of /anime/query and the per-season counts of /seasons
+    db['anime'].create_index([('premiered_ordinal', 1), ('Id_anime', 1)])
+    # /anime/query?sort=premiered: newest first with the ascending Id_anime tie breaker, an order the index
+    # above cannot serve in either direction. Alone and behind each equality filter (genre, type).
+    db['anime'].create_index([('premiered_ordinal', -1), ('Id_anime', 1)])
+    for filter_field in EQUALITY_FILTER_FIELDS:
+        db['anime'].create_index([(filter_field, 1), ('premiered_ordinal', -1), ('Id_anime', 1)])
+    db['anime'].create_index([('Episodes', -1), ('Id_anime', 1)])  # long_series
+    # Genres is a lowercase multikey array: equality on the genre first, then the sort (action_anime)
+    db['anime'].create_index([('Genres', 1), ('Id_anime', 1)])
+    # /anime/query?sort=id: Id_anime alone, and behind the type filter (the genre one is the index above)
+    db['anime'].create_index([('Id_anime', 1)])
+    db['anime'].create_index([('Type', 1), ('Id_anime', 1)])
+    # /top/<metric>: the metric alone, and behind each equality filter (genre, type)
+    for keys in get_top_k_indexes():
+        db['anime'].create_index(keys)
+    # /search: weighted text index over the names and the synopsis (a collection has at most one text index)
+    create_text_index(db)
+    print("Indexes created for 'Score', 'Popularity', 'premiered_ordinal', 'Episodes', 'Genres', 'Id_anime', "
+          "the top-k metrics and the text search.")
@@ -1,50 +1,80 @@
-import pandas as pd
-import pymongo
-
-# Step 1: Connect to MongoDB
-client = pymongo.MongoClient("mongodb://localhost:27017/")
-db = client["myanimelist_db"]
-
-# Step 2: Drop the entire database
-client.drop_database("myanimelist_db")
-print("Database 'myanimelist_db' has been dropped.")
-
-# Step 3: Read data from CSV
-df = pd.read_csv(r'C:\Users\User\anime_app\anime.csv')
-
-# Print the DataFrame columns to verify their names
-print("Columns in the DataFrame:", df.columns)
-
-# Step 4: Strip whitespace from column names
-df.columns = df.columns.str.strip()
-
-# Step 5: Check if 'Score' column exists
-if 'Score' not in df.columns:
-    raise KeyError("The 'Score' column is not found in the DataFrame.")
-
-# Step 6: Convert 'Score' to numeric, replacing invalid entries with NaN
-df['Score'] = pd.to_numeric(df['Score'], errors='coerce')
-
-# Step 7: Remove records with NaN in 'Score' column
-df = df.dropna(subset=['Score'])
-
-# Step 8: Check for valid float conversion for 'Score' and drop invalid records
-df = df[df['Score'].apply(lambda x: isinstance(x, (int, float)))]
-
-# Step 9: Convert the 'Score' column to float64
-df['Score'] = df['Score'].astype('float64')
-
-# Step 10: Handle 'Episodes' column
-if 'Episodes' not in df.columns:
-    raise KeyError("The 'Episodes' column is not found in the DataFrame.")
-
-# Convert 'Episodes' to numeric, replacing invalid entries with 0
-df['Episodes'] = pd.to_numeric(df['Episodes'], errors='coerce').fillna(0).astype('int64')
-
-# Step 11: Convert NaN values to None for MongoDB compatibility
-data = df.where(pd.notnull(df), None).to_dict('records')
-
-# Step 12: Insert the cleaned data into the 'anime' collection
-db['anime'].insert_many(data)
-
-print("Data inserted into 'anime' collection after database reset.")
+import pandas as pd
+import pymongo
+from response_cache import bump_data_generation
+from value_dictionary import build_value_dictionary
+from statistics_store import update_statistics
+from premiered import add_premiered_fields
+
+# Comma separated name lists that are stored as lowercase arrays, so they can be matched
+# with an index instead of a regex and unwound without $split
+NAME_LIST_COLUMNS = ['Genres', 'Producers', 'Studios']
+
+# Step 1: Connect to MongoDB
+client = pymongo.MongoClient("mongodb://localhost:27017/")
+db = client["myanimelist_db"]
+
+# Step 2: Drop the entire database
+client.drop_database("myanimelist_db")
+print("Database 'myanimelist_db' has been dropped.")
+
+# Step 3: Read data from CSV
+df = pd.read_csv(r'C:\Users\User\anime_app\anime.csv')
+
+# Print the DataFrame columns to verify their names
+print("Columns in the DataFrame:", df.columns)
+
+# Step 4: Strip whitespace from column names
+df.columns = df.columns.str.strip()
+
+# Step 5: Check if 'Score' column exists
+if 'Score' not in df.columns:
+    raise KeyError("The 'Score' column is not found in the DataFrame.")
+
+# Step 6: Convert 'Score' to numeric, replacing invalid entries with NaN
+df['Score'] = pd.to_numeric(df['Score'], errors='coerce')
+
+# Step 7: Remove records with NaN in 'Score' column
+df = df.dropna(subset=['Score'])
+
+# Step 8: Check for valid float conversion for 'Score' and drop invalid records
+df = df[df['Score'].apply(lambda x: isinstance(x, (int, float)))]
+
+# Step 9: Convert the 'Score' column to float64
+df['Score'] = df['Score'].astype('float64')
+
+# Step 10: Handle 'Episodes' column
+if 'Episodes' not in df.columns:
+    raise KeyError("The 'Episodes' column is not found in the DataFrame.")
+
+# Convert 'Episodes' to numeric, replacing invalid entries with 0
+df['Episodes'] = pd.to_numeric(df['Episodes'], errors='coerce').fillna(0).astype('int64')
+
+# Step 11: Split the name lists into lowercase arrays, 'Unknown' becomes missing
+for column in NAME_LIST_COLUMNS:
+    if column in df.columns:
+        names = df[column].replace('Unknown', pd.NA).astype('string')
+        df[column] = names.str.strip().str.lower().str.split(r'\s*,\s*', regex=True)
+
+# Step 12: Derive premiered_year, premiered_season and the chronological premiered_ordinal from
+# 'Premiered' ('Spring 1998'), so the date ranges and the per-season counts are index range scans
+if 'Premiered' in df.columns:
+    df = add_premiered_fields(df)
+
+# Step 13: Convert NaN values to None for MongoDB compatibility
+data = df.where(pd.notnull(df), None).to_dict('records')
+
+# Step 14: Insert the cleaned data into the 'anime' collection
+db['anime'].insert_many(data)
+
+print("Data inserted into 'anime' collection after database reset.")
+
+# Add the inserted documents to the running statistics (count, sum, min, max, histogram) of the
+# numeric fields, the views that depend on the average or the quantiles of Score read them from there
+update_statistics(db, 'anime', data)
+
+# Step 15: Count the anime and scores of every distinct genre, producer and studio
+build_value_dictionary(db, 'anime', [column for column in NAME_LIST_COLUMNS if column in df.columns], score_field='Score')
+print("Run 'python migrate.py' to create the views and indexes.")
+
+# Step 16: Start a new data generation, the app processes drop their cached responses at their next poll
+bump_data_generation(db, 'insert_data.py')
@@ -0,0 +1,122 @@
+# Compare the latency of the synchronous (app.py) and async (async_app.py) apps under load.
+#
+# Usage:
+#   python app.py                                  (serves on port 5000)
+#   hypercorn async_app:app --bind localhost:8000
+#   python load_test.py --output load_test.json
+#
+# For every app and every concurrency level, that many clients request the paths in a loop
+# for --duration seconds, and the p50/p99 latency, the throughput and the errors are reported.
+# The requests are sent with 'Cache-Control: no-cache' so app.py reads MongoDB instead of its
+# response cache, pass --cached to measure the cached responses instead.
+import argparse
+import asyncio
+import json
+import time
+import urllib.parse
+
+TARGETS = {
+    'sync': 'http://localhost:5000',
+    'async': 'http://localhost:8000'
+}
+CONCURRENCY_LEVELS = [1, 50, 500]
+PATHS = [
+    '/anime/high_score_anime?limit=100',
+    '/anime/action_anime?limit=100',
+    '/anime/average_score_per_genre',
+    '/anime/count_anime_by_type'
+]
+
+# Seconds a single request may take before it is counted as an error
+REQUEST_TIMEOUT_SECONDS = 30
+
+
+async def fetch(url, cached):
+    # One GET over a new connection (the Flask development server closes it after every response anyway),
+    # returns the HTTP status code
+    parts = urllib.parse.urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    try:
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        headers = f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: close\r\n"
+        if not cached:
+            headers += "Cache-Control: no-cache\r\n"
+        writer.write((headers + "\r\n").encode('ascii'))
+        await writer.drain()
+        status_line = await reader.readline()
+        await reader.read()  # the body, until the server closes the connection
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def client_loop(base_url, paths, deadline, cached, latencies, errors, offset):
+    i = offset
+    while time.perf_counter() < deadline:
+        url = base_url + paths[i % len(paths)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            status = await asyncio.wait_for(fetch(url, cached), REQUEST_TIMEOUT_SECONDS)
+        except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+            status = None
+        if status == 200:
+            latencies.append((time.perf_counter() - started) * 1000)
+        else:
+            errors.append(status)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return round(sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))], 2)
+
+
+async def run_level(base_url, paths, concurrency, duration, cached):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    # Every client starts at a different path, so all the views are requested at the same time
+    await asyncio.gather(*[
+        client_loop(base_url, paths, deadline, cached, latencies, errors, offset)
+        for offset in range(concurrency)
+    ])
+    latencies.sort()
+    return {
+        'requests': len(latencies) + len(errors),
+        'errors': len(errors),
+        'requests_per_second': round(len(latencies) / duration, 1),
+        'p50_ms': percentile(latencies, 0.50),
+        'p99_ms': percentile(latencies, 0.99)
+    }
+
+
+def run(targets, levels, paths, duration, cached):
+    results = {}
+    print(f"{'app':<8} {'clients':>8} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'errors':>8}")
+    for name, base_url in targets.items():
+        results[name] = {}
+        for concurrency in levels:
+            result = asyncio.run(run_level(base_url, paths, concurrency, duration, cached))
+            results[name][concurrency] = result
+            print(f"{name:<8} {concurrency:>8} {result['requests_per_second']:>10} "
+                  f"{str(result['p50_ms']):>10} {str(result['p99_ms']):>10} {result['errors']:>8}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Load test the sync and async anime apps.")
+    parser.add_argument('--sync-url', default=TARGETS['sync'], help="Base URL of app.py")
+    parser.add_argument('--async-url', default=TARGETS['async'], help="Base URL of async_app.py")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=CONCURRENCY_LEVELS,
+                        help="Numbers of concurrent clients")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds per app and concurrency level")
+    parser.add_argument('--path', action='append', dest='paths', help="Path to request, can be repeated")
+    parser.add_argument('--cached', action='store_true', help="Let app.py answer from its response cache")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run({'sync': args.sync_url, 'async': args.async_url}, args.concurrency,
+                  args.paths or PATHS, args.duration, args.cached)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,190 @@
+import datetime
+import hashlib
+import json
+
+# Collection that keeps the refresh state (high-water mark, definition hash, timestamps) of every materialized view
+STATE_COLLECTION = 'materialized_view_state'
+
+# Suffix of the real collection that holds the pre-computed output of a view
+MATERIALIZED_SUFFIX = '_materialized'
+
+# Stages that only order or cut the result, they are applied when reading instead of being materialized
+READ_TIME_STAGES = ('$sort', '$limit', '$skip')
+
+# How each '$group' accumulator combines an existing partial result with a new one inside '$merge'
+MERGE_OPERATORS = {
+    '$sum': '$add',
+    '$max': '$max',
+    '$min': '$min',
+    '$push': '$concatArrays'
+}
+
+
+def materialized_collection_name(view_name):
+    return view_name + MATERIALIZED_SUFFIX
+
+
+def definition_hash(source_collection, pipeline):
+    # Stable hash of a view definition, used to detect when a view has to be rebuilt from scratch
+    definition = json.dumps({'viewOn': source_collection, 'pipeline': pipeline}, sort_keys=True, default=str)
+    return hashlib.sha256(definition.encode('utf-8')).hexdigest()
+
+
+def split_pipeline(pipeline):
+    # Split a view pipeline into the per-document stages, the '$group' stage (or None)
+    # and the stages that run on the grouped/filtered output
+    for i, stage in enumerate(pipeline):
+        if '$group' in stage:
+            return pipeline[:i], stage['$group'], pipeline[i + 1:]
+    for i, stage in enumerate(pipeline):
+        if any(operator in stage for operator in READ_TIME_STAGES):
+            return pipeline[:i], None, pipeline[i:]
+    return pipeline, None, []
+
+
+def make_mergeable_group(group):
+    # Rewrite a '$group' stage so its output can be merged with the output of a later run.
+    # '$avg' is kept as a sum and a count, and turned back into an average by the finalize stages.
+    partial_group = {'_id': group['_id']}
+    merge_fields = {}
+    finalize_fields = {}
+    helper_fields = []
+
+    for field, accumulator in group.items():
+        if field == '_id':
+            continue
+        (operator, expression), = accumulator.items()
+        if operator == '$avg':
+            sum_field, count_field = f'{field}__sum', f'{field}__count'
+            partial_group[sum_field] = {'$sum': expression}
+            partial_group[count_field] = {'$sum': {'$cond': [{'$isNumber': expression}, 1, 0]}}
+            merge_fields[sum_field] = {'$add': [f'${sum_field}', f'$$new.{sum_field}']}
+            merge_fields[count_field] = {'$add': [f'${count_field}', f'$$new.{count_field}']}
+            finalize_fields[field] = {
+                '$cond': [
+                    {'$gt': [f'${count_field}', 0]},
+                    {'$divide': [f'${sum_field}', f'${count_field}']},
+                    None
+                ]
+            }
+            helper_fields += [sum_field, count_field]
+        elif operator in MERGE_OPERATORS:
+            partial_group[field] = accumulator
+            merge_fields[field] = {MERGE_OPERATORS[operator]: [f'${field}', f'$$new.{field}']}
+        else:
+            raise ValueError(f"Accumulator '{operator}' of field '{field}' cannot be refreshed incrementally")
+
+    finalize_stages = []
+    if finalize_fields:
+        finalize_stages.append({'$set': finalize_fields})
+    if helper_fields:
+        finalize_stages.append({'$unset': helper_fields})
+    return partial_group, [{'$set': merge_fields}], finalize_stages
+
+
+def materialize_view(db, view_name, source_collection, pipeline, full_refresh=False, source_version=None):
+    # Write the output of 'pipeline' into a real collection with '$merge' and expose it under 'view_name'.
+    # Only source documents inserted after the stored high-water mark (their _id) are processed,
+    # unless this is the first run, the definition changed or 'full_refresh' is set.
+    # The high-water mark only sees inserts: 'source_version' is a value the loader of the source collection
+    # changes when it may have replaced or removed documents (see bulk_loader.get_rewrite_version), the view
+    # is rebuilt when it differs from the version of the last refresh.
+    # Returns 'rebuilt', 'refreshed' (new source documents were merged) or 'unchanged'.
+    target = materialized_collection_name(view_name)
+    current_hash = definition_hash(source_collection, pipeline)
+    state = db[STATE_COLLECTION].find_one({'_id': view_name})
+
+    if (state is None or full_refresh or state.get('definition_hash') != current_hash
+            or state.get('source_version') != source_version):
+        db[target].drop()
+        rebuilt = True
+        last_mark = None
+    else:
+        rebuilt = False
+        last_mark = state.get('high_water_mark')
+
+    latest = db[source_collection].find_one({}, {'_id': 1}, sort=[('_id', -1)])
+    new_mark = latest['_id'] if latest else None
+
+    pre_stages, group, post_stages = split_pipeline(pipeline)
+    if group is None:
+        when_matched = 'replace'
+        finalize_stages = []
+    else:
+        partial_group, when_matched, finalize_stages = make_mergeable_group(group)
+
+    processed = 0
+    if new_mark is not None and new_mark != last_mark:
+        window = {'_id': {'$lte': new_mark}}
+        if last_mark is not None:
+            window['_id']['$gt'] = last_mark
+        processed = db[source_collection].count_documents(window)
+
+        stages = [{'$match': window}] + pre_stages
+        if group is not None:
+            stages.append({'$group': partial_group})
+        stages.append({'$merge': {
+            'into': target,
+            'on': '_id',
+            'whenMatched': when_matched,
+            'whenNotMatched': 'insert'
+        }})
+        db[source_collection].aggregate(stages)
+
+    # The public name becomes a cheap view over the pre-computed collection
+    deployed = next(db.list_collections(filter={'name': view_name}), None)
+    if rebuilt or deployed is None or deployed.get('options', {}).get('viewOn') != target:
+        rebuilt = True
+        if deployed is not None:
+            db.command({'drop': view_name})
+        db.command({
+            'create': view_name,
+            'viewOn': target,
+            'pipeline': finalize_stages + post_stages
+        })
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    db[STATE_COLLECTION].update_one(
+        {'_id': view_name},
+        {'$set': {
+            'source': source_collection,
+            'target': target,
+            'definition_hash': current_hash,
+            'source_version': source_version,
+            'high_water_mark': new_mark,
+            'refreshed_at': now,
+            'documents_processed': processed
+        }},
+        upsert=True
+    )
+    print(f"Materialized '{view_name}' into '{target}' ({processed} new source documents).")
+    if rebuilt:
+        return 'rebuilt'
+    return 'refreshed' if processed else 'unchanged'
+
+
+def get_staleness(db):
+    # Report how far behind every materialized view is: when it was last refreshed
+    # and how many source documents have been inserted since then
+    now = datetime.datetime.now(datetime.timezone.utc)
+    report = []
+    for state in db[STATE_COLLECTION].find().sort('_id', 1):
+        high_water_mark = state.get('high_water_mark')
+        source = db[state['source']]
+        if high_water_mark is None:
+            pending = source.estimated_document_count()
+        else:
+            pending = source.count_documents({'_id': {'$gt': high_water_mark}})
+
+        refreshed_at = state['refreshed_at']
+        if refreshed_at.tzinfo is None:
+            refreshed_at = refreshed_at.replace(tzinfo=datetime.timezone.utc)
+        report.append({
+            'view': state['_id'],
+            'source': state['source'],
+            'refreshed_at': refreshed_at.isoformat(),
+            'age_seconds': round((now - refreshed_at).total_seconds(), 3),
+            'pending_documents': pending,
+            'stale': pending > 0
+        })
+    return report
@@ -0,0 +1,107 @@
+# Provision the views and indexes used by app.py.
+#
+# Usage:
+#   python migrate.py                  create or update the views whose definition changed
+#   python migrate.py --force          drop and recreate every view
+#   python migrate.py --no-materialize create plain (non-materialized) MongoDB views
+#
+# The command is idempotent: the hash of every deployed view definition is stored in the
+# 'view_migrations' collection and views whose definition did not change are skipped.
+import argparse
+import datetime
+
+import pymongo
+
+from aggregation_views import AGGREGATION_VIEW_PIPELINES
+from filter_views import get_filter_view_pipelines
+from indexes import create_anime_indexes
+from materialized_views import definition_hash, materialize_view, materialized_collection_name
+from pagination import get_sort_spec
+from response_cache import bump_data_generation
+
+MONGO_URI = "mongodb://localhost:27017/"
+DATABASE_NAME = "myanimelist_db"
+
+# Collection that keeps the definition hash of every deployed (non-materialized) view
+MIGRATIONS_COLLECTION = 'view_migrations'
+
+
+def get_view_definitions(db):
+    # All views served by the app, as view name -> (source collection, pipeline)
+    definitions = {}
+    for view_name, pipeline in get_filter_view_pipelines(db).items():
+        definitions[view_name] = ('anime', pipeline)
+    for view_name, pipeline in AGGREGATION_VIEW_PIPELINES.items():
+        definitions[view_name] = ('anime', pipeline)
+    return definitions
+
+
+def apply_view(db, view_name, source_collection, pipeline, materialize=False, force=False):
+    # Create or update one view, returns 'created', 'updated' or 'unchanged',
+    # or for a materialized view 'rebuilt', 'refreshed' or 'unchanged'
+    if materialize:
+        # materialize_view keeps its own definition hash and only processes new documents
+        return materialize_view(db, view_name, source_collection, pipeline, full_refresh=force)
+
+    current_hash = definition_hash(source_collection, pipeline)
+    record = db[MIGRATIONS_COLLECTION].find_one({'_id': view_name})
+    deployed = next(db.list_collections(filter={'name': view_name}), None)
+    deployed_source = deployed.get('options', {}).get('viewOn') if deployed else None
+
+    if (not force and record is not None and record['definition_hash'] == current_hash
+            and deployed_source == source_collection):
+        return 'unchanged'
+
+    if deployed is not None:
+        db.command({'drop': view_name})
+    db.command({
+        'create': view_name,
+        'viewOn': source_collection,
+        'pipeline': pipeline
+    })
+    db[MIGRATIONS_COLLECTION].update_one(
+        {'_id': view_name},
+        {'$set': {
+            'source': source_collection,
+            'definition_hash': current_hash,
+            'applied_at': datetime.datetime.now(datetime.timezone.utc)
+        }},
+        upsert=True
+    )
+    return 'updated' if deployed is not None else 'created'
+
+
+def create_sort_index(db, view_name):
+    # Index a materialized collection on the sort key of its view, so the pages of
+    # /anime/<view_name> are read in index order. The collection is dropped on a rebuild,
+    # create_index is a no-op when the index already exists.
+    db[materialized_collection_name(view_name)].create_index(get_sort_spec(view_name))
+
+
+def migrate(db, materialize=True, force=False):
+    results = {}
+    for view_name, (source_collection, pipeline) in get_view_definitions(db).items():
+        results[view_name] = apply_view(db, view_name, source_collection, pipeline, materialize, force)
+        if materialize:
+            create_sort_index(db, view_name)
+        print(f"View '{view_name}': {results[view_name]}")
+
+    # create_index is a no-op for indexes that already exist with the same definition
+    create_anime_indexes(db)
+
+    if any(result != 'unchanged' for result in results.values()):
+        bump_data_generation(db, 'migrate.py')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Create or update the anime views and indexes.")
+    parser.add_argument('--uri', default=MONGO_URI, help="MongoDB connection string")
+    parser.add_argument('--db', default=DATABASE_NAME, help="Database name")
+    parser.add_argument('--force', action='store_true', help="Recreate every view even if its definition did not change")
+    parser.add_argument('--no-materialize', dest='materialize', action='store_false',
+                        help="Create plain MongoDB views instead of materialized ones")
+    args = parser.parse_args()
+
+    client = pymongo.MongoClient(args.uri)
+    migrate(client[args.db], materialize=args.materialize, force=args.force)
@@ -0,0 +1,150 @@
+import base64
+
+from bson import json_util
+
+# Default and maximum page sizes for /anime/<view_name>?limit=
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Number of documents PyMongo fetches per round trip when streaming NDJSON
+STREAM_BATCH_SIZE = 500
+
+# Sort key of every view, matching the '$sort' stage of its pipeline.
+# Views without a '$sort' stage get a stable key so they can be paged too.
+VIEW_SORT_KEYS = {
+    'high_score_anime': ('Score', -1),
+    'action_anime': ('Id_anime', 1),
+    'long_series': ('Episodes', -1),
+    'recent_anime': ('premiered_ordinal', 1),
+    'popular_anime': ('Popularity', -1),
+    'average_score_anime': ('Id_anime', 1),
+    'above_median_score_anime': ('Score', -1),
+    'top_decile_score_anime': ('Score', -1),
+    'average_score_per_genre': ('averageScore', -1),
+    'total_anime_per_studio': ('totalAnime', -1),
+    'top_10_highest_rated_anime': ('Score', -1),
+    'total_episodes_per_studio': ('totalEpisodes', -1),
+    'top_10_most_popular_anime': ('Popularity', -1),
+    'count_anime_by_type': ('animeCount', -1)
+}
+
+# Unique field used to break ties between documents with the same sort value.
+# Filter views return anime documents (unique Id_anime), the aggregation views
+# return one document per group key (_id), except count_anime_by_type which
+# projects the group key into 'Type'.
+VIEW_TIE_BREAKERS = {
+    'average_score_per_genre': '_id',
+    'total_anime_per_studio': '_id',
+    'total_episodes_per_studio': '_id',
+    'count_anime_by_type': 'Type'
+}
+DEFAULT_TIE_BREAKER = 'Id_anime'
+
+
+def get_sort_spec(view_name):
+    # Returns the list of (field, direction) pairs used to order a view
+    sort_field, direction = VIEW_SORT_KEYS.get(view_name, (DEFAULT_TIE_BREAKER, 1))
+    tie_breaker = VIEW_TIE_BREAKERS.get(view_name, DEFAULT_TIE_BREAKER)
+    if sort_field == tie_breaker:
+        return [(sort_field, direction)]
+    return [(sort_field, direction), (tie_breaker, 1)]
+
+
+def encode_cursor(document, sort_spec):
+    # Turn the sort values of the last document of a page into an opaque token
+    values = [document.get(field) for field, _ in sort_spec]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(token, sort_spec):
+    # Inverse of encode_cursor, raises ValueError on a malformed token
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid 'after' cursor: {token!r}")
+    if not isinstance(values, list) or len(values) != len(sort_spec):
+        raise ValueError(f"Invalid 'after' cursor: {token!r}")
+    return values
+
+
+def build_seek_filter(sort_spec, values):
+    # Keyset (seek) predicate: documents strictly after 'values' in sort order,
+    # e.g. Score < s OR (Score == s AND Id_anime > id) for a descending Score sort
+    clauses = []
+    for i, (field, direction) in enumerate(sort_spec):
+        clause = {f: v for (f, _), v in zip(sort_spec[:i], values[:i])}
+        clause[field] = {'$lt' if direction < 0 else '$gt': values[i]}
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {'$or': clauses}
+
+
+def parse_limit(raw_limit):
+    # Validate the 'limit' query parameter, raises ValueError if it is not a positive integer
+    if raw_limit is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(raw_limit)
+    except ValueError:
+        raise ValueError(f"'limit' must be an integer, got {raw_limit!r}")
+    if limit < 1:
+        raise ValueError("'limit' must be greater than 0")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def parse_fields(raw_fields):
+    # Validate a comma separated 'fields' parameter, returns the list of field names or None for all fields
+    if not raw_fields:
+        return None
+    fields = [field.strip() for field in raw_fields.split(',') if field.strip()]
+    for field in fields:
+        if field.startswith('$') or '\0' in field:
+            raise ValueError(f"Invalid field name: {field!r}")
+    return fields or None
+
+
+def find_page(collection, view_name, limit, after=None, fields=None):
+    # Fetch one page of a view using keyset pagination.
+    # Returns the documents (without _id) and the token for the next page, or None on the last page.
+    # With 'fields', only these fields are returned (the sort fields are read too, for the cursor).
+    sort_spec = get_sort_spec(view_name)
+    query = build_seek_filter(sort_spec, decode_cursor(after, sort_spec)) if after else {}
+    projection = None
+    if fields:
+        projection = dict.fromkeys(fields + [field for field, _ in sort_spec], 1)
+
+    # Fetch one extra document to know whether there is a next page
+    documents = list(collection.find(query, projection).sort(sort_spec).limit(limit + 1))
+    has_more = len(documents) > limit
+    documents = documents[:limit]
+    next_cursor = encode_cursor(documents[-1], sort_spec) if has_more else None
+
+    for document in documents:
+        document.pop('_id', None)
+        if fields:
+            for field, _ in sort_spec:
+                if field not in fields:
+                    document.pop(field, None)
+    return documents, next_cursor
+
+
+def stream_ndjson(collection, view_name, after=None, limit=None, batch_size=STREAM_BATCH_SIZE, fields=None):
+    # Stream one JSON document per line straight from the PyMongo cursor,
+    # so at most 'batch_size' documents are held in memory at any time.
+    # The cursor is decoded here, before the first byte is sent, so a bad token still gives a 400.
+    sort_spec = get_sort_spec(view_name)
+    query = build_seek_filter(sort_spec, decode_cursor(after, sort_spec)) if after else {}
+    projection = dict.fromkeys(fields, 1) if fields else None
+
+    cursor = collection.find(query, projection).sort(sort_spec).batch_size(batch_size)
+    if limit:
+        cursor = cursor.limit(limit)
+
+    def generate():
+        try:
+            for document in cursor:
+                document.pop('_id', None)
+                yield json_util.dumps(document) + '\n'
+        finally:
+            cursor.close()
+
+    return generate()
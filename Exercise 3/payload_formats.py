@@ -0,0 +1,77 @@
+import gzip
+
+from flask import Response, jsonify
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Encodings of the view documents selected with format=<name>:
+#   json      a list of documents (the default)
+#   columnar  one list of values per field, field names are sent once instead of once per document
+#   msgpack   the documents as MessagePack, needs the msgpack package
+PAYLOAD_FORMATS = ('json', 'columnar', 'msgpack')
+
+# Content encodings, in order of preference (brotli compresses JSON better than gzip but is optional)
+CONTENT_ENCODINGS = ('br', 'gzip')
+
+# Smaller bodies are sent uncompressed, the headers would cost more than what compression saves
+MIN_COMPRESS_BYTES = 1024
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def parse_format(raw_format):
+    # Validate the 'format' query parameter (ndjson is streamed by the route itself)
+    payload_format = raw_format or 'json'
+    if payload_format not in PAYLOAD_FORMATS:
+        raise ValueError(f"'format' must be one of {', '.join(PAYLOAD_FORMATS + ('ndjson',))}, got {raw_format!r}")
+    if payload_format == 'msgpack' and msgpack is None:
+        raise ValueError("format=msgpack is not available, install the 'msgpack' package")
+    return payload_format
+
+
+def to_columnar(documents):
+    # {'Name': [...], 'Score': [...]}: one list per field, None where a document does not have the field
+    fields = {}
+    for document in documents:
+        for field in document:
+            fields.setdefault(field, None)
+    return {field: [document.get(field) for document in documents] for field in fields}
+
+
+def make_payload_response(documents, payload_format, next_cursor=None, paged=False):
+    # Paged responses keep their {'data': ..., 'next': ...} envelope in every format
+    if payload_format == 'columnar':
+        payload = {'columns': to_columnar(documents), 'count': len(documents)}
+        if paged:
+            payload['next'] = next_cursor
+        return jsonify(payload)
+
+    payload = {'data': documents, 'next': next_cursor} if paged else documents
+    if payload_format == 'msgpack':
+        return Response(msgpack.packb(payload, default=str), mimetype='application/msgpack')
+    return jsonify(payload)
+
+
+def negotiate_encoding(accept_encodings):
+    # Best content encoding accepted by the client (werkzeug's request.accept_encodings), None for identity
+    for encoding in CONTENT_ENCODINGS:
+        if encoding == 'br' and brotli is None:
+            continue
+        if accept_encodings[encoding] > 0:
+            return encoding
+    return None
+
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
@@ -0,0 +1,72 @@
+# Seasons of a year in chronological order. MyAnimeList writes Premiered as '<season> <year>', e.g. 'Spring 1998'.
+SEASONS = ['winter', 'spring', 'summer', 'fall']
+SEASON_INDEX = {season: index for index, season in enumerate(SEASONS)}
+PREMIERED_PATTERN = r'^\s*(?P<season>winter|spring|summer|fall)\s+(?P<year>\d{4})\s*$'
+
+# Years accepted by the premiered filters of the app
+MIN_YEAR = 1900
+MAX_YEAR = 2100
+
+
+def premiered_ordinal(year, season='winter'):
+    # Sortable number of a season: four per year, in chronological order ('fall 2022' < 'winter 2023').
+    # Stored as premiered_ordinal so that year ranges and seasons are range scans on one index.
+    return year * len(SEASONS) + SEASON_INDEX[season]
+
+
+def year_range_ordinals(first_year=None, last_year=None):
+    # premiered_ordinal bounds of the seasons from the first season of first_year to the last one of last_year
+    bounds = {}
+    if first_year is not None:
+        bounds['$gte'] = premiered_ordinal(first_year, SEASONS[0])
+    if last_year is not None:
+        bounds['$lte'] = premiered_ordinal(last_year, SEASONS[-1])
+    return bounds
+
+
+def add_premiered_fields(df, column='Premiered'):
+    # Derive premiered_year, premiered_season and premiered_ordinal from the Premiered strings.
+    # Values that are not '<season> <year>' (e.g. 'Unknown') leave the three fields as None.
+    parts = df[column].astype('string').str.lower().str.extract(PREMIERED_PATTERN)
+    known = parts['year'].notna()
+    years = parts['year'].where(known, '0').astype('int64')
+    ordinals = years * len(SEASONS) + parts['season'].map(SEASON_INDEX).where(known, 0).astype('int64')
+    df['premiered_year'] = years.astype(object).where(known, None)
+    df['premiered_season'] = parts['season'].astype(object).where(known, None)
+    df['premiered_ordinal'] = ordinals.astype(object).where(known, None)
+    return df
+
+
+def parse_year(args, parameter):
+    # Validate an optional year parameter, raises ValueError if it is not a year between MIN_YEAR and MAX_YEAR
+    raw_year = args.get(parameter)
+    if not raw_year:
+        return None
+    try:
+        year = int(raw_year)
+    except ValueError:
+        raise ValueError(f"'{parameter}' must be a year, got {raw_year!r}")
+    if not MIN_YEAR <= year <= MAX_YEAR:
+        raise ValueError(f"'{parameter}' must be between {MIN_YEAR} and {MAX_YEAR}")
+    return year
+
+
+def season_count_pipeline(first_year=None, last_year=None):
+    match = {'premiered_ordinal': dict(year_range_ordinals(first_year, last_year), **{'$type': 'number'})}
+    return [
+        {'$match': match},
+        {'$sort': {'premiered_ordinal': 1}},
+        {'$group': {'_id': '$premiered_ordinal', 'anime_count': {'$sum': 1}}},
+        {'$sort': {'_id': 1}}
+    ]
+
+
+def count_per_season(collection, first_year=None, last_year=None):
+    # Number of anime that premiered in every season of the year range, in chronological order.
+    # The match, sort and group only read premiered_ordinal, so they are answered from its index.
+    groups = collection.aggregate(season_count_pipeline(first_year, last_year))
+    return [{
+        'year': group['_id'] // len(SEASONS),
+        'season': SEASONS[group['_id'] % len(SEASONS)],
+        'anime_count': group['anime_count']
+    } for group in groups]
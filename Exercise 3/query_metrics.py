@@ -0,0 +1,232 @@
+import bisect
+import contextlib
+import datetime
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds (in bytes) of the response size histogram buckets
+RESPONSE_BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Commands slower than this are kept in the slow-query log, set MONGO_SLOW_QUERY_MS to change it
+SLOW_QUERY_THRESHOLD_MS = int(os.environ.get('MONGO_SLOW_QUERY_MS', 100))
+
+# Number of slow commands kept, the oldest ones are dropped first
+SLOW_QUERY_LOG_SIZE = 100
+
+# Commands whose plan can be explained, a getMore only continues the cursor of one of these
+EXPLAINABLE_COMMANDS = ('find', 'aggregate', 'count', 'distinct')
+
+# Fields the driver adds to every command, they are not part of the query and explain rejects them
+DRIVER_FIELDS = ('lsid', 'txnNumber', 'autocommit', 'startTransaction', 'readConcern', 'writeConcern')
+
+# Commands that are not queries and would only add noise to the metrics
+IGNORED_COMMANDS = ('hello', 'ismaster', 'isMaster', 'ping', 'endSessions', 'saslStart', 'saslContinue',
+                    'buildInfo', 'explain')
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is the +Inf bucket
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        # (upper bound, number of observations <= upper bound) pairs, as Prometheus expects them
+        total, pairs = 0, []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+class CommandStats:
+    def __init__(self):
+        self.duration = Histogram()
+        self.documents = 0
+        self.failures = 0
+
+
+class QueryMetrics(monitoring.CommandListener):
+    # PyMongo command listener that records, per command name and collection (or view),
+    # a latency histogram, the documents returned and the failures, and keeps
+    # a log of the commands slower than 'slow_query_ms'.
+    # Register it with MongoClient(..., event_listeners=[query_metrics]).
+
+    def __init__(self, slow_query_ms=SLOW_QUERY_THRESHOLD_MS, slow_query_log_size=SLOW_QUERY_LOG_SIZE):
+        self.slow_query_ms = slow_query_ms
+        self.slow_queries = deque(maxlen=slow_query_log_size)
+        self.slow_query_count = 0
+        self._commands = {}  # (command name, collection) -> CommandStats
+        self._views = {}  # (view name, operation) -> Histogram
+        self._response_bytes = {}  # (endpoint, view name) -> Histogram of the response sizes
+        self._in_flight = {}  # (connection, request id) -> (command name, collection, database, command)
+        self._lock = threading.Lock()
+
+    # Listener callbacks, called by the driver on the thread that runs the command.
+    # They must not run commands themselves, the explain of a slow query is done later in get_slow_queries.
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        command = event.command
+        collection = command.get('collection') if event.command_name == 'getMore' else command.get(event.command_name)
+        query = None
+        if event.command_name in EXPLAINABLE_COMMANDS:
+            query = {key: value for key, value in command.items()
+                     if not key.startswith('$') and key not in DRIVER_FIELDS}
+        with self._lock:
+            self._in_flight[(event.connection_id, event.request_id)] = (
+                event.command_name, collection if isinstance(collection, str) else '', event.database_name, query)
+
+    def succeeded(self, event):
+        started = self._pop_in_flight(event)
+        if started is None:
+            return
+        command_name, collection, database, query = started
+        seconds = event.duration_micros / 1e6
+        reply = event.reply
+        cursor = reply.get('cursor') if isinstance(reply.get('cursor'), dict) else {}
+        batch = cursor.get('firstBatch', cursor.get('nextBatch', ()))
+
+        with self._lock:
+            stats = self._commands.setdefault((command_name, collection), CommandStats())
+            stats.duration.observe(seconds)
+            stats.documents += len(batch)
+
+            if seconds * 1000 >= self.slow_query_ms:
+                self.slow_query_count += 1
+                self.slow_queries.append({
+                    'at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                    'command': command_name,
+                    'database': database,
+                    'collection': collection,
+                    'duration_ms': round(seconds * 1000, 3),
+                    'documents': len(batch),
+                    'query': query,
+                    'plan': None
+                })
+                logging.warning(f"Slow MongoDB command '{command_name}' on '{collection}': {seconds * 1000:.1f} ms")
+
+    def failed(self, event):
+        started = self._pop_in_flight(event)
+        if started is None:
+            return
+        command_name, collection, _, _ = started
+        with self._lock:
+            stats = self._commands.setdefault((command_name, collection), CommandStats())
+            stats.duration.observe(event.duration_micros / 1e6)
+            stats.failures += 1
+
+    def _pop_in_flight(self, event):
+        with self._lock:
+            return self._in_flight.pop((event.connection_id, event.request_id), None)
+
+    @contextlib.contextmanager
+    def time_view(self, view_name, operation):
+        # Measure a whole view operation ('read' for an endpoint, 'build' for a view creation),
+        # which may span several commands (aggregate + getMore, or $merge batches)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._views.setdefault((view_name, operation), Histogram()).observe(elapsed)
+
+    def observe_response_bytes(self, endpoint, view_name, size):
+        # Size of a response body as sent (compressed if it was), taken from its Content-Length by the app
+        # rather than by encoding the MongoDB replies again
+        with self._lock:
+            self._response_bytes.setdefault((endpoint, view_name), Histogram(RESPONSE_BYTES_BUCKETS)).observe(size)
+
+    def get_slow_queries(self, client=None):
+        # The slow-query log, newest first. With a client, the plan of every entry that has none yet is
+        # explained ('queryPlanner' verbosity, so the slow query is not executed again).
+        with self._lock:
+            entries = list(self.slow_queries)
+        if client is not None:
+            for entry in entries:
+                if entry['plan'] is None and entry['query'] is not None:
+                    try:
+                        explain = client[entry['database']].command(
+                            {'explain': entry['query'], 'verbosity': 'queryPlanner'})
+                        # Aggregations that are not pushed down to the query layer have 'stages' instead
+                        entry['plan'] = explain.get('queryPlanner') or explain.get('stages')
+                    except PyMongoError as e:
+                        entry['plan'] = {'error': str(e)}
+        return entries[::-1]
+
+    def render_prometheus(self):
+        # All metrics in the Prometheus text exposition format
+        with self._lock:
+            commands = sorted(self._commands.items())
+            views = sorted(self._views.items())
+            response_bytes = sorted(self._response_bytes.items())
+            slow_query_count = self.slow_query_count
+
+        lines = [
+            '# HELP mongodb_command_duration_seconds Duration of the MongoDB commands.',
+            '# TYPE mongodb_command_duration_seconds histogram'
+        ]
+        for (command_name, collection), stats in commands:
+            labels = f'command="{escape_label(command_name)}",collection="{escape_label(collection)}"'
+            lines.extend(render_histogram('mongodb_command_duration_seconds', labels, stats.duration))
+
+        for name, help_text, attribute in (
+                ('mongodb_command_documents_returned_total', 'Documents returned by the MongoDB commands.', 'documents'),
+                ('mongodb_command_failures_total', 'Failed MongoDB commands.', 'failures')):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for (command_name, collection), stats in commands:
+                labels = f'command="{escape_label(command_name)}",collection="{escape_label(collection)}"'
+                lines.append(f'{name}{{{labels}}} {getattr(stats, attribute)}')
+
+        lines.append('# HELP mongodb_view_duration_seconds Duration of the view reads and builds.')
+        lines.append('# TYPE mongodb_view_duration_seconds histogram')
+        for (view_name, operation), histogram in views:
+            labels = f'view="{escape_label(view_name)}",operation="{escape_label(operation)}"'
+            lines.extend(render_histogram('mongodb_view_duration_seconds', labels, histogram))
+
+        lines.append('# HELP http_response_bytes Size of the response bodies sent, per endpoint and view.')
+        lines.append('# TYPE http_response_bytes histogram')
+        for (endpoint, view_name), histogram in response_bytes:
+            labels = f'endpoint="{escape_label(endpoint)}",view="{escape_label(view_name)}"'
+            lines.extend(render_histogram('http_response_bytes', labels, histogram))
+
+        lines.append(f'# HELP mongodb_slow_queries_total Commands slower than {self.slow_query_ms} ms.')
+        lines.append('# TYPE mongodb_slow_queries_total counter')
+        lines.append(f'mongodb_slow_queries_total {slow_query_count}')
+        return '\n'.join(lines) + '\n'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render_histogram(name, labels, histogram):
+    lines = []
+    for bound, count in histogram.cumulative():
+        le = '+Inf' if bound == float('inf') else repr(bound)
+        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {count}')
+    lines.append(f'{name}_sum{{{labels}}} {histogram.sum}')
+    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+    return lines
+
+
+# Shared instance, registered on the MongoClient of the app and of the loading scripts
+query_metrics = QueryMetrics()
@@ -0,0 +1,249 @@
+import datetime
+import functools
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+from flask import Response, make_response, request
+
+from payload_formats import MIN_COMPRESS_BYTES, compress_body, negotiate_encoding
+
+# Collection of the data generation stamp: one document replaced with a new ObjectId whenever the
+# data is reloaded or the views are rebuilt. Every app process compares it with the stamp its cache
+# was filled under, so the caches of all the workers (and hosts) are dropped, not only one.
+DATA_GENERATION_COLLECTION = 'data_generation'
+DATA_GENERATION_ID = 'anime'
+
+# Seconds between two reads of the stamp in a process, the longest a worker serves stale responses
+DATA_GENERATION_POLL_SECONDS = 2
+
+
+class CacheEntry:
+    def __init__(self, body, mimetype, ttl):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.last_modified = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        self.ttl = ttl
+        self.expires_at = time.monotonic() + ttl
+        self.encoded = {}  # content encoding -> compressed body, see ResponseCache.get_encoded
+
+
+class ResponseCache:
+    # In-process LRU cache of response bodies, bounded by the total size of the bodies in bytes.
+    # Entries expire after the TTL of their view, and can be invalidated per view or all at once.
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, default_ttl=300, view_ttls=None):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.view_ttls = view_ttls or {}
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.generation = 0  # incremented by invalidate(), see put()
+
+    def make_key(self, view_name, path, args):
+        # The key contains the view name first so that invalidate(view_name) can find its entries
+        return (view_name, path, tuple(sorted(args.items(multi=True))))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body, mimetype, generation=None):
+        # 'generation' is self.generation when the body was read: a body read before an invalidation
+        # is served but not cached
+        entry = CacheEntry(body, mimetype, self.view_ttls.get(key[0], self.default_ttl))
+        if len(body) > self.max_bytes:
+            # Too big to ever fit, serve it without caching
+            return entry
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return entry
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+        return entry
+
+    def get_encoded(self, key, entry, encoding):
+        # Compressed body of an entry, compressed once per encoding and counted in the cache size
+        body = entry.encoded.get(encoding)
+        if body is None:
+            body = compress_body(entry.body, encoding)
+            with self._lock:
+                if self._entries.get(key) is entry and encoding not in entry.encoded:
+                    entry.encoded[encoding] = body
+                    self._size += len(body)
+        return body
+
+    def invalidate(self, view_name=None):
+        # Drop the entries of one view, or of every view when view_name is None.
+        # Called when the data is reloaded or the views are rebuilt.
+        with self._lock:
+            keys = [key for key in self._entries if view_name is None or key[0] == view_name]
+            for key in keys:
+                self._remove(key)
+            self.invalidations += 1
+            self.generation += 1
+        return len(keys)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._size -= len(entry.body) + sum(len(body) for body in entry.encoded.values())
+
+
+def cached_view(cache, bypass=None, coalesce=None):
+    # Decorator for Flask routes that take a 'view_name' argument.
+    # Successful, non-streamed responses are cached and returned with ETag and Last-Modified
+    # headers, so clients and proxies can revalidate with If-None-Match / If-Modified-Since.
+    # 'bypass' is an optional callable returning True for requests that must not be cached.
+    # Bodies are compressed with gzip or brotli when the client accepts it (Accept-Encoding),
+    # the compressed copies are cached next to the entry.
+    # 'coalesce' is an optional SingleFlight: on a cache miss, identical requests that arrive while
+    # the view is being read wait for that read, which also fills the cache for the next ones.
+    def decorator(view_function):
+        @functools.wraps(view_function)
+        def wrapper(view_name):
+            if bypass is not None and bypass():
+                return view_function(view_name)
+
+            key = cache.make_key(view_name, request.path, request.args)
+            entry = cache.get(key)
+            if entry is None:
+                def compute():
+                    generation = cache.generation
+                    response = make_response(view_function(view_name))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    return cache.put(key, response.get_data(), response.mimetype, generation)
+
+                if coalesce is None:
+                    result, shared = compute(), False
+                else:
+                    result, shared = coalesce.do(key, compute)
+                if not isinstance(result, CacheEntry):
+                    if not shared:
+                        return result
+                    # Error responses are not cached, the waiting requests get a copy of the leader's one
+                    return Response(result.get_data(), status=result.status_code, mimetype=result.mimetype)
+                entry = result
+
+            encoding = negotiate_encoding(request.accept_encodings) if len(entry.body) >= MIN_COMPRESS_BYTES else None
+            if encoding is None:
+                response = Response(entry.body, mimetype=entry.mimetype)
+                response.set_etag(entry.etag)
+            else:
+                response = Response(cache.get_encoded(key, entry, encoding), mimetype=entry.mimetype)
+                response.headers['Content-Encoding'] = encoding
+                response.set_etag(f'{entry.etag}-{encoding}')  # every representation has its own ETag
+            response.vary.add('Accept-Encoding')
+            response.last_modified = entry.last_modified
+            response.cache_control.public = True
+            response.cache_control.max_age = max(0, int(entry.expires_at - time.monotonic()))
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+
+def bump_data_generation(db, reason):
+    # Start a new data generation, used by the scripts that reload the data or rebuild the views.
+    # The stamp is an ObjectId rather than a counter, so it still changes when insert_data.py drops
+    # the database and the stamp with it.
+    stamp = ObjectId()
+    db[DATA_GENERATION_COLLECTION].replace_one(
+        {'_id': DATA_GENERATION_ID},
+        {'stamp': stamp, 'reason': reason, 'changed_at': datetime.datetime.now(datetime.timezone.utc)},
+        upsert=True
+    )
+    print(f"Data generation {stamp} ({reason}): the app processes drop their cached responses.")
+    return stamp
+
+
+def read_data_generation(db):
+    document = db[DATA_GENERATION_COLLECTION].find_one({'_id': DATA_GENERATION_ID}, {'stamp': 1})
+    return document['stamp'] if document else None
+
+
+class DataGenerationWatcher:
+    # Polls the data generation stamp at most every 'poll_seconds' and calls 'on_change' (dropping
+    # the caches of the process) when it differs from the last stamp read. check() is called before
+    # every request, only one request thread reads the stamp at a time.
+
+    def __init__(self, db, on_change, poll_seconds=DATA_GENERATION_POLL_SECONDS):
+        self.db = db
+        self.on_change = on_change
+        self.poll_seconds = poll_seconds
+        self._stamp = None
+        self._read = False  # False until the stamp is read once
+        self._checked_at = None
+        self._lock = threading.Lock()
+        self.changes = 0
+
+    def check(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.poll_seconds:
+            return False
+        if not self._lock.acquire(blocking=False):
+            return False  # another thread is reading the stamp
+        try:
+            self._checked_at = now
+            stamp = read_data_generation(self.db)
+            first_read, self._read = not self._read, True
+            if stamp == self._stamp:
+                return False
+            self._stamp = stamp
+            if first_read:
+                # Nothing was cached under an older stamp yet
+                return False
+            self.changes += 1
+            self.on_change()
+            return True
+        except PyMongoError as e:
+            # The caches are kept until the next poll, the request itself reports the database error
+            logging.error(f"Could not read the data generation: {e}")
+            return False
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        return {'data_generation': str(self._stamp) if self._stamp else None, 'data_generation_changes': self.changes}
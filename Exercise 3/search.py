@@ -0,0 +1,121 @@
+import bisect
+import threading
+import unicodedata
+
+from pagination import parse_limit
+
+# Text index of /search, a collection can only have one. A match in the title weighs more than one in the synopsis.
+TEXT_INDEX_NAME = 'name_synopsis_text'
+TEXT_INDEX_WEIGHTS = {
+    'Name': 10,
+    'English name': 5,
+    'Synopsis': 1
+}
+
+# Results per page of /search, and the last page that can be read (pages are skipped on the server)
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE = 50
+MAX_QUERY_LENGTH = 200
+
+# Fields of the anime whose titles are suggested by the autocomplete mode
+TITLE_FIELDS = ('Name', 'English name')
+AUTOCOMPLETE_SIZE = 10
+
+
+# Most relevant first, Id_anime breaks the ties so the pages do not overlap
+SEARCH_SORT = [('score', {'$meta': 'textScore'}), ('Id_anime', 1)]
+
+
+def build_search_filter(query):
+    return {'$text': {'$search': query}}
+
+
+def create_text_index(db):
+    db['anime'].create_index([(field, 'text') for field in TEXT_INDEX_WEIGHTS], weights=TEXT_INDEX_WEIGHTS,
+                             name=TEXT_INDEX_NAME, default_language='english')
+
+
+def normalize(text):
+    # Lowercase without accents and repeated spaces, so 'Pokémon  XY' is found with 'pokemon x'
+    text = unicodedata.normalize('NFKD', text.casefold())
+    return ' '.join(''.join(c for c in text if not unicodedata.combining(c)).split())
+
+
+def parse_search_query(args):
+    # Validate q, page and limit, raises ValueError on invalid values.
+    # Without a limit a search returns SEARCH_PAGE_SIZE results and an autocompletion AUTOCOMPLETE_SIZE titles.
+    query = args.get('q', '').strip()
+    if not query:
+        raise ValueError("'q' must not be empty")
+    if len(query) > MAX_QUERY_LENGTH:
+        raise ValueError(f"'q' must be at most {MAX_QUERY_LENGTH} characters long")
+    raw_page = args.get('page', '1')
+    try:
+        page = int(raw_page)
+    except ValueError:
+        raise ValueError(f"'page' must be an integer, got {raw_page!r}")
+    if not 1 <= page <= MAX_SEARCH_PAGE:
+        raise ValueError(f"'page' must be between 1 and {MAX_SEARCH_PAGE}")
+    default_limit = AUTOCOMPLETE_SIZE if args.get('mode') == 'autocomplete' else SEARCH_PAGE_SIZE
+    limit = parse_limit(args['limit']) if 'limit' in args else default_limit
+    return query, page, limit
+
+
+def search_anime(collection, query, page=1, limit=SEARCH_PAGE_SIZE, fields=None):
+    # One page of the anime matching the words of 'query', the most relevant first.
+    # Returns the documents with their 'score' and whether there is a next page.
+    projection = dict.fromkeys(fields or [], 1)
+    projection.update({'_id': 0, 'score': {'$meta': 'textScore'}})
+    cursor = (collection.find(build_search_filter(query), projection)
+              .sort(SEARCH_SORT)
+              .skip((page - 1) * limit)
+              .limit(limit + 1))  # one extra document to know whether there is a next page
+    documents = list(cursor)
+    return documents[:limit], len(documents) > limit
+
+
+class TitleIndex:
+    # In-memory prefix index of the anime titles for autocompletion: a sorted array of
+    # (normalized title, Id_anime, title) searched with bisect. Every word of a title starts an entry,
+    # so 'titan' finds 'Attack on Titan'. Loaded on first use and rebuilt by refresh() after a data reload.
+
+    def __init__(self):
+        self._index = None  # (keys, entries), replaced as a whole so readers never see half of a refresh
+        self._lock = threading.Lock()
+
+    def refresh(self, collection):
+        entries = []
+        for document in collection.find({}, dict.fromkeys(TITLE_FIELDS + ('Id_anime',), 1)):
+            for field in TITLE_FIELDS:
+                title = document.get(field)
+                if not isinstance(title, str) or not title.strip():
+                    continue
+                words = normalize(title).split(' ')
+                for i in range(len(words)):
+                    entries.append((' '.join(words[i:]), document.get('Id_anime'), title))
+        entries.sort(key=lambda entry: entry[0])
+        # Requests running during a refresh keep reading the previous index
+        self._index = ([entry[0] for entry in entries], entries)
+        return len(entries)
+
+    def complete(self, collection, prefix, limit=AUTOCOMPLETE_SIZE):
+        # Titles of at most 'limit' anime with a word starting with 'prefix', in alphabetical order
+        if self._index is None:
+            with self._lock:  # only the first request loads the titles
+                if self._index is None:
+                    self.refresh(collection)
+        keys, entries = self._index
+        prefix = normalize(prefix)
+        results, seen = [], set()
+        for i in range(bisect.bisect_left(keys, prefix), len(keys)):
+            if not keys[i].startswith(prefix) or len(results) >= limit:
+                break
+            _, anime_id, title = entries[i]
+            if anime_id not in seen:
+                seen.add(anime_id)
+                results.append({'Id_anime': anime_id, 'title': title})
+        return results
+
+    def stats(self):
+        index = self._index
+        return {'titles_indexed': len(index[0]) if index else 0, 'loaded': index is not None}
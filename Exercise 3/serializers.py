@@ -0,0 +1,82 @@
+from bson import Decimal128, ObjectId
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import bsonjs
+except ImportError:
+    bsonjs = None
+
+# JSON serializers of the app, selected with make_json_provider:
+#   flask   Flask's default provider (json module) with the BSON types, the reference
+#   orjson  orjson, with the BSON types converted by bson_default
+#   bsonjs  orjson for every response, and whole views are converted from the raw BSON returned
+#           by MongoDB to JSON by python-bsonjs without building Python dicts (see dumps_raw_documents)
+JSON_SERIALIZERS = ('flask', 'orjson', 'bsonjs')
+
+# Reading a collection with these options returns RawBSONDocuments, which keep the BSON bytes undecoded
+RAW_BSON_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+
+
+def bson_default(value):
+    # BSON types the json module and orjson do not know (orjson handles datetime and Int64 natively)
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    if isinstance(value, RawBSONDocument):
+        return dict(value.items())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class BsonJSONProvider(DefaultJSONProvider):
+    # Flask's default provider (json module), with the BSON types added to the ones it already converts
+    @staticmethod
+    def default(value):
+        try:
+            return bson_default(value)
+        except TypeError:
+            return DefaultJSONProvider.default(value)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    # Flask JSON provider backed by orjson, used by jsonify and every JSON response of the app.
+    # NaN and infinite floats are written as null, which keeps the output valid JSON.
+    option = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=bson_default, option=self.option).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Build the body as bytes directly instead of going through a str
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=bson_default, option=self.option),
+                                        mimetype=self.mimetype)
+
+
+def make_json_provider(app, serializer):
+    # The provider of the selected serializer, falls back to Flask's one if its package is missing
+    if serializer not in JSON_SERIALIZERS:
+        raise ValueError(f"Unknown JSON serializer {serializer!r}, expected one of {', '.join(JSON_SERIALIZERS)}")
+    if serializer == 'flask' or orjson is None:
+        return BsonJSONProvider(app)
+    return OrjsonProvider(app)
+
+
+def raw_documents_available(serializer):
+    return serializer == 'bsonjs' and bsonjs is not None
+
+
+def dumps_raw_documents(documents):
+    # JSON array of RawBSONDocuments, converted in C from their BSON bytes. The output is MongoDB
+    # Extended JSON, so an ObjectId is written as {"$oid": ...} and a date as {"$date": ...}.
+    return b'[' + b','.join(bsonjs.dumps(document.raw).encode('utf-8') for document in documents) + b']'
@@ -0,0 +1,71 @@
+import threading
+
+
+class Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    # Coalesces identical concurrent calls: while a call for a key is running, other threads asking
+    # for the same key wait for it and get its result instead of running the function again.
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, function):
+        # Returns (result, shared), 'shared' is True for the threads that got the result of another call.
+        # An exception of the function is raised in every waiting thread.
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = Call()
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = function()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            return {
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+                'in_flight': len(self._calls)
+            }
+
+    def render_prometheus(self, prefix):
+        stats = self.stats()
+        return '\n'.join([
+            f'# HELP {prefix}_executions_total Calls that ran the view query.',
+            f'# TYPE {prefix}_executions_total counter',
+            f'{prefix}_executions_total {stats["executions"]}',
+            f'# HELP {prefix}_coalesced_total Calls that waited for an identical call instead of querying MongoDB.',
+            f'# TYPE {prefix}_coalesced_total counter',
+            f'{prefix}_coalesced_total {stats["coalesced"]}',
+            f'# HELP {prefix}_in_flight Calls currently running.',
+            f'# TYPE {prefix}_in_flight gauge',
+            f'{prefix}_in_flight {stats["in_flight"]}'
+        ]) + '\n'
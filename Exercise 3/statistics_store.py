@@ -0,0 +1,129 @@
+import datetime
+import math
+import numbers
+
+# Collection with one document of running aggregates per (collection, numeric field):
+# count, sum, min, max and a histogram, from which the mean and the quantiles are derived
+STATISTICS_COLLECTION = 'field_statistics'
+
+# Numeric fields with statistics, and their histogram bins as (lowest value, bin width, number of bins).
+# Values outside the range are counted in the first or the last bin, so the quantiles are exact to one
+# bin width inside the range. Only the non-empty bins are stored.
+STATISTICS_FIELDS = {
+    'anime': {
+        'Score': (0, 0.01, 1000),
+        'Episodes': (0, 1, 5000),
+        'Popularity': (0, 10, 3000),
+        'Members': (0, 1000, 4000)
+    }
+}
+
+# Quantiles returned by get_field_statistics
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9, 0.99)
+
+
+def statistics_id(collection_name, field):
+    return f'{collection_name}:{field}'
+
+
+def is_number(value):
+    return isinstance(value, numbers.Real) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def bin_index(value, low, width, bins):
+    # Same expression as the '$group' key of rebuild_statistics
+    return min(bins - 1, max(0, math.floor((value - low) / width)))
+
+
+def apply_increments(db, collection_name, field, count, total, minimum, maximum, histogram):
+    low, width, bins = STATISTICS_FIELDS[collection_name][field]
+    increments = {'count': count, 'sum': total}
+    increments.update({f'histogram.{index}': n for index, n in histogram.items()})
+    db[STATISTICS_COLLECTION].update_one(
+        {'_id': statistics_id(collection_name, field)},
+        {
+            '$inc': increments,
+            '$min': {'min': minimum},
+            '$max': {'max': maximum},
+            '$set': {'updated_at': datetime.datetime.now(datetime.timezone.utc)},
+            '$setOnInsert': {'collection': collection_name, 'field': field, 'bins': [low, width, bins]}
+        },
+        upsert=True
+    )
+
+
+def update_statistics(db, collection_name, documents):
+    # Add newly inserted documents to the running aggregates, without reading the collection.
+    # Call it with the documents right after inserting them.
+    for field, (low, width, bins) in STATISTICS_FIELDS.get(collection_name, {}).items():
+        values = [float(document[field]) for document in documents if is_number(document.get(field))]
+        if not values:
+            continue
+        histogram = {}
+        for value in values:
+            index = bin_index(value, low, width, bins)
+            histogram[index] = histogram.get(index, 0) + 1
+        apply_increments(db, collection_name, field, len(values), sum(values),
+                         min(values), max(values), histogram)
+
+
+def rebuild_statistics(db, collection_name):
+    # Recompute the aggregates of a collection from scratch (one scan per field).
+    # Only needed when the statistics are missing or the documents were changed in place.
+    for field, (low, width, bins) in STATISTICS_FIELDS.get(collection_name, {}).items():
+        db[STATISTICS_COLLECTION].delete_one({'_id': statistics_id(collection_name, field)})
+        groups = list(db[collection_name].aggregate([
+            {'$match': {field: {'$type': 'number'}}},
+            {'$group': {
+                '_id': {'$min': [bins - 1, {'$max': [0, {'$floor': {
+                    '$divide': [{'$subtract': [f'${field}', low]}, width]}}]}]},
+                'count': {'$sum': 1},
+                'sum': {'$sum': f'${field}'},
+                'min': {'$min': f'${field}'},
+                'max': {'$max': f'${field}'}
+            }}
+        ]))
+        if not groups:
+            continue
+        apply_increments(
+            db, collection_name, field,
+            sum(group['count'] for group in groups),
+            float(sum(group['sum'] for group in groups)),
+            min(group['min'] for group in groups),
+            max(group['max'] for group in groups),
+            {int(group['_id']): group['count'] for group in groups}
+        )
+        print(f"Statistics of '{collection_name}.{field}' rebuilt.")
+
+
+def quantile(statistics, q):
+    # Value below which a fraction q of the values lies, interpolated inside its histogram bin
+    low, width, bins = statistics['bins']
+    target = q * statistics['count']
+    seen = 0
+    for index in sorted(int(key) for key in statistics['histogram']):
+        count = statistics['histogram'][str(index)]
+        if seen + count >= target:
+            value = low + width * (index + (target - seen) / count)
+            return min(statistics['max'], max(statistics['min'], value))
+        seen += count
+    return statistics['max']
+
+
+def get_field_statistics(db, collection_name, field):
+    # count, sum, min, max, mean and QUANTILES of a field, read from the statistics store.
+    # Returns None if the field has no statistics yet (see rebuild_statistics).
+    statistics = db[STATISTICS_COLLECTION].find_one({'_id': statistics_id(collection_name, field)})
+    if statistics is None or not statistics.get('count'):
+        return None
+    return {
+        'collection': collection_name,
+        'field': field,
+        'count': statistics['count'],
+        'sum': statistics['sum'],
+        'min': statistics['min'],
+        'max': statistics['max'],
+        'mean': statistics['sum'] / statistics['count'],
+        'quantiles': {str(q): quantile(statistics, q) for q in QUANTILES},
+        'updated_at': statistics['updated_at']
+    }
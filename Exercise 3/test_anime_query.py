@@ -0,0 +1,18 @@
+from anime_query import PlanCache, parse_query_parameters
+
+
+def build_match(args):
+    parameters = parse_query_parameters(args)
+    return PlanCache().get_plan(parameters).build_match(parameters)
+
+
+def test_genre_match_all_applies_to_genres_only():
+    match = build_match({'genres': 'Action,Drama', 'genre_match': 'all', 'type': 'TV,Movie'})
+    assert match['Genres'] == {'$all': ['action', 'drama']}
+    assert match['Type'] == {'$in': ['Movie', 'TV']}
+
+
+def test_genre_match_any_uses_in():
+    match = build_match({'genres': 'Action,Drama', 'type': 'TV,Movie'})
+    assert match['Genres'] == {'$in': ['action', 'drama']}
+    assert match['Type'] == {'$in': ['Movie', 'TV']}
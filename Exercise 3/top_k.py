@@ -0,0 +1,113 @@
+from value_dictionary import DICTIONARY_COLLECTION
+
+DEFAULT_K = 10
+MAX_K = 1000
+
+# Metrics ranking anime documents: metric -> (field, direction). Ties are broken by Id_anime,
+# and every metric has an index (field, Id_anime) plus one per equality filter (Genres or Type first),
+# see get_top_k_indexes, so the first k documents are read from an index whatever the filters.
+DOCUMENT_METRICS = {
+    'score': ('Score', -1),
+    'popularity': ('Popularity', -1),
+    'members': ('Members', -1),
+    'episodes': ('Episodes', -1)
+}
+
+# Metrics ranking groups of anime: metric -> (grouped field, ranking field). Without filters they are
+# read from the value dictionary (one document per genre, studio or producer, already aggregated);
+# with filters the matching anime are grouped on the fly.
+GROUP_METRICS = {
+    'genres_by_score': ('Genres', 'avg_score'),
+    'genres_by_count': ('Genres', 'anime_count'),
+    'studios_by_score': ('Studios', 'avg_score'),
+    'studios_by_count': ('Studios', 'anime_count'),
+    'producers_by_score': ('Producers', 'avg_score'),
+    'producers_by_count': ('Producers', 'anime_count')
+}
+
+# Fields used as equality filters, an index is created with each of them in front of the metric
+EQUALITY_FILTER_FIELDS = ('Genres', 'Type')
+
+
+def get_top_k_indexes():
+    # Equality-sort-range: the equality filter first, then the metric (sort), and the Id_anime tie breaker
+    indexes = []
+    for field, direction in DOCUMENT_METRICS.values():
+        indexes.append([(field, direction), ('Id_anime', 1)])
+        for filter_field in EQUALITY_FILTER_FIELDS:
+            indexes.append([(filter_field, 1), (field, direction), ('Id_anime', 1)])
+    return indexes
+
+
+def parse_top_query(args):
+    # Validate k, genre, type and min_score, raises ValueError on invalid values
+    raw_k = args.get('k')
+    try:
+        k = int(raw_k) if raw_k is not None else DEFAULT_K
+    except ValueError:
+        raise ValueError(f"'k' must be an integer, got {raw_k!r}")
+    if not 1 <= k <= MAX_K:
+        raise ValueError(f"'k' must be between 1 and {MAX_K}")
+
+    filters = {}
+    if args.get('genre'):
+        filters['genre'] = args['genre'].strip().lower()  # Genres is stored as a lowercase array
+    if args.get('type'):
+        filters['type'] = args['type'].strip()
+    if args.get('min_score') is not None:
+        try:
+            filters['min_score'] = float(args['min_score'])
+        except ValueError:
+            raise ValueError(f"'min_score' must be a number, got {args['min_score']!r}")
+    return k, filters
+
+
+def build_anime_filter(filters):
+    query = {}
+    if 'genre' in filters:
+        query['Genres'] = filters['genre']
+    if 'type' in filters:
+        query['Type'] = filters['type']
+    if 'min_score' in filters:
+        query['Score'] = {'$gte': filters['min_score']}
+    return query
+
+
+def build_top_documents_query(metric, filters):
+    # Filter and sort of /top/<metric> for an anime metric
+    field, direction = DOCUMENT_METRICS[metric]
+    query = build_anime_filter(filters)
+    # Documents without a number in the metric are not ranked
+    query[field] = dict(query.get(field, {}), **{'$type': 'number'})
+    return query, [(field, direction), ('Id_anime', 1)]
+
+
+def top_documents(db, metric, k, filters, fields=None):
+    query, sort = build_top_documents_query(metric, filters)
+    projection = dict.fromkeys(fields or [], 1)
+    projection['_id'] = 0
+    return list(db['anime'].find(query, projection).sort(sort).limit(k))
+
+
+def top_groups(db, metric, k, filters):
+    field, ranking = GROUP_METRICS[metric]
+    if not filters:
+        # (collection, field, ranking) is indexed in the dictionary, see value_dictionary.py
+        return list(db[DICTIONARY_COLLECTION].find(
+            {'collection': 'anime', 'field': field, ranking: {'$type': 'number'}},
+            {'_id': 0, 'value': 1, 'anime_count': 1, 'avg_score': 1}
+        ).sort([(ranking, -1), ('value', 1)]).limit(k))
+
+    return list(db['anime'].aggregate([
+        {'$match': build_anime_filter(filters)},
+        {'$unwind': f'${field}'},
+        {'$group': {
+            '_id': f'${field}',
+            'anime_count': {'$sum': 1},
+            'avg_score': {'$avg': '$Score'}
+        }},
+        {'$match': {ranking: {'$type': 'number'}}},
+        {'$sort': {ranking: -1, '_id': 1}},
+        {'$limit': k},
+        {'$project': {'_id': 0, 'value': '$_id', 'anime_count': 1, 'avg_score': 1}}
+    ]))
@@ -0,0 +1,47 @@
+import pymongo
+
+# Side collection with one document per distinct value of the array fields (genres, studios, producers)
+# of a collection, with the number of anime that have it and the sum/count of their scores
+DICTIONARY_COLLECTION = 'anime_dictionary'
+
+
+def build_value_dictionary(db, source_collection, fields, score_field=None):
+    # (Re)build the dictionary entries of 'source_collection' for every field in 'fields'.
+    # Called by the loaders after the data is inserted, so the per-value aggregations read
+    # a few hundred dictionary documents instead of unwinding the whole collection.
+    dictionary = db[DICTIONARY_COLLECTION]
+    dictionary.create_index([('collection', pymongo.ASCENDING), ('field', pymongo.ASCENDING),
+                             ('anime_count', pymongo.DESCENDING)], name='collection_field_count_index')
+    dictionary.create_index([('collection', pymongo.ASCENDING), ('field', pymongo.ASCENDING),
+                             ('avg_score', pymongo.DESCENDING)], name='collection_field_score_index')
+
+    for field in fields:
+        group = {
+            '_id': {'$concat': [source_collection, ':', field, ':', f'${field}']},
+            'value': {'$first': f'${field}'},
+            'anime_count': {'$sum': 1}
+        }
+        if score_field:
+            group['score_sum'] = {'$sum': f'${score_field}'}
+            group['score_count'] = {'$sum': {'$cond': [{'$isNumber': f'${score_field}'}, 1, 0]}}
+
+        pipeline = [
+            {'$match': {field: {'$type': 'array'}}},
+            {'$unwind': f'${field}'},
+            {'$match': {field: {'$type': 'string'}}},
+            {'$group': group},
+            {'$set': {'collection': source_collection, 'field': field}}
+        ]
+        if score_field:
+            # Stored so that the values can be ranked by average score on an index (top_k.py)
+            pipeline.append({'$set': {'avg_score': {'$cond': [
+                {'$gt': ['$score_count', 0]}, {'$divide': ['$score_sum', '$score_count']}, None]}}})
+        pipeline.append({'$merge': {'into': DICTIONARY_COLLECTION, 'on': '_id',
+                                    'whenMatched': 'replace', 'whenNotMatched': 'insert'}})
+
+        # Values that disappeared from the data must not stay in the dictionary
+        dictionary.delete_many({'collection': source_collection, 'field': field})
+        db[source_collection].aggregate(pipeline)
+        count = dictionary.count_documents({'collection': source_collection, 'field': field})
+        print(f"Dictionary of '{source_collection}.{field}' built with {count} distinct values.")
+
@@ -0,0 +1,47 @@
+# Template file and human-readable title of every view, shared by app.py and async_app.py
+VIEW_TEMPLATES = {
+    'high_score_anime': 'high_score_anime.html',
+    'action_anime': 'action_anime.html',
+    'long_series': 'long_series.html',
+    'recent_anime': 'recent_anime.html',
+    'popular_anime': 'popular_anime.html',
+    'average_score_anime': 'average_score_anime.html',
+    'average_score_per_genre': 'average_score_per_genre.html',
+    'total_anime_per_studio': 'total_anime_per_studio.html',
+    'top_10_highest_rated_anime': 'top_10_highest_rated_anime.html',
+    'total_episodes_per_studio': 'total_episodes_per_studio.html',
+    'top_10_most_popular_anime': 'top_10_most_popular_anime.html',
+    'count_anime_by_type': 'count_anime_by_type.html'
+}
+
+VIEW_TITLES = {
+    'high_score_anime': 'High Score Anime',
+    'action_anime': 'Action Anime',
+    'long_series': 'Long Series Anime',
+    'recent_anime': 'Recent Anime',
+    'popular_anime': 'Popular Anime',
+    'average_score_anime': 'Average Score Anime',
+    'average_score_per_genre': 'Average Score per Genre',
+    'total_anime_per_studio': 'Total Anime per Studio',
+    'top_10_highest_rated_anime': 'Top 10 Highest Rated Anime',
+    'total_episodes_per_studio': 'Total Episodes per Studio',
+    'top_10_most_popular_anime': 'Top 10 Most Popular Anime',
+    'count_anime_by_type': 'Total number for each type'
+}
+
+# Fields rendered by the template of every view. The templates request their view with
+# fields=template, so only these fields are read from MongoDB and sent to the browser.
+VIEW_FIELDS = {
+    'high_score_anime': ['Name', 'English name', 'Score', 'Episodes', 'Genres', 'Members', 'Synopsis', 'Image URL'],
+    'action_anime': ['Name', 'Score', 'Episodes', 'Genres', 'Premiered'],
+    'long_series': ['Name', 'Type', 'Episodes', 'Rank', 'Image URL'],
+    'recent_anime': ['Name', 'Premiered', 'Aired', 'Image URL'],
+    'popular_anime': ['Name', 'Type', 'Episodes', 'Popularity', 'Image URL'],
+    'average_score_anime': ['Name', 'Type', 'Episodes', 'Score', 'Popularity'],
+    'average_score_per_genre': ['genres', 'averageScore'],
+    'total_anime_per_studio': ['Studios', 'totalAnime'],
+    'top_10_highest_rated_anime': ['Name', 'Score'],
+    'total_episodes_per_studio': ['Studios', 'totalEpisodes'],
+    'top_10_most_popular_anime': ['Name', 'Popularity'],
+    'count_anime_by_type': ['Type', 'animeCount']
+}
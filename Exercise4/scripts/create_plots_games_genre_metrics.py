@@ -1,17 +1,17 @@
-import os
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
 
-# Get the absolute directory of the current script
-script_dir = os.path.dirname(os.path.abspath(__file__))
+# Reads the gold tables of Exercise 1 (Parquet) or their CSV copies in the data folder
+from gold_tables import read_gold_table
 
-# Define the relative path to the data folder
-file_path = os.path.join(script_dir, "../data", "games_genre_metrics.csv")
+# Columns of the gold table used by the plots
+GENRE_METRIC_COLUMNS = ['Genres', 'Average_Playtime_Forever', 'Average_Positive_Review_Rate',
+                        'Total_Estimated_Players', 'Total_Revenue', 'Number_of_Games']
 
-# Read the CSV file
-games_genre_metrics = pd.read_csv(file_path)
+# Read the gold table
+games_genre_metrics = read_gold_table("games_genre_metrics", GENRE_METRIC_COLUMNS)
 
 # Bar chart for total revenue by genre
 def create_bar_charts():
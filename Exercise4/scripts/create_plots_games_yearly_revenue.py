@@ -1,16 +1,15 @@
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
-import os
 
-# Get the absolute directory of the current script
-script_dir = os.path.dirname(os.path.abspath(__file__))
+# Reads the gold tables of Exercise 1 (Parquet) or their CSV copies in the data folder
+from gold_tables import read_gold_table
 
-# Define the relative path to the data folder
-file_path = os.path.join(script_dir, "../data", "games_yearly_revenue.csv")
+# Columns of the gold table used by the plots
+REVENUE_COLUMNS = ['Release_Year', 'Total_Estimated_Revenue', 'Total_Estimated_Owners', 'Number_of_Games']
 
-# Read the CSV file
-games_yearly_revenue = pd.read_csv(file_path)
+# Read the gold table
+games_yearly_revenue = read_gold_table("games_yearly_revenue", REVENUE_COLUMNS)
 
 def create_line_plots():
     # Line Plot 1: Yearly trend of total estimated revenue over time
@@ -0,0 +1,21 @@
+import os
+
+import pandas as pd
+
+# Get the absolute directory of the current script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Define the relative path to the data folder
+data_dir = os.path.join(script_dir, "../data")
+
+# Gold layer of the Games pipeline, written as Parquet datasets by 'python games_etl.py all' in "Exercise 1"
+gold_dir = os.path.join(script_dir, "../../Exercise 1/gold")
+
+
+def read_gold_table(name, columns):
+    # The Parquet dataset gold/<name>/ of Exercise 1 (memory-mapped, only these columns) when the
+    # pipeline was run, else the CSV copy committed in the data folder
+    path = os.path.join(gold_dir, name)
+    if os.path.isdir(path):
+        return pd.read_parquet(path, columns=columns, memory_map=True)
+    return pd.read_csv(os.path.join(data_dir, name + ".csv"), usecols=columns)
@@ -0,0 +1,85 @@
+# Measure the latency of reading every view of anime_db.
+#
+# Usage:
+#   python benchmark_views.py --output before.json   (on the database loaded with the old script)
+#   python benchmark_views.py --output after.json    (after reloading with typed ingestion)
+#   python benchmark_views.py --compare before.json after.json
+import argparse
+import json
+import statistics
+import time
+
+import pymongo
+
+VIEWS = [
+    "currently_airing_anime",
+    "sci_fi_genre_anime",
+    "long_running_anime",
+    "users_watched_more_than_500",
+    "popular_anime_by_favourites",
+    "top_rated_anime",
+    "avg_score_by_genre",
+    "num_anime_per_genre",
+    "top_studios_by_avg_score",
+    "country_with_most_users",
+    "most_active_users_by_total_episodes_watched",
+    "top_producers_by_anime_count"
+]
+
+
+def benchmark_view(db, view_name, repeats):
+    # Read the whole view 'repeats' times, after one warm-up read
+    documents = len(list(db[view_name].find()))
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        list(db[view_name].find())
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "documents": documents,
+        "median_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+        "min_ms": round(timings[0], 2)
+    }
+
+
+def run(uri, db_name, repeats):
+    db = pymongo.MongoClient(uri)[db_name]
+    results = {}
+    for view_name in VIEWS:
+        results[view_name] = benchmark_view(db, view_name, repeats)
+        print(f"{view_name:<45} {results[view_name]['median_ms']:>10.2f} ms  ({results[view_name]['documents']} documents)")
+    return results
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{'view':<45} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+    for view_name in VIEWS:
+        if view_name not in before or view_name not in after:
+            continue
+        old, new = before[view_name]["median_ms"], after[view_name]["median_ms"]
+        speedup = f"{old / new:.1f}x" if new else "-"
+        print(f"{view_name:<45} {old:>10.2f} {new:>10.2f} {speedup:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the latency of the anime_db views.")
+    parser.add_argument("--uri", default="mongodb://localhost:27017/")
+    parser.add_argument("--db", default="anime_db")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        results = run(args.uri, args.db, args.repeats)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
@@ -0,0 +1,346 @@
+import datetime
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import bson
+import numpy as np
+import pandas as pd
+from bson.raw_bson import RawBSONDocument
+from pymongo import ASCENDING, ReplaceOne
+from tqdm import tqdm
+
+# Defaults of load_csv, tuned for the multi-GB files such as users-score-2023.csv
+CHUNK_BYTES = 8 * 1024 * 1024
+WRITER_THREADS = 4
+MAX_IN_FLIGHT_BATCHES = 8
+
+# One document per loaded collection with the source file and the committed byte offset
+CHECKPOINT_COLLECTION = "ingestion_checkpoints"
+# One document per committed chunk with its byte range and checksum
+CHUNK_COLLECTION = "ingestion_chunks"
+
+# Placeholders the MyAnimeList files use for unknown values, they are stored as missing fields
+MISSING_VALUES = ["Unknown", "UNKNOWN", ""]
+
+# Seasons in chronological order and the "<season> <year>" format of the Premiered columns,
+# the same derivation as premiered.py of the Flask app
+SEASONS = ["winter", "spring", "summer", "fall"]
+PREMIERED_PATTERN = r"^\s*(?P<season>winter|spring|summer|fall)\s+(?P<year>\d{4})\s*$"
+
+
+def read_chunks(csv_file, chunk_bytes):
+    # Split the file after the header into blocks of roughly 'chunk_bytes' that end on a record boundary.
+    # A newline ends a record only if it is outside quotes, i.e. the number of '"' seen so far is even
+    # (escaped quotes are doubled, so they do not change the parity). Yields (start, end, block).
+    while True:
+        start = csv_file.tell()
+        block = csv_file.read(chunk_bytes)
+        if not block:
+            return
+        quotes = block.count(b'"')
+        while not (block.endswith(b"\n") and quotes % 2 == 0):
+            rest = csv_file.readline()
+            if not rest:
+                break
+            block += rest
+            quotes += rest.count(b'"')
+        yield start, csv_file.tell(), block
+
+
+def chunk_checksum(block, salt):
+    # The salt identifies the load settings (key and schema), so the same bytes loaded
+    # with a different schema do not count as already written
+    return hashlib.blake2b(block, digest_size=16, key=salt).hexdigest()
+
+
+def coerce_chunk(chunk, schema):
+    # Convert the columns listed in 'schema' to their type:
+    #   "int" / "float"  numbers, values that are not numbers become missing
+    #   "list"           comma separated strings become arrays of trimmed strings
+    #   "lowercase_list" the same, lowercased, for names that are matched by equality (genres, studios)
+    #   "premiered"      "<season> <year>" strings, kept as they are, with premiered_year, premiered_season and
+    #                    premiered_ordinal (four seasons per year, sortable) added for range queries
+    # Placeholders such as "Unknown" become missing in every column of the schema.
+    for column, kind in schema.items():
+        if column not in chunk:
+            continue
+        values = chunk[column].replace(MISSING_VALUES, np.nan)
+        if kind in ("int", "float"):
+            numbers = pd.to_numeric(values, errors="coerce")
+            chunk[column] = numbers.round().astype("Int64") if kind == "int" else numbers.astype("float64")
+        elif kind in ("list", "lowercase_list"):
+            names = values.astype("string").str.strip()
+            if kind == "lowercase_list":
+                names = names.str.lower()
+            chunk[column] = names.str.split(r"\s*,\s*", regex=True)
+        elif kind == "premiered":
+            parts = values.astype("string").str.lower().str.extract(PREMIERED_PATTERN)
+            seasons = pd.to_numeric(parts["season"].map({season: i for i, season in enumerate(SEASONS)}), errors="coerce")
+            chunk["premiered_year"] = pd.to_numeric(parts["year"], errors="coerce").astype("Int64")
+            chunk["premiered_season"] = parts["season"]
+            chunk["premiered_ordinal"] = chunk["premiered_year"] * len(SEASONS) + seasons.astype("Int64")
+        else:
+            raise ValueError(f"Unknown type '{kind}' for column '{column}'")
+    return chunk
+
+
+def is_missing(value):
+    return not isinstance(value, list) and pd.isna(value)
+
+
+def parse_chunk(header, block, key_fields, schema, read_csv_options):
+    # Runs in a worker process: parse one block of the CSV file and BSON encode its rows.
+    # Rows without a natural key cannot be upserted idempotently and are skipped.
+    chunk = pd.read_csv(io.BytesIO(header + block), **(read_csv_options or {}))
+    if schema:
+        chunk = coerce_chunk(chunk, schema)
+    skipped = 0
+    if key_fields:
+        rows = len(chunk)
+        chunk = chunk.dropna(subset=key_fields)
+        skipped = rows - len(chunk)
+        for field in key_fields:
+            # Columns with missing values are parsed as floats, keep the keys integers
+            if chunk[field].dtype.kind == "f" and (chunk[field] % 1 == 0).all():
+                chunk[field] = chunk[field].astype("int64")
+    records = chunk.to_dict(orient="records")
+    if schema:
+        # Missing values are left out of the document instead of being stored as NaN/null
+        records = [{field: value for field, value in record.items() if not is_missing(value)} for record in records]
+    documents = [bson.encode(record) for record in records]
+    return documents, skipped
+
+
+class LoadStats:
+    def __init__(self, total_bytes):
+        self.total_bytes = total_bytes
+        self.bytes_read = 0
+        self.rows_inserted = 0
+        self.rows_skipped = 0
+        self.batches_inserted = 0
+        self.batches_unchanged = 0
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def add_batch(self, rows, skipped):
+        with self._lock:
+            self.rows_inserted += rows
+            self.rows_skipped += skipped
+            self.batches_inserted += 1
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    def summary(self):
+        elapsed = max(self.elapsed, 1e-9)
+        return {
+            "rows": self.rows_inserted,
+            "rows_skipped": self.rows_skipped,
+            "batches": self.batches_inserted,
+            "batches_unchanged": self.batches_unchanged,
+            "megabytes": round(self.bytes_read / 1e6, 2),
+            "seconds": round(elapsed, 2),
+            "rows_per_second": round(self.rows_inserted / elapsed),
+            "megabytes_per_second": round(self.bytes_read / 1e6 / elapsed, 2)
+        }
+
+
+class Checkpoint:
+    # Tracks which chunks of a file have been written. Chunks finish out of order, so the committed
+    # offset only moves forward over the contiguous run of finished chunks from the start of the file.
+
+    def __init__(self, db, collection_name, file_path, settings):
+        self.checkpoints = db[CHECKPOINT_COLLECTION]
+        self.chunks = db[CHUNK_COLLECTION]
+        self.collection_name = collection_name
+        stat = os.stat(file_path)
+        self.fingerprint = {
+            "file": os.path.basename(file_path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "settings": settings
+        }
+        self.state = self.checkpoints.find_one({"_id": collection_name})
+        self._finished = {}
+        self._lock = threading.Lock()
+
+        if self.file_unchanged():
+            self.committed_offset = self.state["committed_offset"]
+            self.known_checksums = {}
+            self.rewrite_version = self.state.get("rewrite_version", 0)
+        else:
+            # New or modified file: start from the beginning, but skip the chunks whose
+            # checksum matches the previous load of the same byte range.
+            # Reloading a modified file can replace documents in place or leave rows that were removed
+            # from it, which the materialized views (that only process new _ids) cannot see, so it
+            # increments rewrite_version before anything is written, see get_rewrite_version
+            self.rewrite_version = self.state.get("rewrite_version", 0) + 1 if self.state is not None else 0
+            self.committed_offset = None
+            self.known_checksums = {
+                (chunk["start"], chunk["end"]): chunk["checksum"]
+                for chunk in self.chunks.find({"collection": collection_name})
+            }
+            self.chunks.delete_many({"collection": collection_name})
+            self.checkpoints.replace_one(
+                {"_id": collection_name},
+                {**self.fingerprint, "committed_offset": None, "completed": False, "started_at": now(),
+                 "rewrite_version": self.rewrite_version},
+                upsert=True
+            )
+
+    def file_unchanged(self):
+        return self.state is not None and all(self.state.get(key) == value for key, value in self.fingerprint.items())
+
+    @property
+    def completed(self):
+        return self.file_unchanged() and self.state.get("completed", False)
+
+    def start(self, header_end):
+        # Offset where reading resumes: right after the header or after the last committed chunk
+        if self.committed_offset is None:
+            self.committed_offset = header_end
+        return self.committed_offset
+
+    def is_unchanged(self, start, end, checksum):
+        return self.known_checksums.get((start, end)) == checksum
+
+    def commit(self, start, end, checksum, rows):
+        with self._lock:
+            self.chunks.replace_one(
+                {"_id": f"{self.collection_name}:{start}"},
+                {"collection": self.collection_name, "start": start, "end": end, "checksum": checksum, "rows": rows},
+                upsert=True
+            )
+            self._finished[start] = end
+            advanced = False
+            while self.committed_offset in self._finished:
+                self.committed_offset = self._finished.pop(self.committed_offset)
+                advanced = True
+            if advanced:
+                self.checkpoints.update_one(
+                    {"_id": self.collection_name},
+                    {"$set": {"committed_offset": self.committed_offset, "updated_at": now()}}
+                )
+
+    def finish(self):
+        self.checkpoints.update_one(
+            {"_id": self.collection_name},
+            {"$set": {"completed": True, "committed_offset": self.committed_offset, "finished_at": now()}}
+        )
+
+
+def now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def get_rewrite_version(db, collection_name):
+    # Number of times a modified file was reloaded into the collection, 0 for a collection only ever
+    # appended to. The materialized views over it are rebuilt when it changes.
+    state = db[CHECKPOINT_COLLECTION].find_one({"_id": collection_name}, {"rewrite_version": 1})
+    return state.get("rewrite_version", 0) if state else 0
+
+
+def load_csv(file_path, collection, key_fields=None, schema=None, chunk_bytes=CHUNK_BYTES, processes=None,
+             writers=WRITER_THREADS, max_in_flight=MAX_IN_FLIGHT_BATCHES, read_csv_options=None):
+    # Load a CSV file into 'collection' in a single pass over the file:
+    #   - the calling thread reads the file in blocks that end on a record boundary,
+    #   - a process pool parses every block and BSON encodes its rows,
+    #   - a pool of writer threads writes them with unordered bulk writes, each thread
+    #     on its own connection of the client's pool (maxPoolSize must be >= writers).
+    # At most 'max_in_flight' blocks are being converted or written at the same time,
+    # the reader waits for a free slot, so memory stays bounded when MongoDB is the bottleneck.
+    #
+    # With 'key_fields' the rows are upserted by that natural key, and the byte offset and checksum
+    # of every written block are recorded, so an interrupted load resumes after the last committed
+    # block and loading an unchanged file again is a no-op.
+    # With 'schema' (column -> "int", "float" or "list") the values are typed before they are stored.
+    settings = json.dumps([key_fields, schema, read_csv_options], sort_keys=True, default=str)
+    salt = hashlib.blake2b(settings.encode("utf-8"), digest_size=16).digest()
+    checkpoint = Checkpoint(collection.database, collection.name, file_path, salt.hex()) if key_fields else None
+    if checkpoint is not None and checkpoint.completed:
+        print(f"'{os.path.basename(file_path)}' is unchanged since it was loaded into '{collection.name}', skipping.")
+        return None
+    if key_fields:
+        collection.create_index([(field, ASCENDING) for field in key_fields], unique=True,
+                                name="_".join(key_fields) + "_natural_key")
+
+    stats = LoadStats(os.path.getsize(file_path))
+    slots = threading.BoundedSemaphore(max_in_flight)
+    progress = tqdm(total=stats.total_bytes, unit="B", unit_scale=True, desc=f"Inserting {collection.name}")
+    errors = []
+
+    def write_batch(documents, skipped, start, end, checksum):
+        try:
+            raw_documents = [RawBSONDocument(document) for document in documents]
+            if key_fields:
+                collection.bulk_write([
+                    ReplaceOne({field: document[field] for field in key_fields}, document, upsert=True)
+                    for document in raw_documents
+                ], ordered=False)
+                checkpoint.commit(start, end, checksum, len(documents))
+            elif raw_documents:
+                collection.insert_many(raw_documents, ordered=False)
+            stats.add_batch(len(documents), skipped)
+            progress.set_postfix(rows=stats.rows_inserted, refresh=False)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            slots.release()
+
+    def on_converted(future, start, end, checksum):
+        # Hand the converted block over to the writer threads
+        if future.exception() is not None:
+            errors.append(future.exception())
+            slots.release()
+        else:
+            writer_pool.submit(write_batch, *future.result(), start, end, checksum)
+
+    with open(file_path, "rb") as csv_file, \
+            ProcessPoolExecutor(processes) as converter_pool, \
+            ThreadPoolExecutor(writers) as writer_pool:
+        header = csv_file.readline()
+        if checkpoint is not None:
+            csv_file.seek(checkpoint.start(csv_file.tell()))
+        stats.bytes_read = csv_file.tell()
+        progress.update(stats.bytes_read)
+
+        for start, end, block in read_chunks(csv_file, chunk_bytes):
+            if errors:
+                break
+            checksum = chunk_checksum(block, salt)
+            if checkpoint is not None and checkpoint.is_unchanged(start, end, checksum):
+                # Same bytes as in the previous load, their rows are already upserted
+                checkpoint.commit(start, end, checksum, 0)
+                stats.batches_unchanged += 1
+            else:
+                slots.acquire()
+                future = converter_pool.submit(parse_chunk, header, block, key_fields, schema, read_csv_options)
+                future.add_done_callback(lambda f, s=start, e=end, c=checksum: on_converted(f, s, e, c))
+
+            progress.update(end - stats.bytes_read)
+            stats.bytes_read = end
+
+        # Wait until every submitted block has been converted and written
+        for _ in range(max_in_flight):
+            slots.acquire()
+
+    progress.close()
+    stats.finished_at = time.perf_counter()
+    if errors:
+        raise errors[0]
+    if checkpoint is not None:
+        checkpoint.finish()
+
+    summary = stats.summary()
+    print(f"Inserted {summary['rows']} rows into '{collection.name}' in {summary['seconds']}s "
+          f"({summary['rows_per_second']} rows/s, {summary['megabytes_per_second']} MB/s)")
+    if summary["rows_skipped"]:
+        print(f"Skipped {summary['rows_skipped']} rows without a value for {key_fields}.")
+    return summary
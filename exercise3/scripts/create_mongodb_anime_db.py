@@ -1,7 +1,8 @@
 import os
-from tqdm import tqdm
+import sys
 import pymongo
-import pandas as pd
+from bson import json_util
+from bulk_loader import CHUNK_BYTES, WRITER_THREADS, get_rewrite_version, load_csv
 
 # Get the directory containing the current script
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -9,46 +10,93 @@ script_dir = os.path.dirname(os.path.abspath(__file__))
 # Define the relative path to the data folder
 data_dir = os.path.join(script_dir, "../data")
 
-# Establish a connection to MongoDB and the anime_db database
-client = pymongo.MongoClient("mongodb://localhost:27017/")
+# Reuse the MongoDB helpers of the Flask app in "Exercise 3"
+sys.path.append(os.path.join(script_dir, "../../Exercise 3"))
+from materialized_views import materialize_view
+from migrate import apply_view
+from value_dictionary import DICTIONARY_COLLECTION, build_value_dictionary
+from query_metrics import query_metrics
+
+# Pre-compute the views into collections with '$merge' instead of plain (non-materialized) views.
+# Rerunning the script then only processes documents inserted since the last run, or rebuilds the
+# views over a collection whose file was modified and reloaded.
+MATERIALIZE_VIEWS = True
+
+# Latency histograms of every MongoDB command of the run, in the Prometheus text format
+# (can be picked up by node_exporter's textfile collector), and the commands slower than MONGO_SLOW_QUERY_MS
+METRICS_FILE = os.path.join(script_dir, "mongodb_metrics.prom")
+SLOW_QUERY_FILE = os.path.join(script_dir, "slow_queries.json")
+
+# Establish a connection to MongoDB and the anime_db database.
+# The pool must hold at least one connection per writer thread of the bulk loader.
+client = pymongo.MongoClient("mongodb://localhost:27017/", maxPoolSize=WRITER_THREADS * 2,
+                             event_listeners=[query_metrics])
 db = client["anime_db"]
 
+# Natural key of every collection: rows are upserted by it, so reloading a file never duplicates documents
+NATURAL_KEYS = {
+    "anime_dataset_2023": ["anime_id"],
+    "users_details_2023": ["Mal ID"],
+    "anime_filtered": ["anime_id"],
+    "final_animedataset": ["user_id", "anime_id"],
+    "user_filtered": ["user_id", "anime_id"],
+    "users_score_2023": ["user_id", "anime_id"]
+}
+
+# Types of the columns of every file, see bulk_loader.coerce_chunk. Numbers are stored as numbers,
+# comma separated names as arrays and "Unknown" placeholders as missing fields, so the views can
+# filter and sort on the fields directly and use their indexes.
+SCHEMAS = {
+    "anime_dataset_2023": {
+        "anime_id": "int", "Score": "float", "Episodes": "int", "Rank": "int", "Popularity": "int",
+        "Favorites": "int", "Scored By": "int", "Members": "int",
+        "Genres": "lowercase_list", "Producers": "lowercase_list", "Licensors": "list", "Studios": "lowercase_list",
+        "Premiered": "premiered"
+    },
+    "users_details_2023": {
+        "Mal ID": "int", "Days Watched": "float", "Mean Score": "float", "Watching": "int", "Completed": "int",
+        "On Hold": "int", "Dropped": "int", "Plan to Watch": "int", "Total Entries": "int", "Rewatched": "int",
+        "Episodes Watched": "int"
+    },
+    "anime_filtered": {
+        "anime_id": "int", "Score": "float", "Episodes": "int", "Ranked": "int", "Popularity": "int",
+        "Members": "int", "Favorites": "int", "Watching": "int", "Completed": "int", "On-Hold": "int",
+        "Dropped": "int", "Genres": "lowercase_list", "Producers": "lowercase_list", "Licensors": "list",
+        "Studios": "lowercase_list", "Premiered": "premiered"
+    },
+    "final_animedataset": {
+        "anime_id": "int", "user_id": "int", "my_score": "int", "score": "float", "scored_by": "int",
+        "rank": "int", "popularity": "int", "Genres": "lowercase_list", "genre": "lowercase_list"
+    },
+    "user_filtered": {"user_id": "int", "anime_id": "int", "rating": "int"},
+    "users_score_2023": {"user_id": "int", "anime_id": "int", "rating": "int"}
+}
+
 # Function to insert data from CSV to MongoDB collection
 def insert_csv_to_collection(file_name, collection_name):
     # Construct the full path to the file by combining the script's directory and the file name
     file_path = os.path.join(data_dir, file_name)
     print(f"Processing file at: {file_path}")
-    
-    # Read the CSV file into a pandas DataFrame
-    data = pd.read_csv(file_path)
-    
-    # Convert the DataFrame to a dictionary format that MongoDB accepts
-    data_dict = data.to_dict("records")
-    
-    # Insert the data into the MongoDB collection
-    collection = db[collection_name]
-    collection.insert_many(data_dict)
+
+    # Stream the file into the collection instead of loading it into memory at once
+    load_csv(file_path, db[collection_name], key_fields=NATURAL_KEYS[collection_name], schema=SCHEMAS[collection_name])
     print(f"Data inserted into collection '{collection_name}' successfully!")
 
 # Function to insert data into MongoDB in chunks for larger datasets
-def insert_csv_in_chunks(file_name, collection_name, chunk_size=10000):
+def insert_csv_in_chunks(file_name, collection_name, chunk_bytes=CHUNK_BYTES):
     file_path = os.path.join(script_dir, file_name)
     print(f"Processing file at: {file_path}")
 
-    # Create the MongoDB collection
-    collection = db[collection_name]
-
-    # Read the CSV file in chunks, using tqdm library to print the progress
-    total_rows = sum(1 for _ in open(file_path))
-    for chunk in tqdm(pd.read_csv(file_path, chunksize=chunk_size), total=(total_rows // chunk_size) + 1, desc=f"Inserting {collection_name}"):
-        # Convert the chunk to a list of dictionaries (records) and insert into MongoDB
-        data_dict = chunk.to_dict(orient="records")
-        collection.insert_many(data_dict)
-    
+    # Read the file once, convert the chunks in a process pool and upsert them with unordered
+    # bulk writes from several connections, printing the progress and rows/s and MB/s.
+    # Every committed chunk is checkpointed, so rerunning after a crash resumes where it stopped.
+    load_csv(file_path, db[collection_name], key_fields=NATURAL_KEYS[collection_name],
+             schema=SCHEMAS[collection_name], chunk_bytes=chunk_bytes)
     print(f"Data inserted into collection '{collection_name}' successfully!")
 
 def insert_datasets():
-    # Insert the datasets into MongoDB collections using filenames relative to the script directory
+    # Insert the datasets into MongoDB collections using filenames relative to the script directory.
+    # Files that were already loaded completely and did not change are skipped.
     insert_csv_to_collection("anime-dataset-2023.csv", "anime_dataset_2023")
     insert_csv_to_collection("users-details-2023.csv", "users_details_2023")
     insert_csv_to_collection("anime-filtered.csv", "anime_filtered")
@@ -58,15 +106,24 @@ def insert_datasets():
     insert_csv_in_chunks("user-filtered.csv", "user_filtered")
     insert_csv_in_chunks("users-score-2023.csv", "users_score_2023")
 
+# Count the anime (and scores) of every distinct genre, studio and producer into the dictionary
+# collection, the per-genre/studio/producer aggregation views read it instead of unwinding every document
+def build_dictionaries():
+    build_value_dictionary(db, "anime_dataset_2023", ["Genres", "Studios", "Producers"], score_field="Score")
+    build_value_dictionary(db, "final_animedataset", ["Genres"])
+
 # Function to create a view
-def create_view(view_name, source_collection, pipeline):
+def create_view(view_name, source_collection, pipeline, materialize=MATERIALIZE_VIEWS):
     try:
-        db.command({
-            "create": view_name,
-            "viewOn": source_collection,
-            "pipeline": pipeline
-        })
-        print(f"View '{view_name}' created successfully.")
+        with query_metrics.time_view(view_name, "build"):
+            if materialize:
+                # Rebuilt instead of refreshed when a modified file was reloaded into the source collection
+                status = materialize_view(db, view_name, source_collection, pipeline,
+                                          source_version=get_rewrite_version(db, source_collection))
+            else:
+                # Reruns keep the database: the view is dropped and recreated when its definition changed
+                status = apply_view(db, view_name, source_collection, pipeline)
+        print(f"View '{view_name}': {status}.")
     except pymongo.errors.PyMongoError as e:
         print(f"Error creating view '{view_name}': {str(e)}")
 
@@ -90,7 +147,7 @@ def create_filtering_views():
     create_view(
         "sci_fi_genre_anime",
         "anime_dataset_2023",
-        [{ "$match": { "Genres": "Sci-Fi" } }]
+        [{ "$match": { "Genres": "sci-fi" } }]  # Genres is a lowercase array, equality match on the multikey index
     )
 
     # 3. Filter anime with more than 50 episodes
@@ -98,18 +155,8 @@ def create_filtering_views():
         view_name="long_running_anime",
         source_collection="anime_dataset_2023",
         pipeline=[
-            { 
-                "$match": { 
-                    "Episodes": { "$regex": "^[0-9]+\\.?[0-9]*$" }  # Filter out non-floats
-                }
-            },
-            { 
-                "$match": { 
-                    "$expr": { 
-                        "$gt": [ { "$toDouble": "$Episodes" }, 50 ]  # Convert Episodes to float and filter for > 50
-                    }
-                }
-            }
+            { "$match": { "Episodes": { "$gt": 50 } } },  # Episodes is stored as a number, so this uses episodes_index
+            { "$sort": { "Episodes": -1 } }
         ]
     )
 
@@ -141,96 +188,60 @@ def create_filtering_views():
     view_name="top_rated_anime",
     source_collection="anime_dataset_2023",
     pipeline=[
-        { 
-            "$match": { 
-                "Score": { "$regex": "^[0-9]+\\.?[0-9]*$" }  # Only allow numeric score values (with optional decimals)
-            }
-        },
-        { 
-            "$match": { 
-                "$expr": { 
-                    "$gt": [ { "$toDouble": "$Score" },  9  ] 
-                } 
-            }
-        }
+        { "$match": { "Score": { "$gt": 9 } } },  # Score is stored as a number, so this uses score_index
+        { "$sort": { "Score": -1 } }
     ]
 )
 
 def create_aggregation_views():
+    # The per-genre/studio/producer views read the few hundred documents of the dictionary collection
+    # built by build_dictionaries(). It is tiny and rebuilt on every load, so these are never materialized.
+
     # 1. Average score of anime by genre
     create_view(
         view_name="avg_score_by_genre",
-        source_collection="anime_dataset_2023",
+        source_collection=DICTIONARY_COLLECTION,
         pipeline=[
-            { 
-                "$set": { 
-                    "GenresArray": { "$split": ["$Genres", ", "] }  # Split the genres string into an array
+            { "$match": { "collection": "anime_dataset_2023", "field": "Genres", "score_count": { "$gt": 0 } } },
+            {
+                "$project": {
+                    "_id": "$value",  # The genre
+                    "avg_score": { "$divide": ["$score_sum", "$score_count"] }  # Unknown scores are not counted
                 }
             },
-            { 
-                "$unwind": "$GenresArray"  # Unwind the genres array to process each genre individually
-            },
-            { 
-                "$match": { 
-                    "Score": { "$regex": "^[0-9]+\\.?[0-9]*$" }  # Filter out non-numeric scores
-                }
-            },
-            { 
-                "$group": {
-                    "_id": "$GenresArray",  # Group by individual genres
-                    "avg_score": { 
-                        "$avg": { 
-                            "$toDouble": "$Score"  # Convert Score to a number and calculate the average
-                        } 
-                    }
-                }
-            },
-            { "$sort": { "avg_score": -1 } } 
-        ]
+            { "$sort": { "avg_score": -1 } }
+        ],
+        materialize=False
     )
 
     # 2. Number of anime per genre
     create_view(
         view_name="num_anime_per_genre",
-        source_collection="final_animedataset",
+        source_collection=DICTIONARY_COLLECTION,
         pipeline=[
-            { 
-                "$set": { 
-                    "GenresArray": { "$split": ["$Genres", ", "] }  # Split the genres string into an array
-                }
-            },
-            { 
-                "$unwind": "$GenresArray"  # Unwind the genres array to process each genre individually
-            },
-            { "$group": {
-                "_id": "$GenresArray",
-                "num_anime": { "$sum": 1 }  # Count number of anime in each genre
-            }},
+            { "$match": { "collection": "final_animedataset", "field": "Genres" } },
+            { "$project": { "_id": "$value", "num_anime": "$anime_count" } },  # Number of anime in each genre
             { "$sort": { "num_anime": -1 } }
-        ]
+        ],
+        materialize=False
     )
 
     # 3. Average score per studio
     create_view(
         view_name="top_studios_by_avg_score",
-        source_collection="anime_dataset_2023",
+        source_collection=DICTIONARY_COLLECTION,
         pipeline=[
-            { 
-                "$match": { 
-                    "Score": { "$regex": "^[0-9]+\\.?[0-9]*$" }  # Ensure score is numeric
-                }
-            },
-            { 
-                "$group": {
-                    "_id": "$Studios",  # Group by studio name
-                    "avg_score": { 
-                        "$avg": { "$toDouble": "$Score" }  # Calculate average score after converting score to double
-                    }
+            { "$match": { "collection": "anime_dataset_2023", "field": "Studios", "score_count": { "$gt": 0 } } },
+            {
+                "$project": {
+                    "_id": "$value",  # The studio, every studio of a co-production is credited
+                    "avg_score": { "$divide": ["$score_sum", "$score_count"] }
                 }
             },
             { "$sort": { "avg_score": -1 } },  # Sort by average score in descending order
             { "$limit": 10 }  # Get the top 10 studios
-        ]
+        ],
+        materialize=False
     )
 
     # 4. Top 10 coutnries with most users
@@ -274,34 +285,61 @@ def create_aggregation_views():
     # 6. Top producers by anime count
     create_view(
         view_name="top_producers_by_anime_count",
-        source_collection="anime_dataset_2023",
+        source_collection=DICTIONARY_COLLECTION,
         pipeline=[
-            { 
-                "$set": { 
-                    "ProducersArray": { "$split": ["$Producers", ", "] }  # Split the producers string into an array
-                }
-            },
-            { 
-                "$unwind": "$ProducersArray"  # Unwind the producers array to process each producer individually
-            },
-            { 
-                "$group": {
-                    "_id": "$ProducersArray",  # Group by individual producers
-                    "anime_count": { "$sum": 1 }  # Count the number of anime produced by each producer
-                }
-            },
+            { "$match": { "collection": "anime_dataset_2023", "field": "Producers" } },
+            { "$project": { "_id": "$value", "anime_count": 1 } },  # Number of anime produced by each producer
             { "$sort": { "anime_count": -1 } },  # Sort by anime count in descending order
             { "$limit": 10 }  # Limit to the top 10 producers
-        ]
+        ],
+        materialize=False
     )
 
+# Indexes created by earlier versions of create_indices on fields the documents do not have
+OBSOLETE_INDEXES = {
+    "anime_dataset_2023": ["status_genres_score_index"],  # on 'Favourites', the field is 'Favorites'
+    "user_filtered": ["completed_index"],  # on 'Completed', the collection holds user_id/anime_id/rating
+    "users_score_2023": ["user_anime_score_index"]  # on 'score', same
+}
+
+def drop_obsolete_indexes():
+    for collection_name, index_names in OBSOLETE_INDEXES.items():
+        existing = db[collection_name].index_information()
+        for index_name in index_names:
+            if index_name in existing:
+                db[collection_name].drop_index(index_name)
+                print(f"Obsolete index '{index_name}' dropped from '{collection_name}'.")
+
 def create_indices():
+    drop_obsolete_indexes()
+
     # 1. Index for anime-dataset-2023.csv
     create_index(
         collection_name="anime_dataset_2023",
-        # Composite index on Status, Genres, and Score
-        index_fields=[("Genres", pymongo.ASCENDING), ("Score", pymongo.DESCENDING), ("Favourites", pymongo.DESCENDING)],
-        index_name="status_genres_score_index"
+        # Composite index on Genres, Score and Favorites
+        index_fields=[("Genres", pymongo.ASCENDING), ("Score", pymongo.DESCENDING), ("Favorites", pymongo.DESCENDING)],
+        index_name="genres_score_favorites_index"
+    )
+
+    # Score and Episodes are stored as numbers, these back the range filters and sorts of
+    # top_rated_anime and long_running_anime
+    create_index(
+        collection_name="anime_dataset_2023",
+        index_fields=[("Score", pymongo.DESCENDING)],
+        index_name="score_index"
+    )
+    create_index(
+        collection_name="anime_dataset_2023",
+        index_fields=[("Episodes", pymongo.DESCENDING)],
+        index_name="episodes_index"
+    )
+
+    # premiered_ordinal (derived from Premiered by the loader) orders the seasons chronologically,
+    # year ranges and single seasons are range scans on it
+    create_index(
+        collection_name="anime_dataset_2023",
+        index_fields=[("premiered_ordinal", pymongo.ASCENDING)],
+        index_name="premiered_ordinal_index"
     )
 
     # 2. Index for anime-filtered.csv
@@ -319,11 +357,11 @@ def create_indices():
         index_name="genres_index"
     )
 
-    # 4. Index for user-filtered.csv
+    # 4. Index for user-filtered.csv: the ratings of an anime, highest first (user_id is the natural key index)
     create_index(
         collection_name="user_filtered",
-        index_fields=[("Completed", pymongo.ASCENDING)],
-        index_name="completed_index"
+        index_fields=[("anime_id", pymongo.ASCENDING), ("rating", pymongo.DESCENDING)],
+        index_name="anime_rating_index"
     )
 
     # 5. Index for users-details-2023.csv
@@ -333,16 +371,31 @@ def create_indices():
         index_name="location_episodes_watched_index"
     )
 
-    # 6. Index for users-score-2023.csv
+    # 6. Index for users-score-2023.csv: same as user-filtered.csv
     create_index(
         collection_name="users_score_2023",
-        index_fields=[("anime_id", pymongo.ASCENDING), ("score", pymongo.DESCENDING)],
-        index_name="user_anime_score_index"
+        index_fields=[("anime_id", pymongo.ASCENDING), ("rating", pymongo.DESCENDING)],
+        index_name="anime_rating_index"
     )
 
+# Write the metrics of the run and the slow commands with their explain plan
+def report_metrics():
+    with open(METRICS_FILE, "w") as f:
+        f.write(query_metrics.render_prometheus())
+    slow_queries = query_metrics.get_slow_queries(client)
+    with open(SLOW_QUERY_FILE, "w") as f:
+        f.write(json_util.dumps(slow_queries, indent=2))
+    for entry in slow_queries:
+        print(f"Slow command '{entry['command']}' on '{entry['collection']}': {entry['duration_ms']} ms")
+    print(f"Metrics written to '{METRICS_FILE}', {len(slow_queries)} slow command(s) written to '{SLOW_QUERY_FILE}'.")
+
 # Create the datatsets, views and indices
 # To disable any of the following calls, comment out the line
-insert_datasets()
-create_filtering_views()
-create_aggregation_views()
-create_indices()
+# The guard is needed because the bulk loader's worker processes import this module
+if __name__ == "__main__":
+    insert_datasets()
+    build_dictionaries()
+    create_filtering_views()
+    create_aggregation_views()
+    create_indices()
+    report_metrics()